@@ -0,0 +1,132 @@
+import asyncio
+import logging
+import threading
+from collections import deque
+from . import config
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionRejected(Exception):
+    pass
+
+
+class Ticket:
+    def __init__(self, func_id, memory_mb, cpus, max_concurrency):
+        self.func_id = func_id
+        self.memory_mb = memory_mb
+        self.cpus = cpus
+        self.max_concurrency = max_concurrency
+        self.released = False
+
+
+class AdmissionController:
+    # Tracks the memory and CPU reserved by running invocations and per-function concurrency.
+    # Requests that do not fit wait in a bounded FIFO queue; a full queue or a wait longer than
+    # max_wait is rejected instead of over-committing the host. Tickets may be released from
+    # any thread (containers are recycled on the reaper), so state is guarded by a plain lock.
+    def __init__(self, memory_mb=None, cpus=None, max_queue=None, max_wait=None):
+        self.memory_mb = config.HOST_MEMORY_MB if memory_mb is None else memory_mb
+        self.cpus = config.HOST_CPUS if cpus is None else cpus
+        self.max_queue = config.ADMISSION_MAX_QUEUE if max_queue is None else max_queue
+        self.max_wait = config.ADMISSION_MAX_WAIT if max_wait is None else max_wait
+        self.used_memory_mb = 0
+        self.used_cpus = 0.0
+        self.running = {}  # function id -> running invocations
+        self.waiters = deque()  # (ticket, future) in arrival order
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    async def admit(self, func_data):
+        ticket = Ticket(
+            func_data.get('id'),
+            func_data.get('memory_mb') or 0,
+            func_data.get('cpus') or 0.0,
+            func_data.get('max_concurrency') or 0
+        )
+        if ticket.memory_mb > self.memory_mb or ticket.cpus > self.cpus:
+            self.rejected += 1
+            raise AdmissionRejected(f"Function needs more than the host capacity ({ticket.memory_mb} MiB, {ticket.cpus} CPUs)")
+
+        with self.lock:
+            if not self.waiters and self._fits(ticket):
+                self._reserve(ticket)
+                return ticket
+            if len(self.waiters) >= self.max_queue:
+                self.rejected += 1
+                raise AdmissionRejected("Too many invocations waiting for capacity")
+            future = asyncio.get_running_loop().create_future()
+            waiter = (ticket, future)
+            self.waiters.append(waiter)
+            # Earlier waiters keep priority, but a request that fits where they do not goes straight in
+            self._wake()
+
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=self.max_wait)
+            return ticket
+        except asyncio.TimeoutError:
+            with self.lock:
+                if waiter in self.waiters:
+                    self.waiters.remove(waiter)
+                    self.rejected += 1
+                    raise AdmissionRejected(f"No capacity became available within {self.max_wait}s")
+            # Admitted just as the wait expired
+            return ticket
+        except asyncio.CancelledError:
+            with self.lock:
+                admitted = waiter not in self.waiters
+                if not admitted:
+                    self.waiters.remove(waiter)
+            if admitted:
+                self.release(ticket)
+            raise
+
+    def release(self, ticket):
+        with self.lock:
+            if ticket.released:
+                return
+            ticket.released = True
+            self.used_memory_mb -= ticket.memory_mb
+            self.used_cpus -= ticket.cpus
+            self.running[ticket.func_id] -= 1
+            if not self.running[ticket.func_id]:
+                del self.running[ticket.func_id]
+            self._wake()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "memory_mb": {"capacity": self.memory_mb, "used": self.used_memory_mb},
+                "cpus": {"capacity": self.cpus, "used": self.used_cpus},
+                "running": sum(self.running.values()),
+                "waiting": len(self.waiters),
+                "rejected": self.rejected
+            }
+
+    def _fits(self, ticket):
+        if ticket.max_concurrency and self.running.get(ticket.func_id, 0) >= ticket.max_concurrency:
+            return False
+        return (self.used_memory_mb + ticket.memory_mb <= self.memory_mb
+                and self.used_cpus + ticket.cpus <= self.cpus)
+
+    def _reserve(self, ticket):
+        self.used_memory_mb += ticket.memory_mb
+        self.used_cpus += ticket.cpus
+        self.running[ticket.func_id] = self.running.get(ticket.func_id, 0) + 1
+
+    def _wake(self):
+        # Admit waiters in order; one blocked only by its own function's concurrency limit
+        # does not hold up the others
+        for waiter in list(self.waiters):
+            ticket, future = waiter
+            if future.done():
+                self.waiters.remove(waiter)
+            elif self._fits(ticket):
+                self.waiters.remove(waiter)
+                self._reserve(ticket)
+                future.get_loop().call_soon_threadsafe(_resolve, future)
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(True)
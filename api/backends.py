@@ -0,0 +1,172 @@
+import abc
+import logging
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+import docker
+from . import config
+from .exec_stream import ExecTimeout
+from .metrics import Histogram
+from .process_stream import ProcessStream
+from .tracing import span
+from .worker import WORKER_COMMANDS, WorkerChannel, WorkerError, uses_worker, version_hash
+
+logger = logging.getLogger(__name__)
+
+
+class ExecutionBackend(abc.ABC):
+    # Runs one admitted invocation and returns (result, response_time, errors, resources).
+    # run carries phase timings and exit_code back to the engine, plus for backends that lease
+    # containers the entry and reusable flag the engine releases afterwards.
+    name = None
+    pooled = False  # Whether the backend runs on the warm container pool
+
+    def __init__(self):
+        self.latency = Histogram()
+        self.errors = 0
+
+    @abc.abstractmethod
+    async def invoke(self, func_data, payload, data, start_time, run):
+        pass
+
+    def record(self, response_time, errors):
+        self.latency.add(response_time)
+        if errors:
+            self.errors += 1
+
+    def stats(self):
+        count = self.latency.count
+        return dict(self.latency.summary(), count=count, error_rate=self.errors / count if count else 0.0)
+
+    def shutdown(self):
+        pass
+
+
+class DockerBackend(ExecutionBackend):
+    # Containers from the warm pool under a Docker runtime: runc, runsc (gVisor) or any other
+    # runtime registered with the daemon
+    pooled = True
+
+    def __init__(self, engine, runtime):
+        super().__init__()
+        self.engine = engine
+        self.runtime = runtime
+        self.name = f"docker-{runtime}"
+
+    async def invoke(self, func_data, payload, data, start_time, run):
+        engine = self.engine
+        spec = engine.container_spec(func_data)
+        try:
+            run["entry"] = await engine._acquire(func_data, spec, start_time, run["phases"])
+        except (docker.errors.APIError, WorkerError, OSError) as e:
+            return engine._failed(e, start_time, run)
+        return await engine._invoke(run["entry"], func_data, payload, data, start_time, run)
+
+
+class LocalBackend(ExecutionBackend):
+    # Runs functions as local subprocesses with no container at all, for tests and trusted
+    # internal functions. Handler functions keep warm worker processes per code version;
+    # scripts get a fresh process. Isolation is limited to what ProcessStream provides.
+    name = "local"
+
+    def __init__(self, engine, max_workers=None, worker_dir=None):
+        super().__init__()
+        self.engine = engine
+        self.max_workers = config.LOCAL_MAX_WORKERS if max_workers is None else max_workers
+        self.worker_dir = worker_dir or config.LOCAL_WORKER_DIR
+        self.idle = OrderedDict()  # (language, code hash) -> idle WorkerChannels, least recently used first
+        self.lock = threading.Lock()
+
+    async def invoke(self, func_data, payload, data, start_time, run):
+        engine = self.engine
+        phases = run["phases"]
+        timeout = func_data['timeout']
+        try:
+            if uses_worker(func_data):
+                key = (func_data['language'], version_hash(func_data))
+                acquire_start = time.time()
+                with span("acquire"):
+                    worker = self._take(key) or await engine._run(self._spawn_worker, func_data)
+                phases["acquire"] = time.time() - acquire_start
+                exec_start = time.time()
+                with span("exec"):
+                    reply = await engine._run(worker.call, payload, timeout, config.TIMEOUT_GRACE)
+                phases["exec"] = time.time() - exec_start
+                if reply.get("timeout") and not reply.get("recoverable"):
+                    worker.close()
+                self._put(key, worker)
+                return engine._worker_result(reply, start_time, run, "local worker")
+
+            exec_start = time.time()
+            with span("exec"):
+                stream = await engine._run(self._spawn, engine._function_command(func_data), func_data)
+                try:
+                    stdout, stderr, exit_code = await engine._run(stream.communicate, data, exec_start + timeout)
+                finally:
+                    stream.close()
+            phases["exec"] = time.time() - exec_start
+            return engine._oneshot_result(stdout, stderr, exit_code, start_time, run, "local process", timeout)
+        except ExecTimeout:
+            logger.warning(f"Local function {func_data.get('id')} killed at its deadline")
+            return engine._timed_out(start_time, run)
+        except (WorkerError, OSError) as e:
+            return engine._failed(e, start_time, run)
+
+    def shutdown(self):
+        with self.lock:
+            workers = [worker for idle in self.idle.values() for worker in idle]
+            self.idle.clear()
+        for worker in workers:
+            worker.close()
+
+    def _localise(self, cmd):
+        # Worker scripts are read from the repository rather than /opt/worker
+        if cmd[0] == "python":
+            cmd = [sys.executable] + cmd[1:]
+        return [arg.replace("/opt/worker", self.worker_dir) for arg in cmd]
+
+    def _spawn(self, cmd, func_data):
+        environment = {"PATH": os.environ.get("PATH", "/usr/bin:/bin"), "LANG": "C.UTF-8",
+                       "TIMEOUT": str(func_data['timeout'])}
+        # V8 reserves far more address space than it uses, so only Python gets an RLIMIT_AS
+        memory_mb = (func_data.get('memory_mb') or 1024) if func_data['language'] == "python" else None
+        return ProcessStream(self._localise(cmd), environment=environment, memory_mb=memory_mb)
+
+    def _spawn_worker(self, func_data):
+        logger.info(f"Starting local worker for function {func_data.get('id')}")
+        stream = self._spawn(WORKER_COMMANDS[func_data['language']], func_data)
+        return WorkerChannel(None, None, func_data['language'], func_data['code'], stream=stream,
+                             load_timeout=func_data['timeout'])
+
+    def _take(self, key):
+        with self.lock:
+            idle = self.idle.get(key)
+            worker = None
+            while idle:
+                worker = idle.pop()
+                if worker.alive:
+                    break
+                worker = None
+            if idle is not None and not idle:
+                del self.idle[key]
+            elif worker is not None:
+                self.idle.move_to_end(key)
+            return worker
+
+    def _put(self, key, worker):
+        if not worker.alive:
+            return
+        evicted = []
+        with self.lock:
+            self.idle.setdefault(key, []).append(worker)
+            self.idle.move_to_end(key)
+            while sum(len(idle) for idle in self.idle.values()) > self.max_workers:
+                oldest = next(iter(self.idle))
+                if self.idle[oldest]:
+                    evicted.append(self.idle[oldest].pop(0))
+                if not self.idle[oldest]:
+                    del self.idle[oldest]
+        for worker in evicted:
+            worker.close()
@@ -0,0 +1,246 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from . import config
+from .worker import version_hash
+
+logger = logging.getLogger(__name__)
+
+
+class FunctionCache:
+    def __init__(self, max_size=None):
+        self.max_size = config.FUNCTION_CACHE_SIZE if max_size is None else max_size
+        self.by_id = OrderedDict()  # function id -> definition, least recently used first
+        self.routes = {}  # route -> function id
+        self.version = 0  # Bumped on every invalidation
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get_by_id(self, func_id):
+        with self.lock:
+            func = self.by_id.get(func_id)
+            return self._lookup(func_id, func)
+
+    def get_by_route(self, route):
+        with self.lock:
+            func_id = self.routes.get(route)
+            func = self.by_id.get(func_id) if func_id is not None else None
+            return self._lookup(func_id, func)
+
+    def put(self, func, version):
+        # version is what the caller read before querying the database; if an update or
+        # delete happened since, its result may be stale and is not cached
+        with self.lock:
+            if version != self.version:
+                return
+            self._drop(func["id"])
+            self.by_id[func["id"]] = dict(func)
+            self.routes[func["route"]] = func["id"]
+            while len(self.by_id) > self.max_size:
+                _, evicted = self.by_id.popitem(last=False)
+                self._drop_route(evicted)
+
+    def invalidate(self, func_id):
+        with self.lock:
+            self.version += 1
+            self._drop(func_id)
+
+    def clear(self):
+        with self.lock:
+            self.version += 1
+            self.by_id.clear()
+            self.routes.clear()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self.by_id),
+                "max_size": self.max_size,
+                "version": self.version,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
+
+    def _lookup(self, func_id, func):
+        if func is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.by_id.move_to_end(func_id)
+        return dict(func)
+
+    def _drop(self, func_id):
+        func = self.by_id.pop(func_id, None)
+        if func is not None:
+            self._drop_route(func)
+
+    def _drop_route(self, func):
+        if self.routes.get(func["route"]) == func["id"]:
+            del self.routes[func["route"]]
+
+
+def payload_hash(payload):
+    # Canonical JSON, so payloads that differ only in key order or whitespace share an entry
+    if isinstance(payload, bytes):
+        data = b"raw:" + payload
+    else:
+        data = b"json:" + json.dumps(payload, sort_keys=True, separators=(",", ":")).encode()
+    return hashlib.sha256(data).hexdigest()
+
+
+class ResultCache:
+    # Memoised results of functions marked cacheable, keyed by (function id, code hash,
+    # payload hash) and bounded by entry count, total result size and TTL with LRU eviction.
+    # With a directory configured entries are also written to disk and survive restarts; the
+    # files follow the same bounds, so evicted or expired entries are deleted there too.
+    def __init__(self, max_size=None, max_bytes=None, ttl=None, directory=None):
+        self.max_size = config.RESULT_CACHE_SIZE if max_size is None else max_size
+        self.max_bytes = config.RESULT_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+        self.ttl = config.RESULT_CACHE_TTL if ttl is None else ttl
+        self.directory = config.RESULT_CACHE_DIR if directory is None else directory
+        self.entries = OrderedDict()  # key -> (result, expires_at, size), least recently used first
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            self._prune_directory()
+
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[1] > now:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                self._drop(key)
+        entry = self._load(key, now)
+        with self.lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._store(key, *entry)
+            return entry[0]
+
+    def contains(self, key):
+        # Peeks at the in-memory entries without counting a lookup or touching the LRU order
+        with self.lock:
+            entry = self.entries.get(key)
+            return entry is not None and entry[1] > time.time()
+
+    def put(self, key, result):
+        expires_at = time.time() + self.ttl
+        with self.lock:
+            stored = self._store(key, result, expires_at)
+        if stored and self.directory:
+            try:
+                with open(self._path(key), "w") as f:
+                    json.dump({"result": result, "expires_at": expires_at}, f)
+            except OSError as e:
+                logger.warning(f"Failed to persist cached result: {str(e)}")
+
+    def invalidate(self, func_id):
+        with self.lock:
+            for key in [key for key in self.entries if key[0] == func_id]:
+                self._drop(key)
+        if self.directory:
+            # Files of entries that are no longer (or not yet) in memory go too
+            prefix = f"{func_id}-"
+            for name in os.listdir(self.directory):
+                if name.startswith(prefix):
+                    self._unlink(os.path.join(self.directory, name))
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self.entries),
+                "max_size": self.max_size,
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
+
+    @staticmethod
+    def key(func_data, payload):
+        return (func_data["id"], version_hash(func_data), payload_hash(payload))
+
+    def _store(self, key, result, expires_at):
+        size = len(result) if result is not None else 0
+        if size > self.max_bytes:
+            return False
+        self._drop(key, unlink=False)
+        self.entries[key] = (result, expires_at, size)
+        self.bytes += size
+        while len(self.entries) > self.max_size or self.bytes > self.max_bytes:
+            self._drop(next(iter(self.entries)))
+            self.evictions += 1
+        return True
+
+    def _drop(self, key, unlink=True):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[2]
+        if unlink and self.directory:
+            self._unlink(self._path(key))
+
+    @staticmethod
+    def _unlink(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _path(self, key):
+        return os.path.join(self.directory, "-".join(str(part) for part in key) + ".json")
+
+    def _load(self, key, now):
+        if not self.directory:
+            return None
+        try:
+            with open(self._path(key)) as f:
+                data = json.load(f)
+        except OSError:
+            return None
+        except ValueError:
+            self._unlink(self._path(key))
+            return None
+        if data.get("expires_at", 0) <= now:
+            self._unlink(self._path(key))
+            return None
+        return data["result"], data["expires_at"]
+
+    def _prune_directory(self):
+        # Files left by an earlier process are only otherwise looked at on a lookup of their
+        # key, so expired ones are cleared out at startup
+        now = time.time()
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                with open(path) as f:
+                    expires_at = json.load(f).get("expires_at", 0)
+            except OSError:
+                continue
+            except ValueError:
+                expires_at = 0
+            if expires_at <= now:
+                self._unlink(path)
+
+
+function_cache = FunctionCache()
+result_cache = ResultCache()
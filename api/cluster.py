@@ -0,0 +1,189 @@
+import json
+import logging
+import threading
+import time
+import requests
+from sqlalchemy import func, or_
+from . import config, models
+from .cache import function_cache, result_cache
+
+logger = logging.getLogger(__name__)
+
+FORWARDED_HEADER = "x-forwarded-node"
+
+
+def key_string(key):
+    # Pool keys are tuples; nodes exchange them as strings
+    return "|".join("" if part is None else str(part) for part in key)
+
+
+class Cluster:
+    # Coordinates API processes sharing one database. Each process polls the registry change
+    # log so function and result caches update everywhere within a sync interval, and
+    # heartbeats its admission capacity and warm containers into the nodes table. A dispatcher
+    # uses that table to send an invocation that would cold start here to a node that has a
+    # warm container for it.
+    def __init__(self, engine, session_factory=None, node_id=None, url=None, interval=None, node_ttl=None):
+        self.engine = engine
+        self.session_factory = session_factory or models.SessionLocal
+        self.node_id = node_id or config.NODE_ID
+        self.url = config.NODE_URL if url is None else url
+        self.interval = config.CLUSTER_SYNC_INTERVAL if interval is None else interval
+        self.node_ttl = config.NODE_TTL if node_ttl is None else node_ttl
+        self.cursor = 0  # Highest change id applied
+        self.gaps = {}  # Change ids below the cursor not seen yet -> when first missed
+        self.started_at = time.time()
+        self.peers = []  # Live nodes other than this one, as of the last sync
+        self.http = requests.Session()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        with self.session_factory() as db:
+            # Nothing is cached yet, so earlier changes are irrelevant
+            self.cursor = db.query(func.max(models.FunctionChange.id)).scalar() or 0
+        self.sync()
+        self._stop.clear()
+
+        def run():
+            while not self._stop.wait(self.interval):
+                try:
+                    self.sync()
+                except Exception as e:
+                    logger.error(f"Cluster sync failed: {str(e)}")
+
+        self._thread = threading.Thread(target=run, name="cluster-sync", daemon=True)
+        self._thread.start()
+        logger.info(f"Node {self.node_id} joined the cluster")
+
+    def shutdown(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        with self.session_factory() as db:
+            db.query(models.Node).filter(models.Node.id == self.node_id).delete(synchronize_session=False)
+            db.commit()
+        self.http.close()
+
+    def sync(self):
+        self.apply_changes()
+        self.heartbeat()
+
+    def apply_changes(self):
+        # Ids are handed out when a change is inserted but become visible when its transaction
+        # commits, so on PostgreSQL a lower id can show up after a higher one was applied. Ids
+        # skipped over are rechecked until they appear or CHANGE_GAP_TIMEOUT passes, which also
+        # covers ids that were rolled back and never will.
+        now = time.time()
+        self.gaps = {gap: at for gap, at in self.gaps.items() if at > now - config.CHANGE_GAP_TIMEOUT}
+        newer = models.FunctionChange.id > self.cursor
+        with self.session_factory() as db:
+            changes = db.query(models.FunctionChange.id, models.FunctionChange.function_id,
+                               models.FunctionChange.kind, models.FunctionChange.node).filter(
+                or_(newer, models.FunctionChange.id.in_(list(self.gaps))) if self.gaps else newer
+            ).order_by(models.FunctionChange.id).all()
+        for change_id, func_id, kind, node in changes:
+            if change_id > self.cursor:
+                self.gaps.update((gap, now) for gap in range(self.cursor + 1, change_id))
+                self.cursor = change_id
+            else:
+                self.gaps.pop(change_id, None)
+            if node == self.node_id:
+                continue
+            function_cache.invalidate(func_id)
+            result_cache.invalidate(func_id)
+            if kind == "deleted":
+                self.engine.prewarmer.forget(func_id)
+        return len(changes)
+
+    def heartbeat(self):
+        now = time.time()
+        warm = {key_string(key): count for key, count in self.engine.pool.idle_counts().items()}
+        with self.session_factory() as db:
+            node = db.get(models.Node, self.node_id)
+            if node is None:
+                node = models.Node(id=self.node_id, started_at=self.started_at)
+                db.add(node)
+            node.url = self.url
+            node.heartbeat_at = now
+            node.capacity = json.dumps(self.engine.admission.stats())
+            node.warm = json.dumps(warm)
+            # Any node may prune; the work is a single indexed delete
+            db.query(models.FunctionChange).filter(
+                models.FunctionChange.at < now - config.CHANGE_RETENTION).delete(synchronize_session=False)
+            db.query(models.Node).filter(
+                models.Node.heartbeat_at < now - self.node_ttl * 6).delete(synchronize_session=False)
+            db.commit()
+            live = db.query(models.Node).filter(models.Node.heartbeat_at >= now - self.node_ttl).all()
+            nodes = [self._node_to_dict(n) for n in live]
+        self.peers = [n for n in nodes if n["id"] != self.node_id]
+        return nodes
+
+    def nodes(self):
+        with self.session_factory() as db:
+            live = db.query(models.Node).filter(models.Node.heartbeat_at >= time.time() - self.node_ttl).all()
+            return [self._node_to_dict(n) for n in live]
+
+    def pick_node(self, func_data):
+        # A peer is only worth the extra hop when this node would cold start and the peer has
+        # a warm container for the same pool key and room to run it
+        if not config.DISPATCH_ENABLED or not self.peers or not self.engine.backend_for(func_data).pooled:
+            return None
+        key = self.engine.pool_key(func_data)
+        if self.engine.pool.idle_count(key):
+            return None
+        wanted = key_string(key)
+        memory_mb = func_data.get('memory_mb') or 1024
+        best = None
+        for node in self.peers:
+            warm = node["warm"].get(wanted, 0)
+            memory = node["capacity"].get("memory_mb", {})
+            if not node["url"] or not warm or memory.get("used", 0) + memory_mb > memory.get("capacity", 0):
+                continue
+            if best is None or warm > best["warm"].get(wanted, 0):
+                best = node
+        return best
+
+    def forward(self, node, path, query, body, headers):
+        # Blocking; the request is marked so the receiving node always runs it itself
+        response = self.http.post(
+            f"{node['url'].rstrip('/')}{path}",
+            params=query,
+            data=body,
+            headers=dict(headers, **{FORWARDED_HEADER: self.node_id}),
+            timeout=config.DISPATCH_TIMEOUT
+        )
+        return response.status_code, response.content, response.headers.get("content-type", "application/json")
+
+    def _node_to_dict(self, node):
+        return {
+            "id": node.id,
+            "url": node.url,
+            "started_at": node.started_at,
+            "heartbeat_at": node.heartbeat_at,
+            "capacity": json.loads(node.capacity or "{}"),
+            "warm": json.loads(node.warm or "{}")
+        }
+
+
+_cluster = None
+
+
+def init_cluster(engine):
+    global _cluster
+    if _cluster is None:
+        _cluster = Cluster(engine)
+        _cluster.start()
+    return _cluster
+
+
+def get_cluster():
+    return _cluster
+
+
+def shutdown_cluster():
+    global _cluster
+    if _cluster is not None:
+        _cluster.shutdown()
+        _cluster = None
@@ -0,0 +1,81 @@
+import hashlib
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from . import config, models
+
+# Dialects with INSERT ... ON CONFLICT DO NOTHING
+UPSERT_INSERTS = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
+
+
+def blob_hash(code):
+    return hashlib.sha256(code.encode()).hexdigest()
+
+
+class CodeStore:
+    # Function code keyed by the SHA-256 of its text. Identical code is stored once however
+    # many functions or versions use it, large code is compressed, and since blobs never
+    # change the in-memory copies never need invalidating.
+    def __init__(self, max_size=None, compress_min=None):
+        self.max_size = config.CODE_CACHE_SIZE if max_size is None else max_size
+        self.compress_min = config.CODE_COMPRESS_MIN if compress_min is None else compress_min
+        self.blobs = OrderedDict()  # hash -> code, least recently used first
+        self.lock = threading.Lock()
+
+    def put(self, db: Session, code: str):
+        # Added to the caller's transaction, so the blob commits with the version that uses it
+        digest = blob_hash(code)
+        with self.lock:
+            if digest in self.blobs:
+                return digest
+        if db.query(models.CodeBlob.hash).filter(models.CodeBlob.hash == digest).first() is not None:
+            self._remember(digest, code)
+        else:
+            # Only remembered once read back, as this transaction may still be rolled back
+            data = code.encode()
+            size = len(data)
+            compressed = False
+            if size >= self.compress_min:
+                packed = zlib.compress(data)
+                if len(packed) < size:
+                    data, compressed = packed, True
+            values = {"hash": digest, "size": size, "compressed": compressed, "data": data, "created_at": time.time()}
+            # Another request may be storing the same code concurrently; whichever commits second
+            # finds the blob already there, which is just as good
+            insert = UPSERT_INSERTS.get(db.get_bind().dialect.name)
+            if insert is not None:
+                db.execute(insert(models.CodeBlob).values(**values).on_conflict_do_nothing(index_elements=["hash"]))
+            else:
+                try:
+                    with db.begin_nested():
+                        db.add(models.CodeBlob(**values))
+                except IntegrityError:
+                    pass
+        return digest
+
+    def get(self, db: Session, digest: str):
+        with self.lock:
+            code = self.blobs.get(digest)
+            if code is not None:
+                self.blobs.move_to_end(digest)
+                return code
+        blob = db.get(models.CodeBlob, digest)
+        if blob is None:
+            return None
+        code = (zlib.decompress(blob.data) if blob.compressed else blob.data).decode()
+        self._remember(digest, code)
+        return code
+
+    def _remember(self, digest, code):
+        with self.lock:
+            self.blobs[digest] = code
+            self.blobs.move_to_end(digest)
+            while len(self.blobs) > self.max_size:
+                self.blobs.popitem(last=False)
+
+
+code_store = CodeStore()
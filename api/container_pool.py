@@ -1,49 +1,282 @@
 import docker
 import time
 import logging
-from docker.errors import APIError
+import threading
+from collections import defaultdict, deque
+from docker.errors import APIError, NotFound
+from . import config
+from .tracing import span
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_MEM_LIMIT = '1g'
+DEFAULT_NANO_CPUS = int(2.0 * 1e9)
+
+# Kills every process spawned after the container was warmed (pids >= $BASE) except
+# this shell, then wipes scratch space so the next invocation starts from a clean slate.
+SANITISE_SCRIPT = (
+    'for d in /proc/[0-9]*; do p=${d#/proc/}; '
+    '[ "$p" -ge "$BASE" ] && [ "$p" -ne "$$" ] && kill -9 "$p" 2>/dev/null; done; '
+    'for d in /tmp /var/tmp /dev/shm; do rm -rf "$d"/* "$d"/.[!.]* 2>/dev/null; done; true'
+)
+
+
+class PooledContainer:
+    def __init__(self, container, key, base_pid):
+        self.container = container
+        self.key = key
+        self.base_pid = base_pid
+        self.created_at = time.time()
+        self.last_used = self.created_at
+        self.uses = 0
+        self.worker = None  # Persistent function worker, set when the container is pinned
+        self.code_path = None  # Script copied into the container, set on first use
+        self.baseline = None  # Resource counters at the start of the next invocation
+
+    @property
+    def id(self):
+        return self.container.id
+
+
 class ContainerPool:
-    def __init__(self, client):
+    def __init__(self, client, min_idle=None, max_idle=None, idle_ttl=None, max_uses=None, sampler=None):
         self.client = client
-        self.pool = []
-        
-    def acquire(self, image, timeout, runtime='runc', code=None, language='python', max_retries=2):
-        logger.info(f"Preparing container with image={image}, runtime={runtime}, language={language}")
-        
+        self.sampler = sampler
+        self.min_idle = config.POOL_MIN_IDLE if min_idle is None else min_idle
+        self.max_idle = config.POOL_MAX_IDLE if max_idle is None else max_idle
+        self.idle_ttl = config.POOL_IDLE_TTL if idle_ttl is None else idle_ttl
+        self.max_uses = config.POOL_MAX_USES if max_uses is None else max_uses
+        self.idle = defaultdict(deque)  # key -> deque of PooledContainer, most recently used on the right
+        self.busy = {}  # container id -> PooledContainer
+        self.limits = {}  # key -> (min_idle, max_idle) overrides
+        self.warmups = {}  # key -> callable run on freshly pre-warmed containers
+        self.lock = threading.Lock()
+        self._stop = threading.Event()
+        self._maintenance = None
+
+    @staticmethod
+    def make_key(image, runtime='runc', mem_limit=DEFAULT_MEM_LIMIT, nano_cpus=DEFAULT_NANO_CPUS, pin=None):
+        # pin identifies the function version a container is dedicated to
+        return (image, runtime, mem_limit, nano_cpus, pin)
+
+    def configure(self, key, min_idle=None, max_idle=None, warmup=None):
+        current_min, current_max = self._limits(key)
+        self.limits[key] = (
+            current_min if min_idle is None else min_idle,
+            current_max if max_idle is None else max_idle,
+        )
+        if warmup is not None:
+            self.warmups[key] = warmup
+
+    def _limits(self, key):
+        return self.limits.get(key, (self.min_idle, self.max_idle))
+
+    def acquire(self, image, timeout, runtime='runc', code=None, language='python', max_retries=2,
+                mem_limit=DEFAULT_MEM_LIMIT, nano_cpus=DEFAULT_NANO_CPUS, pin=None):
+        key = self.make_key(image, runtime, mem_limit, nano_cpus, pin)
+        while True:
+            with self.lock:
+                entry = self.idle[key].pop() if self.idle[key] else None
+            if entry is None:
+                break
+            if self._healthy(entry):
+                logger.info(f"Reusing warm container {entry.id} for key={key}")
+                with self.lock:
+                    self.busy[entry.id] = entry
+                return entry
+            self._destroy(entry)
+
+        logger.info(f"No warm container for key={key}, cold starting")
+        entry = self._create(key, max_retries)
+        with self.lock:
+            self.busy[entry.id] = entry
+        return entry
+
+    def release(self, entry, reusable=True):
+        with self.lock:
+            self.busy.pop(entry.id, None)
+        entry.uses += 1
+        entry.last_used = time.time()
+
+        if reusable and entry.uses < self.max_uses and self._sanitise(entry):
+            if self.sampler is not None:
+                entry.baseline = self.sampler.sample(entry.container)
+            _, max_idle = self._limits(entry.key)
+            with self.lock:
+                if len(self.idle[entry.key]) < max_idle:
+                    self.idle[entry.key].append(entry)
+                    logger.info(f"Returned container {entry.id} to pool for key={entry.key}")
+                    return
+        self._destroy(entry)
+
+    def pin(self, entry, worker):
+        entry.worker = worker
+        # The worker must survive sanitising, so only processes newer than it are killed
+        entry.base_pid = self._probe_pid(entry.container)
+
+    def prewarm(self, key, count):
+        started = 0
+        while self.idle_count(key) < count:
+            entry = self._create(key, max_retries=0)
+            warmup = self.warmups.get(key)
+            if warmup is not None:
+                try:
+                    warmup(entry)
+                except Exception:
+                    self._destroy(entry)
+                    raise
+            with self.lock:
+                self.idle[key].append(entry)
+            started += 1
+        return started
+
+    def drain(self, key):
+        # Drops every idle container for key and forgets its overrides (scale to zero)
+        with self.lock:
+            entries = list(self.idle.pop(key, ()))
+            self.limits.pop(key, None)
+            self.warmups.pop(key, None)
+        for entry in entries:
+            self._destroy(entry)
+        return len(entries)
+
+    def idle_count(self, key):
+        with self.lock:
+            return len(self.idle[key])
+
+    def idle_counts(self):
+        with self.lock:
+            return {key: len(entries) for key, entries in self.idle.items() if entries}
+
+    def evict_idle(self):
+        now = time.time()
+        expired = []
+        with self.lock:
+            for key, entries in self.idle.items():
+                min_idle, _ = self._limits(key)
+                # Oldest entries sit on the left; keep at least min_idle of the freshest ones
+                while len(entries) > min_idle and now - entries[0].last_used > self.idle_ttl:
+                    expired.append(entries.popleft())
+        for entry in expired:
+            logger.info(f"Evicting idle container {entry.id} for key={entry.key}")
+            self._destroy(entry)
+        return len(expired)
+
+    def replenish(self):
+        with self.lock:
+            keys = set(self.idle) | set(self.limits)
+        for key in keys:
+            min_idle, _ = self._limits(key)
+            if min_idle:
+                try:
+                    self.prewarm(key, min_idle)
+                except Exception as e:
+                    logger.error(f"Failed to pre-warm container for key={key}: {str(e)}")
+
+    def start(self, interval=None):
+        interval = config.POOL_MAINTENANCE_INTERVAL if interval is None else interval
+        if self._maintenance is not None:
+            return
+        self._stop.clear()
+
+        def run():
+            while not self._stop.wait(interval):
+                self.evict_idle()
+                self.replenish()
+
+        self._maintenance = threading.Thread(target=run, name="container-pool-maintenance", daemon=True)
+        self._maintenance.start()
+
+    def shutdown(self):
+        self._stop.set()
+        if self._maintenance is not None:
+            self._maintenance.join(timeout=5)
+            self._maintenance = None
+        with self.lock:
+            entries = [entry for entries in self.idle.values() for entry in entries]
+            entries.extend(self.busy.values())
+            self.idle.clear()
+            self.busy.clear()
+        for entry in entries:
+            self._destroy(entry)
+
+    def _create(self, key, max_retries):
+        image, runtime, mem_limit, nano_cpus, _ = key
         for attempt in range(max_retries + 1):
             logger.info(f"Attempt {attempt + 1}/{max_retries + 1}: Creating container with image={image}, runtime={runtime}")
+            container = None
             try:
                 # Use a non-exiting command to keep the container running
                 command = ["tail", "-f", "/dev/null"]
-                container = self.client.containers.create(
-                    image,
-                    command=command,
-                    detach=True,
-                    mem_limit='1g',
-                    nano_cpus=int(2.0 * 1e9),
-                    runtime=runtime,
-                    init=True,
-                    stdin_open=True,
-                    user="nobody"
-                )
-                container.start()
+                with span("container_create"):
+                    container = self.client.containers.create(
+                        image,
+                        command=command,
+                        detach=True,
+                        mem_limit=mem_limit,
+                        nano_cpus=nano_cpus,
+                        runtime=runtime,
+                        init=True,
+                        stdin_open=True,
+                        user="nobody"
+                    )
+                with span("container_start"):
+                    container.start()
+                    # Everything running now belongs to the container itself; anything with a
+                    # higher pid was spawned by an invocation and is fair game for sanitising.
+                    base_pid = self._probe_pid(container)
                 logger.info(f"Started container {container.id}")
-                self.pool.append(container)
-                return container
-            except APIError as e:
+                entry = PooledContainer(container, key, base_pid)
+                if self.sampler is not None:
+                    # Cold starts are on the request path, so only the cheap cgroup read is allowed
+                    entry.baseline = self.sampler.sample(container, allow_api=False)
+                return entry
+            except (APIError, ValueError) as e:
                 logger.error(f"Failed to create/start container: {str(e)}")
+                if container is not None:
+                    self._remove(container)
                 if attempt == max_retries:
                     raise
                 time.sleep(1)
-        
-    def release(self, container):
+
+    def _probe_pid(self, container):
+        probe = container.exec_run(["/bin/sh", "-c", "echo $$"], user="nobody")
+        return int(probe.output.decode().strip())
+
+    def _healthy(self, entry):
+        if entry.worker is not None and not entry.worker.alive:
+            return False
+        try:
+            entry.container.reload()
+        except APIError as e:
+            logger.warning(f"Health check failed for container {entry.id}: {str(e)}")
+            return False
+        return entry.container.status == 'running'
+
+    def _sanitise(self, entry):
+        try:
+            result = entry.container.exec_run(
+                ["/bin/sh", "-c", SANITISE_SCRIPT],
+                user="nobody",
+                environment={"BASE": str(entry.base_pid)}
+            )
+        except APIError as e:
+            logger.warning(f"Failed to sanitise container {entry.id}: {str(e)}")
+            return False
+        return result.exit_code == 0
+
+    def _destroy(self, entry):
+        logger.info(f"Removing container {entry.id}")
+        if entry.worker is not None:
+            entry.worker.close()
+        if self.sampler is not None:
+            self.sampler.forget(entry.id)
+        self._remove(entry.container)
+
+    def _remove(self, container):
         try:
-            logger.info(f"Stopping container {container.id}")
-            container.stop(timeout=15)
-            container.remove()
-            self.pool.remove(container)
+            container.remove(force=True)
+        except NotFound:
+            pass
         except APIError as e:
-            logger.error(f"Failed to release container {container.id}: {str(e)}")
\ No newline at end of file
+            logger.error(f"Failed to remove container {container.id}: {str(e)}")
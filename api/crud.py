@@ -1,101 +1,253 @@
+from sqlalchemy import func as sql_func
 from sqlalchemy.orm import Session
-from . import models
+from . import config, models
+from .cache import function_cache, result_cache
+from .code_store import code_store
+from .tracing import span
+import json
+import time
 import uuid
 
+DEFAULT_MEMORY_MB = 1024
+DEFAULT_CPUS = 2.0
+DEFAULT_MAX_CONCURRENCY = 10
+
+# Columns of a function definition. The code itself lives in the code store under code_hash
+# and is only loaded to run or edit one function; listings also leave out the dependency manifest.
+FUNCTION_COLUMNS = ("id", "name", "language", "code_hash", "version", "timeout", "route", "runtime", "memory_mb",
+                    "cpus", "max_concurrency", "cacheable", "dependencies", "image", "entrypoint")
+LISTING_COLUMNS = tuple(c for c in FUNCTION_COLUMNS if c != "dependencies")
+VERSION_COLUMNS = ("version", "code_hash", "dependencies", "image", "entrypoint", "created_at")
+
+def _columns(names):
+    return [getattr(models.Function, name) for name in names]
+
+def _to_dict(row, names=FUNCTION_COLUMNS):
+    # Accepts ORM objects and projected rows alike
+    result = {name: getattr(row, name) for name in names}
+    result["cacheable"] = bool(result["cacheable"])
+    return result
+
+def _function(db: Session, row):
+    result = _to_dict(row)
+    result["code"] = code_store.get(db, row.code_hash)
+    return result
+
+def _add_version(db: Session, db_func, version: int):
+    db.add(models.FunctionVersion(
+        function_id=db_func.id,
+        version=version,
+        code_hash=db_func.code_hash,
+        dependencies=db_func.dependencies,
+        image=db_func.image,
+        entrypoint=db_func.entrypoint,
+        created_at=time.time()
+    ))
+
+def _new_unique_id(db: Session):
+    while True:
+        unique_id = str(uuid.uuid4())[:8]
+        if not db.query(models.Function.id).filter(models.Function.unique_id == unique_id).first():
+            return unique_id
+
+def _record_change(db: Session, func_id: int, kind: str):
+    # Committed with the write itself, so other processes never see one without the other
+    db.add(models.FunctionChange(function_id=func_id, kind=kind, node=config.NODE_ID, at=time.time()))
+
 def create_function(db: Session, func: dict):
-    unique_id = str(uuid.uuid4())[:8]
+    unique_id = _new_unique_id(db)
     route = f"/fn/{unique_id}/{func.get('route', 'default')}"
     db_func = models.Function(
+        unique_id=unique_id,
         name=func['name'],
         language=func['language'],
-        code=func['code'],
+        code_hash=code_store.put(db, func['code']),
+        version=1,
         timeout=func['timeout'],
         route=route,
-        runtime=func.get('runtime', 'runc')  # Add runtime
+        runtime=func.get('runtime', 'runc'),  # Add runtime
+        memory_mb=int(func.get('memory_mb', DEFAULT_MEMORY_MB)),
+        cpus=float(func.get('cpus', DEFAULT_CPUS)),
+        max_concurrency=int(func.get('max_concurrency', DEFAULT_MAX_CONCURRENCY)),
+        cacheable=bool(func.get('cacheable', False)),
+        dependencies=func.get('dependencies'),
+        image=func.get('image'),
+        entrypoint=func.get('entrypoint') or "script"
     )
     db.add(db_func)
+    db.flush()
+    _add_version(db, db_func, 1)
+    _record_change(db, db_func.id, "created")
     db.commit()
     db.refresh(db_func)
-    return {
-        "id": db_func.id,
-        "name": db_func.name,
-        "language": db_func.language,
-        "code": db_func.code,
-        "timeout": db_func.timeout,
-        "route": db_func.route,
-        "runtime": db_func.runtime
-    }
+    result = _function(db, db_func)
+    # Prime the cache so the new route is served from memory right away
+    function_cache.put(result, function_cache.version)
+    return result
 
-def get_functions(db: Session):
-    funcs = db.query(models.Function).all()
-    return [
-        {
-            "id": f.id,
-            "name": f.name,
-            "language": f.language,
-            "code": f.code,
-            "timeout": f.timeout,
-            "route": f.route,
-            "runtime": f.runtime
-        } for f in funcs
-    ]
+def get_functions(db: Session, after: int = None, limit: int = None):
+    # Keyset pagination: pass the last id of one page as `after` to get the next
+    query = db.query(*_columns(LISTING_COLUMNS)).order_by(models.Function.id)
+    if after is not None:
+        query = query.filter(models.Function.id > after)
+    if limit is not None:
+        query = query.limit(limit)
+    return [_to_dict(row, LISTING_COLUMNS) for row in query]
 
 def get_function_by_id(db: Session, func_id: int):
-    func = db.query(models.Function).filter(models.Function.id == func_id).first()
+    cached = function_cache.get_by_id(func_id)
+    if cached:
+        return cached
+    version = function_cache.version
+    with span("db_query"):
+        func = db.query(*_columns(FUNCTION_COLUMNS)).filter(models.Function.id == func_id).first()
     if func:
-        return {
-            "id": func.id,
-            "name": func.name,
-            "language": func.language,
-            "code": func.code,
-            "timeout": func.timeout,
-            "route": func.route,
-            "runtime": func.runtime
-        }
+        result = _function(db, func)
+        function_cache.put(result, version)
+        return result
     return None
 
 def get_function_by_route(db: Session, route: str):
-    func = db.query(models.Function).filter(models.Function.route == route).first()
+    cached = function_cache.get_by_route(route)
+    if cached:
+        return cached
+    version = function_cache.version
+    with span("db_query"):
+        func = db.query(*_columns(FUNCTION_COLUMNS)).filter(models.Function.route == route).first()
     if func:
-        return {
-            "id": func.id,
-            "name": func.name,
-            "language": func.language,
-            "code": func.code,
-            "timeout": func.timeout,
-            "route": func.route,
-            "runtime": func.runtime
-        }
+        result = _function(db, func)
+        function_cache.put(result, version)
+        return result
     return None
 
+def get_function_versions(db: Session, func_id: int):
+    if not db.query(models.Function.id).filter(models.Function.id == func_id).first():
+        return None
+    rows = db.query(*[getattr(models.FunctionVersion, name) for name in VERSION_COLUMNS]).filter(
+        models.FunctionVersion.function_id == func_id).order_by(models.FunctionVersion.version.desc())
+    return [{name: getattr(row, name) for name in VERSION_COLUMNS} for row in rows]
+
+def get_function_version(db: Session, func_id: int, version: int):
+    # The function as it was at that version, e.g. to invoke it pinned without activating it
+    func = get_function_by_id(db, func_id)
+    if not func:
+        return None
+    if func["version"] == version:
+        return func
+    row = db.query(models.FunctionVersion).filter(models.FunctionVersion.function_id == func_id,
+                                                  models.FunctionVersion.version == version).first()
+    if not row:
+        return None
+    return dict(func, version=version, code_hash=row.code_hash, code=code_store.get(db, row.code_hash),
+                dependencies=row.dependencies, image=row.image, entrypoint=row.entrypoint or "script", pinned=True)
+
+def activate_version(db: Session, func_id: int, version: int):
+    # Rollback (or forward) to a stored version. Its code and image already exist, and
+    # containers pinned to it may still be warm, so this is a metadata change only.
+    db_func = db.query(models.Function).filter(models.Function.id == func_id).first()
+    row = db.query(models.FunctionVersion).filter(models.FunctionVersion.function_id == func_id,
+                                                  models.FunctionVersion.version == version).first()
+    if not db_func or not row:
+        return None
+    db_func.version = row.version
+    db_func.code_hash = row.code_hash
+    db_func.dependencies = row.dependencies
+    db_func.image = row.image
+    db_func.entrypoint = row.entrypoint or "script"
+    _record_change(db, func_id, "updated")
+    db.commit()
+    function_cache.invalidate(func_id)
+    result_cache.invalidate(func_id)
+    db.refresh(db_func)
+    result = _function(db, db_func)
+    function_cache.put(result, function_cache.version)
+    return result
+
 def update_function(db: Session, func_id: int, func: dict):
     db_func = db.query(models.Function).filter(models.Function.id == func_id).first()
     if not db_func:
         return None
-    unique_id = db_func.route.split('/')[2]
+    # Functions created before the unique_id column have it backfilled from their route
+    unique_id = db_func.unique_id or db_func.route.split('/')[2]
     route = f"/fn/{unique_id}/{func.get('route', 'default')}"
+    db_func.unique_id = unique_id
     db_func.name = func['name']
     db_func.language = func['language']
-    db_func.code = func['code']
+    current = (db_func.code_hash, db_func.dependencies, db_func.image, db_func.entrypoint)
+    db_func.code_hash = code_store.put(db, func['code'])
     db_func.timeout = func['timeout']
     db_func.route = route
     db_func.runtime = func.get('runtime', 'runc')  # Add runtime
+    db_func.memory_mb = int(func.get('memory_mb', db_func.memory_mb or DEFAULT_MEMORY_MB))
+    db_func.cpus = float(func.get('cpus', db_func.cpus or DEFAULT_CPUS))
+    db_func.max_concurrency = int(func.get('max_concurrency', db_func.max_concurrency or DEFAULT_MAX_CONCURRENCY))
+    db_func.cacheable = bool(func.get('cacheable', db_func.cacheable))
+    db_func.dependencies = func.get('dependencies')
+    db_func.image = func.get('image')
+    db_func.entrypoint = func.get('entrypoint') or db_func.entrypoint or "script"
+    if (db_func.code_hash, db_func.dependencies, db_func.image, db_func.entrypoint) != current:
+        # New code, dependencies or entrypoint become a new immutable version; numbering continues past
+        # versions that were rolled back from
+        latest = db.query(sql_func.max(models.FunctionVersion.version)).filter(
+            models.FunctionVersion.function_id == func_id).scalar() or 0
+        db_func.version = latest + 1
+        _add_version(db, db_func, db_func.version)
+    _record_change(db, func_id, "updated")
     db.commit()
+    function_cache.invalidate(func_id)
+    # Results of the previous definition must never be served for the new one
+    result_cache.invalidate(func_id)
     db.refresh(db_func)
-    return {
-        "id": db_func.id,
-        "name": db_func.name,
-        "language": db_func.language,
-        "code": db_func.code,
-        "timeout": db_func.timeout,
-        "route": db_func.route,
-        "runtime": db_func.runtime
-    }
+    result = _function(db, db_func)
+    function_cache.put(result, function_cache.version)
+    return result
 
 def delete_function(db: Session, func_id: int):
     db_func = db.query(models.Function).filter(models.Function.id == func_id).first()
     if not db_func:
         return None
     db.delete(db_func)
+    # Blobs stay: other functions or versions may share them
+    db.query(models.FunctionVersion).filter(models.FunctionVersion.function_id == func_id).delete(
+        synchronize_session=False)
+    _record_change(db, func_id, "deleted")
     db.commit()
-    return {"status": "success"}
\ No newline at end of file
+    function_cache.invalidate(func_id)
+    result_cache.invalidate(func_id)
+    return {"status": "success"}
+
+def _job_to_dict(job):
+    return {
+        "id": job.id,
+        "function_id": job.function_id,
+        "status": job.status,
+        "result": job.result,
+        "error": job.error,
+        "attempts": job.attempts,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at
+    }
+
+def create_job(db: Session, func_id: int, payload, max_attempts: int, callback_url: str = None):
+    now = time.time()
+    raw = isinstance(payload, bytes)
+    db_job = models.Job(
+        id=str(uuid.uuid4()),
+        function_id=func_id,
+        status="queued",
+        payload=payload if raw else json.dumps(payload).encode(),
+        payload_type="raw" if raw else "json",
+        attempts=0,
+        max_attempts=max_attempts,
+        callback_url=callback_url,
+        created_at=now,
+        run_at=now
+    )
+    db.add(db_job)
+    db.commit()
+    return _job_to_dict(db_job)
+
+def get_job(db: Session, job_id: str):
+    job = db.query(models.Job).filter(models.Job.id == job_id).first()
+    return _job_to_dict(job) if job else None
@@ -0,0 +1,128 @@
+import abc
+import socket
+import struct
+import threading
+import time
+
+STDOUT = 1
+STDERR = 2
+
+
+class ExecTimeout(Exception):
+    pass
+
+
+# A running process with stdin attached whose output is read back as (stream, data) frames
+class Stream(abc.ABC):
+    @abc.abstractmethod
+    def send(self, data):
+        pass
+
+    @abc.abstractmethod
+    def close_stdin(self):
+        pass
+
+    @abc.abstractmethod
+    def read_frame(self, deadline=None):
+        pass
+
+    @abc.abstractmethod
+    def exit_code(self):
+        pass
+
+    def feed(self, data):
+        # Feed stdin from a separate thread so a function that writes a lot before it has
+        # consumed its input cannot deadlock against us
+        writer = threading.Thread(target=self._write_all, args=(data,), daemon=True)
+        writer.start()
+        return writer
+
+    def communicate(self, data, deadline=None):
+        writer = self.feed(data)
+        stdout, stderr = bytearray(), bytearray()
+        while True:
+            stream, chunk = self.read_frame(deadline)
+            if stream is None:
+                break
+            (stdout if stream == STDOUT else stderr).extend(chunk)
+        writer.join()
+        return bytes(stdout), bytes(stderr), self.exit_code()
+
+    def _write_all(self, data):
+        try:
+            if data:
+                self.send(data)
+            self.close_stdin()
+        except (OSError, ValueError):
+            # The process exited without reading all of its input
+            pass
+
+
+# A docker exec with stdin attached, read back as demultiplexed stdout/stderr frames
+class ExecStream(Stream):
+    def __init__(self, client, container, cmd, user="nobody", environment=None):
+        self.client = client
+        self.exec_id = client.api.exec_create(
+            container.id,
+            cmd,
+            stdin=True,
+            stdout=True,
+            stderr=True,
+            user=user,
+            environment=environment
+        )['Id']
+        self.sock = client.api.exec_start(self.exec_id, socket=True)
+        # docker-py hands back a SocketIO wrapper; the raw socket supports half-close and timeouts
+        self.raw = getattr(self.sock, '_sock', self.sock)
+        self._buffer = bytearray()
+        self.closed = False
+
+    def send(self, data):
+        self.raw.sendall(data)
+
+    def close_stdin(self):
+        self.raw.shutdown(socket.SHUT_WR)
+
+    def read_frame(self, deadline=None):
+        # Returns (stream, data), or (None, b"") once the exec has finished
+        header = self._read_exactly(8, deadline)
+        if header is None:
+            return None, b""
+        stream, size = struct.unpack('>BxxxL', header)
+        data = self._read_exactly(size, deadline) if size else b""
+        if data is None:
+            return None, b""
+        return stream, data
+
+    def exit_code(self):
+        return self.client.api.exec_inspect(self.exec_id)['ExitCode']
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self.sock.close()
+            self.raw.close()
+        except OSError:
+            pass
+
+    def _read_exactly(self, n, deadline):
+        while len(self._buffer) < n:
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise ExecTimeout()
+                self.raw.settimeout(remaining)
+            else:
+                self.raw.settimeout(None)
+            try:
+                chunk = self.raw.recv(max(n - len(self._buffer), 65536))
+            except socket.timeout:
+                raise ExecTimeout()
+            if not chunk:
+                return None
+            self._buffer.extend(chunk)
+        data = bytes(self._buffer[:n])
+        del self._buffer[:n]
+        return data
@@ -3,85 +3,664 @@ import json
 import time
 import logging
 import asyncio
-import shlex
+import io
+import tarfile
+import contextvars
+import itertools
+import math
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from . import config
+from .admission import AdmissionController, AdmissionRejected
+from .backends import DockerBackend, LocalBackend
+from .cache import result_cache
 from .container_pool import ContainerPool
+from .images import ImageBuilder, base_image, normalise_dependencies
+from .metrics import metrics
+from .prewarm import PrewarmScheduler
+from .resources import ResourceSampler
+from .tracing import add_span, span
+from .exec_stream import ExecStream, ExecTimeout, STDOUT
+from .worker import ENTRYPOINTS, MAX_STDERR_BYTES, WorkerChannel, WorkerError, uses_worker, version_hash
 
 logger = logging.getLogger(__name__)
 
-async def execute_function(func_data, payload):
-    client = docker.from_env()
-    pool = ContainerPool(client)
-    
-    image = "func-python:latest" if func_data['language'] == "python" else "func-js:latest"
-    container = None
-    start_time = time.time()
-    errors = None
-    resources = {"cpu": "2.0 cores", "memory": "1Gi"}
-    
-    try:
-        runtime = func_data.get('runtime', 'runc')
-        logger.info(f"Acquiring container for image={image}, runtime={runtime}")
-        container = pool.acquire(
-            image,
-            func_data['timeout'],
-            runtime=runtime,
-            code=func_data['code'],
-            language=func_data['language']
+TIMEOUT_ERROR = "Execution timed out"
+KILLED_ERROR = "Killed (exit status 137), possibly out of memory"
+# Scripts are copied here once per container; root-owned and read-only to the function
+CODE_DIR = "/opt/code"
+CODE_EXTENSIONS = {"python": "py", "javascript": "js"}
+
+def exit_error(exit_code, elapsed, timeout):
+    # coreutils timeout exits 124 at the deadline, or 137 with -s KILL. 137 is also what any
+    # SIGKILL gives, the OOM killer's included, so it only means a timeout once the deadline passed.
+    if exit_code == 124 or (exit_code == 137 and elapsed >= timeout):
+        return TIMEOUT_ERROR
+    if exit_code == 137:
+        return KILLED_ERROR
+    return None
+
+# Per-function limits: (name, whole numbers only); all must be positive
+RESOURCE_LIMITS = (("memory_mb", True), ("cpus", False), ("max_concurrency", True))
+
+def resource_limits(func):
+    # The limits feed admission accounting directly, so a negative memory size or zero
+    # concurrency would let other functions over-commit the host
+    limits = {}
+    for name, whole in RESOURCE_LIMITS:
+        value = func.get(name)
+        if value is None:
+            continue
+        try:
+            number = float(value)
+        except (TypeError, ValueError):
+            number = math.nan
+        if isinstance(value, bool) or not math.isfinite(number) or number <= 0 or (whole and not number.is_integer()):
+            raise ValueError(f"{name} must be a positive {'integer' if whole else 'number'}")
+        limits[name] = int(number) if whole else number
+    return limits
+
+class PayloadTooLarge(ValueError):
+    pass
+
+class InvalidPayload(ValueError):
+    pass
+
+def encode_payload(payload):
+    # Raw bodies are passed through untouched; anything else is delivered as JSON
+    data = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+    if len(data) > config.MAX_PAYLOAD_BYTES:
+        raise PayloadTooLarge(f"Payload of {len(data)} bytes exceeds the {config.MAX_PAYLOAD_BYTES} byte limit")
+    return data
+
+class ExecutionEngine:
+    def __init__(self, client=None, pool=None):
+        # One client for the whole process: its connection pool is sized for concurrent
+        # invocations so requests reuse sockets to the daemon instead of reconnecting.
+        self.client = client or docker.from_env(
+            max_pool_size=config.DOCKER_MAX_POOL_SIZE,
+            timeout=config.DOCKER_TIMEOUT
         )
-        
-        container.reload()
-        if container.status != 'running':
-            logs = container.logs().decode() if container.logs() else "No logs available"
-            raise docker.errors.APIError(f"Container {container.id} is not running, status: {container.status}, logs: {logs}")
-        
-        # Prepare command and payload
-        code = func_data['code']
-        input_data = json.dumps(payload)
-        input_data_escaped = shlex.quote(input_data)
-        if func_data['language'] == "python":
-            cmd = ["python", "-c", code]
-        else:
-            cmd = ["node", "-e", code]
-        exec_cmd = f"echo {input_data_escaped} | {' '.join([shlex.quote(c) for c in cmd])}"
-        logger.info(f"Executing command: {exec_cmd}")
-        
-        async def run_exec():
-            loop = asyncio.get_event_loop()
-            return await loop.run_in_executor(
-                None,
-                lambda: container.exec_run(
-                    ["/bin/sh", "-c", exec_cmd],
-                    stdout=True,
-                    stderr=True,
-                    user="nobody",
-                    environment={"TIMEOUT": str(func_data['timeout'])}
+        self.sampler = ResourceSampler(self.client)
+        self.pool = pool or ContainerPool(self.client, sampler=self.sampler)
+        self.admission = AdmissionController()
+        self.prewarmer = PrewarmScheduler(self)
+        self.images = ImageBuilder(self.client)
+        # A function's runtime picks its backend: "local" runs it as a subprocess, anything
+        # else is the Docker runtime its containers are created with. Without a container there
+        # is no isolation, so "local" only exists when enabled; otherwise a function stored with
+        # it goes to Docker, which refuses the unknown runtime.
+        self.backends = {"local": LocalBackend(self)} if config.LOCAL_BACKEND_ENABLED else {}
+        # Every blocking Docker call runs on a bounded pool dedicated to it, never on the event
+        # loop; releases run on a separate one so slow teardown never delays new acquires.
+        self.executor = ThreadPoolExecutor(max_workers=config.DOCKER_THREADS, thread_name_prefix="docker")
+        self.reaper = ThreadPoolExecutor(max_workers=config.REAPER_THREADS, thread_name_prefix="container-reaper")
+        self._pending = set()
+        self._pending_lock = threading.Lock()
+
+    def start(self):
+        self.pool.start()
+        self.prewarmer.start()
+        logger.info("Execution engine started")
+
+    def shutdown(self):
+        self.prewarmer.shutdown()
+        self.flush()
+        for backend in self.backends.values():
+            backend.shutdown()
+        self.reaper.shutdown(wait=True)
+        self.executor.shutdown(wait=False)
+        self.pool.shutdown()
+        self.client.close()
+        logger.info("Execution engine stopped")
+
+    def flush(self):
+        # Wait for background releases, e.g. before shutdown or between test steps
+        with self._pending_lock:
+            pending = list(self._pending)
+        for future in pending:
+            future.result()
+
+    async def _run(self, fn, *args, **kwargs):
+        # The caller's context goes along so spans opened on the Docker thread join its trace
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(self.executor, partial(context.run, fn, *args, **kwargs))
+
+    def backend_for(self, func_data):
+        runtime = func_data.get('runtime') or 'runc'
+        backend = self.backends.get(runtime)
+        if backend is None:
+            backend = self.backends.setdefault(runtime, DockerBackend(self, runtime))
+        return backend
+
+    def backend_stats(self):
+        return {backend.name: backend.stats() for backend in list(self.backends.values())}
+
+    def schedule_prewarm(self, func_data):
+        # Called on deploy; warming happens on a Docker thread so the API responds immediately
+        if not self.backend_for(func_data).pooled:
+            return None
+        future = self.executor.submit(self.prewarmer.prewarm, func_data)
+        future.add_done_callback(
+            lambda f: f.exception() and logger.error(f"Pre-warm failed for function {func_data['id']}: {f.exception()}"))
+        return future
+
+    def _recycle(self, entry, reusable, record, ticket):
+        try:
+            release_start = time.time()
+            after = self.sampler.sample(entry.container, allow_api=False)
+            if after is None:
+                # No cgroup access, so sampling goes through docker stats, which takes a second or
+                # two here and again for the pool's new baseline. The invocation itself is over, so
+                # its capacity is handed back first rather than held for that long.
+                if ticket is not None:
+                    self.admission.release(ticket)
+                if record is not None:
+                    after = self.sampler.sample(entry.container)
+            if record is not None:
+                metrics.attach_resources(record, self.sampler.usage(entry.baseline, after))
+            self.pool.release(entry, reusable)
+            add_span("release", release_start, time.time() - release_start)
+            if record is not None:
+                metrics.attach_phase(record, "release", time.time() - release_start)
+        finally:
+            # Otherwise capacity is only handed back once the container is no longer busy
+            if ticket is not None:
+                self.admission.release(ticket)
+
+    def _release_later(self, entry, reusable, record=None, ticket=None):
+        # Resource sampling, sanitising and recycling happen after the caller has its response
+        future = self.reaper.submit(contextvars.copy_context().run, self._recycle, entry, reusable, record, ticket)
+        with self._pending_lock:
+            self._pending.add(future)
+
+        def done(f):
+            with self._pending_lock:
+                self._pending.discard(f)
+            if f.exception() is not None:
+                logger.error(f"Failed to release container {entry.id}: {f.exception()}")
+
+        future.add_done_callback(done)
+
+    async def execute(self, func_data, payload):
+        if func_data.get('cacheable'):
+            start_time = time.time()
+            cache_key = result_cache.key(func_data, payload)
+            result = result_cache.get(cache_key)
+            if result is not None:
+                response_time = time.time() - start_time
+                metrics.record(func_data.get('route'), response_time, None, {},
+                               function_id=func_data.get('id'), exit_code=0, cached=True)
+                return result, response_time, None, {}
+        run = {"phases": {}, "exit_code": None, "entry": None, "reusable": True, "ticket": None}
+        record = None
+        try:
+            result, response_time, errors, resources = await self._execute(func_data, payload, run)
+            if func_data.get('cacheable') and not errors and result is not None:
+                result_cache.put(cache_key, result)
+            record = metrics.record(
+                func_data.get('route'),
+                response_time,
+                errors,
+                resources,
+                function_id=func_data.get('id'),
+                phases=run["phases"],
+                exit_code=run["exit_code"],
+                timeout=errors == TIMEOUT_ERROR
+            )
+            backend = self.backend_for(func_data)
+            backend.record(response_time, errors)
+            if backend.pooled and func_data.get('id') is not None:
+                self.prewarmer.observe(func_data, response_time)
+            return result, response_time, errors, resources
+        finally:
+            if run["entry"]:
+                logger.info(f"Releasing container {run['entry'].id}")
+                self._release_later(run["entry"], run["reusable"], record, run["ticket"])
+            elif run["ticket"]:
+                self.admission.release(run["ticket"])
+
+    async def execute_batch(self, func_data, payloads, concurrency=None):
+        # Runs an iterable (or async iterable) of payloads over at most `concurrency` containers,
+        # each held for the whole batch, and yields one result per payload as it completes.
+        concurrency = min(concurrency or config.BATCH_CONCURRENCY, config.BATCH_CONCURRENCY)
+        if func_data.get('max_concurrency'):
+            concurrency = min(concurrency, func_data['max_concurrency'])
+        source = payloads.__aiter__() if hasattr(payloads, "__aiter__") else _aiter(payloads)
+        source_lock = asyncio.Lock()
+        counter = itertools.count()
+
+        async def next_item():
+            async with source_lock:
+                try:
+                    payload = await source.__anext__()
+                except StopAsyncIteration:
+                    return None
+                return next(counter), payload
+
+        results = asyncio.Queue()
+        spec = self.container_spec(func_data)
+        lane = self._batch_lane if self.backend_for(func_data).pooled else self._batch_lane_unpooled
+        lanes = [asyncio.ensure_future(lane(func_data, spec, next_item, results))
+                 for _ in range(max(concurrency, 1))]
+        running = len(lanes)
+        try:
+            while running:
+                item = await results.get()
+                if item is None:
+                    running -= 1
+                    continue
+                yield item
+        finally:
+            for lane in lanes:
+                lane.cancel()
+            await asyncio.gather(*lanes, return_exceptions=True)
+
+    async def _batch_lane_unpooled(self, func_data, spec, next_item, results):
+        # Backends without containers to hold simply run each payload as its own invocation
+        index = None
+        try:
+            while True:
+                item = await next_item()
+                if item is None:
+                    return
+                index, payload = item
+                start_time = time.time()
+                try:
+                    if isinstance(payload, ValueError):
+                        raise payload
+                    result, response_time, errors, _ = await self.execute(func_data, payload)
+                except (ValueError, AdmissionRejected) as e:
+                    result, response_time, errors = None, time.time() - start_time, str(e)
+                await results.put({"index": index, "result": result, "error": errors, "response_time": response_time})
+                index = None
+        except Exception as e:
+            logger.error(f"Batch lane for function {func_data.get('id')} failed: {str(e)}")
+            _fail_held(results, index, e)
+        finally:
+            results.put_nowait(None)
+
+    async def _batch_lane(self, func_data, spec, next_item, results):
+        # A lane leases one container (and one admission ticket) on its first payload and runs
+        # payloads back to back in it, skipping the per-invocation acquire and release. The
+        # container is only replaced when an invocation leaves it unusable.
+        entry = ticket = index = None
+        try:
+            while True:
+                item = await next_item()
+                if item is None:
+                    return
+                index, payload = item
+                run = {"phases": {}, "exit_code": None, "entry": entry, "reusable": True, "ticket": ticket}
+                start_time = time.time()
+                try:
+                    if isinstance(payload, ValueError):
+                        raise payload
+                    cache_key = result_cache.key(func_data, payload) if func_data.get('cacheable') else None
+                    result = result_cache.get(cache_key) if cache_key else None
+                    if result is not None:
+                        response_time = time.time() - start_time
+                        metrics.record(func_data.get('route'), response_time, None, {},
+                                       function_id=func_data.get('id'), exit_code=0, cached=True)
+                        await results.put({"index": index, "result": result, "error": None, "response_time": response_time})
+                        index = None
+                        continue
+                    data = encode_payload(payload)
+                    if entry is None:
+                        ticket = await self.admission.admit(func_data)
+                        entry = await self._acquire(func_data, spec, start_time, run["phases"])
+                    result, response_time, errors, _ = await self._invoke(entry, func_data, payload, data, start_time, run)
+                    if cache_key and not errors and result is not None:
+                        result_cache.put(cache_key, result)
+                except (ValueError, AdmissionRejected, docker.errors.APIError, WorkerError, OSError) as e:
+                    result, response_time, errors = None, time.time() - start_time, str(e)
+                    if ticket is not None and entry is None:
+                        self.admission.release(ticket)
+                        ticket = None
+
+                record = metrics.record(
+                    func_data.get('route'),
+                    response_time,
+                    errors,
+                    {},
+                    function_id=func_data.get('id'),
+                    phases=run["phases"],
+                    exit_code=run["exit_code"],
+                    timeout=errors == TIMEOUT_ERROR
                 )
+                self.backend_for(func_data).record(response_time, errors)
+                if func_data.get('id') is not None:
+                    self.prewarmer.observe(func_data, response_time)
+                if entry is not None:
+                    # Only cgroup reads are cheap enough to sample between payloads
+                    after = self.sampler.sample(entry.container, allow_api=False)
+                    if after is not None:
+                        metrics.attach_resources(record, self.sampler.usage(entry.baseline, after))
+                        entry.baseline = after
+                await results.put({"index": index, "result": result, "error": errors, "response_time": response_time})
+                index = None
+
+                if entry is not None and (not run["reusable"] or (entry.worker is not None and not entry.worker.alive)):
+                    self._release_later(entry, False, ticket=ticket)
+                    entry = ticket = None
+        except Exception as e:
+            logger.error(f"Batch lane for function {func_data.get('id')} failed: {str(e)}")
+            _fail_held(results, index, e)
+        finally:
+            if entry is not None:
+                self._release_later(entry, True, ticket=ticket)
+            elif ticket is not None:
+                self.admission.release(ticket)
+            results.put_nowait(None)
+
+    async def execute_stream(self, func_data, payload):
+        # Yields ("stdout", bytes) as the function writes it, then ("stderr", bytes) and
+        # ("exit", info) as trailers. Only stderr is buffered (up to MAX_STDERR_BYTES); handler
+        # functions return a single result, which is sent as one stdout chunk.
+        if not self.backend_for(func_data).pooled:
+            result, response_time, errors, _ = await self.execute(func_data, payload)
+            if result is not None:
+                yield "stdout", result if isinstance(result, bytes) else str(result).encode()
+            yield "exit", {"exit_code": 0 if not errors else 1, "error": errors, "response_time": response_time}
+            return
+        run = {"phases": {}, "exit_code": None, "entry": None, "reusable": True, "ticket": None}
+        spec = self.container_spec(func_data)
+        start_time = time.time()
+        data = encode_payload(payload)
+        stream = None
+        record = None
+        stderr = bytearray()
+        errors = None
+        try:
+            run["ticket"] = await self.admission.admit(func_data)
+            try:
+                entry = run["entry"] = await self._acquire(func_data, spec, start_time, run["phases"])
+                if uses_worker(func_data):
+                    result, _, errors, _ = await self._invoke(entry, func_data, payload, data, start_time, run)
+                    if result is not None:
+                        yield "stdout", result if isinstance(result, bytes) else str(result).encode()
+                else:
+                    timeout = func_data['timeout']
+                    logger.info(f"Streaming function {func_data.get('id')} in container {entry.id}")
+                    if entry.code_path is None:
+                        await self._run(self.load_code, entry, func_data)
+                    exec_start = time.time()
+                    stream = await self._run(ExecStream, self.client, entry.container,
+                                             self._oneshot_command(func_data, entry.code_path),
+                                             environment={"TIMEOUT": str(timeout)})
+                    stream.feed(data)
+                    deadline = exec_start + timeout + config.TIMEOUT_GRACE
+                    while True:
+                        kind, chunk = await self._run(stream.read_frame, deadline)
+                        if kind is None:
+                            break
+                        if kind == STDOUT:
+                            yield "stdout", chunk
+                        else:
+                            stderr.extend(chunk)
+                            del stderr[:-MAX_STDERR_BYTES]
+                    exit_code = run["exit_code"] = await self._run(stream.exit_code)
+                    run["phases"]["exec"] = time.time() - exec_start
+                    if exit_code != 0:
+                        errors = exit_error(exit_code, run["phases"]["exec"], timeout) or \
+                            stderr.decode(errors="replace") or f"Exited with status {exit_code}"
+            except ExecTimeout:
+                logger.warning(f"Timeout for container {run['entry'].id}, handing it to the reaper")
+                run["reusable"] = False
+                errors = TIMEOUT_ERROR
+            except (docker.errors.APIError, WorkerError, OSError) as e:
+                _, _, errors, _ = self._failed(e, start_time, run)
+
+            response_time = time.time() - start_time
+            record = metrics.record(
+                func_data.get('route'),
+                response_time,
+                errors,
+                {},
+                function_id=func_data.get('id'),
+                phases=run["phases"],
+                exit_code=run["exit_code"],
+                timeout=errors == TIMEOUT_ERROR
             )
-        
+            self.backend_for(func_data).record(response_time, errors)
+            if func_data.get('id') is not None:
+                self.prewarmer.observe(func_data, response_time)
+            if stderr:
+                yield "stderr", bytes(stderr)
+            yield "exit", {"exit_code": run["exit_code"], "error": errors, "response_time": response_time}
+        finally:
+            # Also reached when the client goes away mid-stream; sanitising on release kills
+            # whatever the function left running
+            if stream is not None:
+                stream.close()
+            if run["entry"]:
+                self._release_later(run["entry"], run["reusable"], record, run["ticket"])
+            elif run["ticket"]:
+                self.admission.release(run["ticket"])
+
+    async def prepare(self, func):
+        # Turns the submitted dependencies into their canonical manifest and builds (or reuses)
+        # the matching image before the function is stored, so invocations never install anything
+        if func.get('language') not in CODE_EXTENSIONS:
+            raise ValueError(f"Unsupported language {func.get('language')!r}, "
+                             f"expected one of {', '.join(CODE_EXTENSIONS)}")
+        if func.get('entrypoint') is not None and func['entrypoint'] not in ENTRYPOINTS:
+            raise ValueError(f"Unsupported entrypoint {func['entrypoint']!r}, expected one of {', '.join(ENTRYPOINTS)}")
+        if func.get('runtime') == "local" and not config.LOCAL_BACKEND_ENABLED:
+            raise ValueError("The local runtime is disabled on this server")
+        limits = resource_limits(func)
+        manifest = normalise_dependencies(func['language'], func.get('dependencies'))
+        image = await self._run(self.images.ensure, func['language'], manifest) if manifest else None
+        return dict(func, **limits, dependencies=manifest, image=image)
+
+    def container_spec(self, func_data):
+        # Containers are dedicated to one code version: handlers keep a persistent worker loaded
+        # with it, scripts have it copied in once, and no function can see another's code
+        pin = version_hash(func_data)
+        return {
+            "image": func_data.get('image') or base_image(func_data['language']),
+            "runtime": func_data.get('runtime') or 'runc',
+            "mem_limit": f"{func_data.get('memory_mb') or 1024}m",
+            "nano_cpus": int((func_data.get('cpus') or 2.0) * 1e9),
+            "pin": pin
+        }
+
+    def pool_key(self, func_data):
+        return ContainerPool.make_key(**self.container_spec(func_data))
+
+    def load_worker(self, entry, func_data):
+        logger.info(f"Loading function {func_data.get('id')} into worker in container {entry.id}")
+        worker = WorkerChannel(self.client, entry.container, func_data['language'], func_data['code'],
+                               load_timeout=func_data['timeout'])
+        self.pool.pin(entry, worker)
+
+    def load_code(self, entry, func_data):
+        # Written once per container over the archive API rather than sent as an argument on
+        # every exec; the pool key guarantees the container only ever runs this version
+        # Functions stored before languages were validated run under node, as they always did
+        path = f"{CODE_DIR}/{version_hash(func_data)}.{CODE_EXTENSIONS.get(func_data['language'], 'js')}"
+        data = func_data['code'].encode()
+        archive = io.BytesIO()
+        with tarfile.open(fileobj=archive, mode="w") as tar:
+            directory = tarfile.TarInfo(CODE_DIR.rsplit("/", 1)[1])
+            directory.type = tarfile.DIRTYPE
+            directory.mode = 0o755
+            tar.addfile(directory)
+            info = tarfile.TarInfo(path.split("/", 2)[2])
+            info.size = len(data)
+            info.mode = 0o444
+            tar.addfile(info, io.BytesIO(data))
+        if not entry.container.put_archive(CODE_DIR.rsplit("/", 1)[0], archive.getvalue()):
+            raise docker.errors.APIError(f"Failed to copy code into container {entry.id}")
+        entry.code_path = path
+
+    async def _execute(self, func_data, payload, run):
+        start_time = time.time()
+        data = encode_payload(payload)
+
+        # Waits for host capacity and the function's concurrency limit, or raises AdmissionRejected
+        with span("admission"):
+            run["ticket"] = await self.admission.admit(func_data)
+
+        return await self.backend_for(func_data).invoke(func_data, payload, data, start_time, run)
+
+    async def _acquire(self, func_data, spec, start_time, phases):
+        logger.info(f"Acquiring container for image={spec['image']}, runtime={spec['runtime']}")
+        queued = time.time()
+
+        def acquire():
+            # Time spent waiting for a free Docker thread is queueing, not acquiring
+            acquire_start = time.time()
+            phases["queue_wait"] = acquire_start - start_time
+            add_span("queue_wait", queued, acquire_start - queued)
+            with span("acquire"):
+                entry = self.pool.acquire(
+                    spec["image"],
+                    func_data['timeout'],
+                    runtime=spec["runtime"],
+                    code=func_data['code'],
+                    language=func_data['language'],
+                    mem_limit=spec["mem_limit"],
+                    nano_cpus=spec["nano_cpus"],
+                    pin=spec["pin"]
+                )
+            phases["acquire"] = time.time() - acquire_start
+            return entry
+
+        return await self._run(acquire)
+
+    def _failed(self, error, start_time, run):
+        logger.error(f"Execution failed: {str(error)}")
+        run["reusable"] = False
+        return None, time.time() - start_time, str(error), {}
+
+    async def _invoke(self, entry, func_data, payload, data, start_time, run):
+        phases = run["phases"]
+        container = entry.container
         try:
-            output = await asyncio.wait_for(run_exec(), timeout=func_data['timeout'])
-        except asyncio.TimeoutError:
-            errors = "Execution timed out"
-            logger.warning(f"Timeout for container {container.id}")
-            container.stop(timeout=15)
-            return None, time.time() - start_time, errors, resources
-        
-        result = output.output.decode()
+            if uses_worker(func_data):
+                return await self._invoke_worker(entry, func_data, payload, start_time, run)
+
+            timeout = func_data['timeout']
+            if entry.code_path is None:
+                await self._run(self.load_code, entry, func_data)
+            cmd = self._oneshot_command(func_data, entry.code_path)
+            logger.info(f"Executing function {func_data.get('id')} in container {container.id} ({len(data)} byte payload)")
+
+            # The payload is streamed to the function's stdin over the exec attach socket. If the
+            # in-container kill does not land in time (e.g. a wedged daemon) the read gives up
+            # TIMEOUT_GRACE later, and the reaper destroys the container.
+            exec_start = time.time()
+            with span("exec"):
+                stdout, stderr, exit_code = await self._run(self._run_oneshot, container, cmd, data, timeout)
+            phases["exec"] = time.time() - exec_start
+            return self._oneshot_result(stdout, stderr, exit_code, start_time, run, f"container {container.id}", timeout)
+
+        except ExecTimeout:
+            logger.warning(f"Timeout for container {entry.id}, handing it to the reaper")
+            run["reusable"] = False
+            return self._timed_out(start_time, run)
+
+        except (docker.errors.APIError, WorkerError, OSError) as e:
+            return self._failed(e, start_time, run)
+
+    def _timed_out(self, start_time, run):
+        return None, time.time() - start_time, TIMEOUT_ERROR, {}
+
+    def _oneshot_result(self, stdout, stderr, exit_code, start_time, run, where, timeout):
+        run["exit_code"] = exit_code
+        with span("decode"):
+            result = stdout.decode(errors="replace")
         response_time = time.time() - start_time
-        
-        if output.exit_code != 0:
-            errors = result
+        killed = exit_error(exit_code, run["phases"].get("exec", response_time), timeout)
+        if killed is not None:
+            logger.warning(f"Function killed in {where}: {killed}")
+            return None, response_time, killed, {}
+        errors = None
+        if exit_code != 0:
+            errors = stderr.decode(errors="replace") or result
             result = None
-            logger.error(f"Command failed in container {container.id}: {errors}")
-            
-        return result, response_time, errors, resources
-        
-    except docker.errors.APIError as e:
-        logger.error(f"Execution failed: {str(e)}")
-        errors = str(e)
-        return None, time.time() - start_time, errors, resources
-        
-    finally:
-        if container:
-            logger.info(f"Releasing container {container.id}")
-            pool.release(container)
\ No newline at end of file
+            logger.error(f"Command failed in {where}: {errors}")
+        return result, response_time, errors, {}
+
+    def _worker_result(self, reply, start_time, run, where):
+        run["exit_code"] = 0 if reply.get("ok") else 1
+        if reply.get("timeout"):
+            logger.warning(f"Handler timed out in {where}")
+            return None, time.time() - start_time, TIMEOUT_ERROR, {}
+        if not reply.get("ok"):
+            logger.error(f"Handler failed in {where}: {reply.get('error')}")
+            return None, time.time() - start_time, reply.get("error"), {}
+        return reply.get("result"), time.time() - start_time, None, {}
+
+    def _function_command(self, func_data, path=None):
+        interpreter = "python" if func_data['language'] == "python" else "node"
+        if path is not None:
+            return [interpreter, path]
+        return [interpreter, "-c" if interpreter == "python" else "-e", func_data['code']]
+
+    def _oneshot_command(self, func_data, path=None):
+        # The deadline is enforced inside the container: timeout runs the function in its own
+        # process group and SIGKILLs the whole group, so nothing outlives the invocation.
+        return ["timeout", "-s", "KILL", str(func_data['timeout'])] + self._function_command(func_data, path)
+
+    def _run_oneshot(self, container, cmd, data, timeout):
+        stream = ExecStream(self.client, container, cmd, environment={"TIMEOUT": str(timeout)})
+        try:
+            return stream.communicate(data, time.time() + timeout + config.TIMEOUT_GRACE)
+        finally:
+            stream.close()
+
+    async def _invoke_worker(self, entry, func_data, payload, start_time, run):
+        phases = run["phases"]
+        if entry.worker is None:
+            # Loading the function is part of the cold start, so it counts towards acquire
+            load_start = time.time()
+            with span("worker_load"):
+                await self._run(self.load_worker, entry, func_data)
+            phases["acquire"] = phases.get("acquire", 0) + time.time() - load_start
+        exec_start = time.time()
+        with span("exec"):
+            reply = await self._run(entry.worker.call, payload, func_data['timeout'], config.TIMEOUT_GRACE)
+        phases["exec"] = time.time() - exec_start
+        if reply.get("timeout") and not reply.get("recoverable"):
+            entry.worker.close()
+        return self._worker_result(reply, start_time, run, f"container {entry.id}")
+
+async def _aiter(items):
+    for item in items:
+        yield item
+
+def _fail_held(results, index, error):
+    # A lane that dies still answers for the payload it was holding
+    if index is not None:
+        results.put_nowait({"index": index, "result": None, "error": str(error), "response_time": 0.0})
+
+_engine = None
+
+def init_engine(client=None, pool=None):
+    global _engine
+    if _engine is None:
+        _engine = ExecutionEngine(client=client, pool=pool)
+        _engine.start()
+    return _engine
+
+def get_engine():
+    return _engine if _engine is not None else init_engine()
+
+def shutdown_engine():
+    global _engine
+    if _engine is not None:
+        _engine.shutdown()
+        _engine = None
+
+async def execute_function(func_data, payload):
+    return await get_engine().execute(func_data, payload)
+
+def execute_stream(func_data, payload):
+    return get_engine().execute_stream(func_data, payload)
+
+def execute_batch(func_data, payloads, concurrency=None):
+    return get_engine().execute_batch(func_data, payloads, concurrency)
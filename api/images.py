@@ -0,0 +1,125 @@
+import hashlib
+import io
+import json
+import logging
+import tarfile
+import threading
+from docker.errors import APIError, BuildError, ImageNotFound
+from . import config
+
+logger = logging.getLogger(__name__)
+
+# Dependencies are installed outside /app so they survive sanitising, and the search path is
+# set in the image so neither workers nor one-shot runs need any per-invocation setup.
+DOCKERFILES = {
+    "python": """FROM {base}
+USER root
+COPY requirements.txt /opt/deps/requirements.txt
+RUN pip install --no-cache-dir --disable-pip-version-check --target /opt/deps/site-packages -r /opt/deps/requirements.txt
+ENV PYTHONPATH=/opt/deps/site-packages
+USER nobody
+""",
+    "javascript": """FROM {base}
+USER root
+COPY package.json /opt/deps/package.json
+RUN cd /opt/deps && npm install --omit=dev --no-audit --no-fund && npm cache clean --force
+ENV NODE_PATH=/opt/deps/node_modules
+USER nobody
+""",
+}
+MANIFESTS = {"python": "requirements.txt", "javascript": "package.json"}
+
+
+class ImageBuildError(Exception):
+    pass
+
+
+def base_image(language):
+    return config.PYTHON_IMAGE if language == "python" else config.JS_IMAGE
+
+
+def normalise_dependencies(language, dependencies):
+    # Canonical manifest text, so equivalent dependency sets map to the same image.
+    # Python takes a requirements list or requirements.txt text; JavaScript takes a
+    # package.json object, its text, or just the dependencies mapping.
+    if not dependencies:
+        return None
+    if language == "python":
+        if isinstance(dependencies, str):
+            dependencies = dependencies.splitlines()
+        if not isinstance(dependencies, list) or not all(isinstance(d, str) for d in dependencies):
+            raise ValueError("Python dependencies must be a list of requirement strings")
+        lines = sorted({d.strip() for d in dependencies if d.strip() and not d.strip().startswith("#")})
+        return "\n".join(lines) + "\n" if lines else None
+    if isinstance(dependencies, str):
+        try:
+            dependencies = json.loads(dependencies)
+        except ValueError:
+            raise ValueError("package.json is not valid JSON")
+    if not isinstance(dependencies, dict):
+        raise ValueError("JavaScript dependencies must be a package.json object")
+    if "dependencies" not in dependencies:
+        dependencies = {"dependencies": dependencies}
+    manifest = {"name": "function-deps", "private": True, "dependencies": dependencies["dependencies"]}
+    if not manifest["dependencies"]:
+        return None
+    return json.dumps(manifest, sort_keys=True, indent=2) + "\n"
+
+
+def image_tag(language, manifest):
+    digest = hashlib.sha256(f"{base_image(language)}\n{manifest}".encode()).hexdigest()[:16]
+    return f"{config.DEPS_IMAGE_REPOSITORY}:{language}-{digest}"
+
+
+class ImageBuilder:
+    # Builds per-function images on top of the language base image, tagged by a hash of the
+    # base and the dependency manifest. Functions with the same dependencies share one image,
+    # and a rebuild only re-runs the install layer.
+    def __init__(self, client):
+        self.client = client
+        self.lock = threading.Lock()
+        self.building = {}  # tag -> lock serialising builds of that tag
+
+    def ensure(self, language, dependencies):
+        manifest = normalise_dependencies(language, dependencies)
+        if manifest is None:
+            return None
+        tag = image_tag(language, manifest)
+        with self.lock:
+            tag_lock = self.building.setdefault(tag, threading.Lock())
+        with tag_lock:
+            if self._exists(tag):
+                return tag
+            self._build(language, manifest, tag)
+        return tag
+
+    def _exists(self, tag):
+        try:
+            self.client.images.get(tag)
+            return True
+        except ImageNotFound:
+            return False
+
+    def _build(self, language, manifest, tag):
+        logger.info(f"Building dependency image {tag}")
+        context = io.BytesIO()
+        with tarfile.open(fileobj=context, mode="w") as tar:
+            files = {
+                "Dockerfile": DOCKERFILES[language].format(base=base_image(language)),
+                MANIFESTS[language]: manifest
+            }
+            for name, content in files.items():
+                data = content.encode()
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+        context.seek(0)
+        try:
+            self.client.images.build(fileobj=context, custom_context=True, tag=tag, rm=True,
+                                     pull=False, timeout=config.IMAGE_BUILD_TIMEOUT)
+        except BuildError as e:
+            output = "".join(line.get("stream", "") or line.get("error", "") for line in e.build_log)
+            raise ImageBuildError(f"Installing dependencies failed: {e.msg}\n{output[-4000:]}")
+        except APIError as e:
+            raise ImageBuildError(f"Image build failed: {str(e)}")
+        logger.info(f"Built dependency image {tag}")
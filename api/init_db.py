@@ -1,4 +1,4 @@
-from models import Base, engine
+from .models import Base, engine
 
 def init_db():
     Base.metadata.drop_all(bind=engine)
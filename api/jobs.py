@@ -0,0 +1,207 @@
+import asyncio
+import json
+import logging
+import time
+import requests
+from sqlalchemy import or_, select
+from . import config, crud, models
+from .admission import AdmissionRejected
+from .execution import PayloadTooLarge, get_engine
+
+logger = logging.getLogger(__name__)
+
+
+class JobQueue:
+    # Asynchronous invocations are persisted in the jobs table and run by a fixed number of
+    # worker tasks on the event loop, so request throughput no longer depends on how long
+    # functions take. Failed attempts are retried with exponential backoff; finished jobs are
+    # kept for result_ttl seconds. Claims are a conditional UPDATE, so a job is never picked
+    # up by two workers, and record the claiming node so other nodes only recover jobs whose
+    # node has stopped heartbeating.
+    def __init__(self, session_factory=None, workers=None, retry_backoff=None, result_ttl=None,
+                 poll_interval=None, node_id=None, node_ttl=None):
+        self.session_factory = session_factory or models.SessionLocal
+        self.workers = config.JOB_WORKERS if workers is None else workers
+        self.retry_backoff = config.JOB_RETRY_BACKOFF if retry_backoff is None else retry_backoff
+        self.result_ttl = config.JOB_RESULT_TTL if result_ttl is None else result_ttl
+        self.poll_interval = config.JOB_POLL_INTERVAL if poll_interval is None else poll_interval
+        self.node_id = node_id or config.NODE_ID
+        self.node_ttl = config.NODE_TTL if node_ttl is None else node_ttl
+        self._wakeup = None
+        self._tasks = []
+
+    def start(self):
+        self.recover()
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.ensure_future(self._work()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.ensure_future(self._expire_loop()))
+        logger.info(f"Job queue started with {self.workers} workers")
+
+    async def shutdown(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        # Jobs interrupted mid-run go back on the queue rather than being lost
+        self.recover()
+
+    def wake(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def recover(self, own=True):
+        # A running job was interrupted if its node stopped heartbeating, or, on start and
+        # shutdown (own), if this node claimed it. Jobs other live nodes are running are left alone.
+        now = time.time()
+        live = select(models.Node.id).where(models.Node.heartbeat_at >= now - self.node_ttl)
+        interrupted = or_(models.Job.node.is_(None), models.Job.node.not_in(live))
+        if own:
+            interrupted = or_(interrupted, models.Job.node == self.node_id)
+        with self.session_factory() as db:
+            count = db.query(models.Job).filter(models.Job.status == "running", interrupted).update(
+                {"status": "queued", "run_at": now}, synchronize_session=False)
+            db.commit()
+        if count:
+            logger.info(f"Requeued {count} interrupted jobs")
+
+    def expire(self):
+        with self.session_factory() as db:
+            count = db.query(models.Job).filter(
+                models.Job.status.in_(("succeeded", "failed")),
+                models.Job.finished_at < time.time() - self.result_ttl
+            ).delete(synchronize_session=False)
+            db.commit()
+        return count
+
+    async def process_next(self):
+        job = self._claim()
+        if job is None:
+            return False
+        await self._execute(job)
+        return True
+
+    async def _work(self):
+        while True:
+            try:
+                if await self.process_next():
+                    continue
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Job worker error: {str(e)}")
+                await asyncio.sleep(self.poll_interval)
+
+    async def _expire_loop(self):
+        while True:
+            await asyncio.sleep(min(self.result_ttl, 60))
+            try:
+                count = self.expire()
+                if count:
+                    logger.info(f"Expired {count} finished jobs")
+                self.recover(own=False)
+            except Exception as e:
+                logger.error(f"Failed to expire jobs: {str(e)}")
+
+    def _claim(self):
+        with self.session_factory() as db:
+            while True:
+                now = time.time()
+                job = db.query(models.Job).filter(
+                    models.Job.status == "queued", models.Job.run_at <= now
+                ).order_by(models.Job.run_at).first()
+                if job is None:
+                    return None
+                claimed = db.query(models.Job).filter(
+                    models.Job.id == job.id, models.Job.status == "queued"
+                ).update({"status": "running", "attempts": models.Job.attempts + 1, "started_at": now,
+                          "node": self.node_id}, synchronize_session=False)
+                db.commit()
+                if claimed:
+                    db.refresh(job)
+                    return {
+                        "id": job.id,
+                        "function_id": job.function_id,
+                        "payload": job.payload if job.payload_type == "raw" else json.loads(job.payload),
+                        "attempts": job.attempts,
+                        "max_attempts": job.max_attempts,
+                        "callback_url": job.callback_url
+                    }
+
+    async def _execute(self, job):
+        try:
+            with self.session_factory() as db:
+                func = crud.get_function_by_id(db, job["function_id"])
+            if not func:
+                self._finish(job, "failed", error="Function not found")
+                return
+            result, response_time, errors, _ = await get_engine().execute(func, job["payload"])
+        except AdmissionRejected as e:
+            # The host is full: try again later without using up an attempt
+            logger.info(f"Job {job['id']} deferred: {str(e)}")
+            self._update(job, status="queued", attempts=job["attempts"] - 1,
+                         run_at=time.time() + self.retry_backoff)
+            return
+        except PayloadTooLarge as e:
+            self._finish(job, "failed", error=str(e))
+            return
+        except Exception as e:
+            # Anything unexpected counts as a failed attempt, so the job never stays running
+            logger.error(f"Job {job['id']} attempt {job['attempts']} raised: {str(e)}")
+            result, errors = None, str(e) or type(e).__name__
+
+        if not errors:
+            self._finish(job, "succeeded", result=result)
+        elif job["attempts"] < job["max_attempts"]:
+            delay = self.retry_backoff * 2 ** (job["attempts"] - 1)
+            logger.warning(f"Job {job['id']} attempt {job['attempts']} failed, retrying in {delay}s: {errors}")
+            self._update(job, status="queued", error=errors, run_at=time.time() + delay)
+        else:
+            self._finish(job, "failed", error=errors)
+
+    def _update(self, job, **values):
+        with self.session_factory() as db:
+            db.query(models.Job).filter(models.Job.id == job["id"]).update(values, synchronize_session=False)
+            db.commit()
+
+    def _finish(self, job, status, result=None, error=None):
+        self._update(job, status=status, result=result, error=error, finished_at=time.time())
+        logger.info(f"Job {job['id']} {status} after {job['attempts']} attempts")
+        if job["callback_url"]:
+            with self.session_factory() as db:
+                body = crud.get_job(db, job["id"])
+            asyncio.get_running_loop().run_in_executor(None, _notify, job["callback_url"], body)
+
+
+def _notify(url, body):
+    try:
+        requests.post(url, json=body, timeout=config.JOB_CALLBACK_TIMEOUT)
+    except requests.RequestException as e:
+        logger.warning(f"Callback to {url} failed: {str(e)}")
+
+
+_queue = None
+
+def submit_job(db, func_id, payload, callback_url=None):
+    # The job is durable once committed; a running queue is only nudged to pick it up sooner
+    job = crud.create_job(db, func_id, payload, config.JOB_MAX_ATTEMPTS, callback_url)
+    if _queue is not None:
+        _queue.wake()
+    return job
+
+def init_queue():
+    global _queue
+    if _queue is None:
+        _queue = JobQueue()
+        _queue.start()
+    return _queue
+
+async def shutdown_queue():
+    global _queue
+    if _queue is not None:
+        await _queue.shutdown()
+        _queue = None
@@ -1,41 +1,227 @@
-from fastapi import FastAPI, Depends, HTTPException, Query
+from fastapi import FastAPI, Depends, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from sqlalchemy.orm import Session
 from . import crud
-from .models import get_db
-from .execution import execute_function
+from .migrate import upgrade
+from .models import engine, get_db
+from .cache import function_cache, result_cache
+from .metrics import metrics
+from . import config
+from .admission import AdmissionRejected
+from .cluster import FORWARDED_HEADER, get_cluster, init_cluster, shutdown_cluster
+from .images import ImageBuildError
+from .jobs import init_queue, shutdown_queue, submit_job
+from .tracing import TracingMiddleware, span, traces
+from .execution import (InvalidPayload, PayloadTooLarge, execute_batch, execute_function, execute_stream, get_engine,
+                        init_engine, shutdown_engine)
+import asyncio
+import codecs
+import json
 import logging
-import time  # Add for timestamp
+import requests
+import time
 
 app = FastAPI()
+if config.TRACING_ENABLED:
+    app.add_middleware(TracingMiddleware)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def register_dynamic_route(app: FastAPI, route: str, func_id: int):
-    async def dynamic_endpoint(payload: dict, db: Session = Depends(get_db)):
-        func_data = crud.get_function_by_route(db, route)
-        if not func_data:
-            raise HTTPException(status_code=404, detail="Function not found")
-        result, response_time, errors, resources = await execute_function(func_data, payload)
-        if errors:
-            raise HTTPException(status_code=500, detail=errors)
-        # Log metrics
-        logger.info(f"Metrics for {route}: response_time={response_time}, resources={resources}, errors={errors}")
-        return {"result": result}
-    app.add_api_route(
-        path=route,
-        endpoint=dynamic_endpoint,
-        methods=["POST"],
-        response_model=dict,
-        name=f"execute_{func_id}"
-    )
-    logger.info(f"Registered route: {route}")
+async def read_body(request: Request):
+    # Oversized bodies are refused from Content-Length when it is sent, and otherwise as soon
+    # as the cap is crossed, so no more than MAX_PAYLOAD_BYTES is ever buffered
+    length = request.headers.get("content-length", "")
+    if length.isdigit() and int(length) > config.MAX_PAYLOAD_BYTES:
+        raise HTTPException(status_code=413, detail="Payload too large")
+    body = bytearray()
+    with span("read_payload"):
+        async for chunk in request.stream():
+            body.extend(chunk)
+            if len(body) > config.MAX_PAYLOAD_BYTES:
+                raise HTTPException(status_code=413, detail="Payload too large")
+    return bytes(body)
+
+def decode_payload(request: Request, body):
+    # JSON bodies are decoded for the function; any other content type is passed through as raw bytes
+    content_type = request.headers.get("content-type", "application/json")
+    if not content_type.startswith("application/json"):
+        return body
+    try:
+        return json.loads(body) if body else {}
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid JSON payload")
+
+async def read_payload(request: Request):
+    return decode_payload(request, await read_body(request))
+
+async def run_function(func_data, payload):
+    try:
+        return await execute_function(func_data, payload)
+    except PayloadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except AdmissionRejected as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "1"})
+
+class BatchResponse(StreamingResponse):
+    # The request body is still being read while results stream out, so the base class's
+    # disconnect listener must not compete with read_ndjson for receive(). Disconnects are
+    # only watched for once the body has been read; until then request.stream() sees them.
+    def __init__(self, content, body_read, **kwargs):
+        super().__init__(content, **kwargs)
+        self.body_read = body_read
+
+    async def __call__(self, scope, receive, send):
+        async def disconnected():
+            await self.body_read.wait()
+            while (await receive())["type"] != "http.disconnect":
+                pass
+
+        streaming = asyncio.ensure_future(self.stream_response(send))
+        watcher = asyncio.ensure_future(disconnected())
+        try:
+            await asyncio.wait({streaming, watcher}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            watcher.cancel()
+            if not streaming.done():
+                logger.info("Batch client disconnected, cancelling the batch")
+                streaming.cancel()
+            await asyncio.gather(streaming, watcher, return_exceptions=True)
+            # Closing the generator cancels the batch's lanes, which hands back their containers
+            # and tickets, also when sending a result failed
+            await self.body_iterator.aclose()
+        if not streaming.cancelled() and streaming.exception() is not None:
+            raise streaming.exception()
+
+async def read_ndjson(request: Request, body_read):
+    # Payloads are handed to the batch as soon as their line arrives; a bad line fails only its own item
+    buffer = bytearray()
+    skipping = False
+    count = 0
+
+    def parse(line):
+        try:
+            return json.loads(line)
+        except ValueError:
+            return InvalidPayload("Invalid JSON payload")
+
+    async for chunk in request.stream():
+        buffer.extend(chunk)
+        while True:
+            newline = buffer.find(b"\n")
+            if newline < 0:
+                if len(buffer) > config.MAX_PAYLOAD_BYTES and not skipping:
+                    skipping = True
+                    count += 1
+                    yield PayloadTooLarge(f"Payload exceeds the {config.MAX_PAYLOAD_BYTES} byte limit")
+                if skipping:
+                    buffer.clear()
+                break
+            line = bytes(buffer[:newline]).strip()
+            del buffer[:newline + 1]
+            if skipping:
+                skipping = False
+            elif line:
+                count += 1
+                yield parse(line) if count <= config.BATCH_MAX_ITEMS else InvalidPayload("Too many payloads in batch")
+    body_read.set()
+    if buffer.strip() and not skipping:
+        count += 1
+        yield parse(bytes(buffer)) if count <= config.BATCH_MAX_ITEMS else InvalidPayload("Too many payloads in batch")
+
+async def prepare_function(func):
+    try:
+        return await get_engine().prepare(func)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ImageBuildError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+def format_event(kind, data, sse):
+    if not sse:
+        return json.dumps({"event": kind, "data": data}) + "\n"
+    text = data if isinstance(data, str) else json.dumps(data)
+    return f"event: {kind}\n" + "".join(f"data: {line}\n" for line in text.split("\n")) + "\n"
+
+async def stream_function(func_data, payload, request: Request):
+    # stdout is forwarded as it is produced, as server-sent events when the client accepts them
+    # and NDJSON events otherwise; stderr and the exit status follow as trailer events
+    sse = "text/event-stream" in request.headers.get("accept", "")
+    events = execute_stream(func_data, payload)
+    try:
+        # Admission happens before the first event, so rejections still get a proper status code
+        first = await events.__anext__()
+    except PayloadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except AdmissionRejected as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "1"})
+
+    async def body():
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        event = first
+        try:
+            while event is not None:
+                kind, value = event
+                if kind == "stdout":
+                    text = decoder.decode(value)
+                    if text:
+                        yield format_event(kind, text, sse)
+                else:
+                    tail = decoder.decode(b"", final=True)
+                    if tail:
+                        yield format_event("stdout", tail, sse)
+                    yield format_event(kind, value.decode(errors="replace") if isinstance(value, bytes) else value, sse)
+                event = await events.__anext__() if kind != "exit" else None
+        finally:
+            # Releases the container, including when the client disconnects mid-stream
+            await events.aclose()
+
+    return StreamingResponse(body(), media_type="text/event-stream" if sse else "application/x-ndjson")
+
+async def forward_function(func_data, request: Request, body, payload):
+    # Sends a sync invocation that would cold start here to a node with a warm container for it.
+    # Returns None to run locally: when running single-node, when already forwarded once, when
+    # the result is cached here, or when the peer cannot be reached.
+    cluster = get_cluster()
+    if cluster is None or request.headers.get(FORWARDED_HEADER):
+        return None
+    if func_data.get('cacheable') and result_cache.contains(result_cache.key(func_data, payload)):
+        return None
+    node = cluster.pick_node(func_data)
+    if node is None:
+        return None
+    headers = {"content-type": request.headers.get("content-type", "application/json")}
+    loop = asyncio.get_running_loop()
+    try:
+        with span("forward"):
+            status, content, content_type = await loop.run_in_executor(
+                None, cluster.forward, node, request.url.path, dict(request.query_params), body, headers)
+    except requests.RequestException as e:
+        logger.warning(f"Forwarding to node {node['id']} failed, running locally: {str(e)}")
+        return None
+    logger.info(f"Forwarded function {func_data['id']} to node {node['id']}")
+    return Response(content=content, status_code=status, media_type=content_type)
+
+def enqueue(db, func_data, payload, callback_url):
+    # Async invocations return as soon as the job is stored; the result is polled from /jobs/{id}
+    # or POSTed to callback_url when the job finishes
+    job = submit_job(db, func_data['id'], payload, callback_url)
+    return JSONResponse(status_code=202, content={"job_id": job["id"], "status": job["status"]})
 
 @app.on_event("startup")
 async def startup():
-    db = next(get_db())
-    for func in crud.get_functions(db):
-        register_dynamic_route(app, func["route"], func["id"])
+    # Creates tables and columns added since the database was initialised, and moves code
+    # stored inline by older versions into the code store
+    upgrade(engine)
+    init_engine()
+    init_queue()
+    init_cluster(get_engine())
+
+@app.on_event("shutdown")
+async def shutdown():
+    await shutdown_queue()
+    shutdown_cluster()
+    shutdown_engine()
 
 @app.get("/")
 async def root():
@@ -43,13 +229,16 @@ async def root():
 
 @app.post("/functions/")
 async def create_func(func: dict, db: Session = Depends(get_db)):
+    func = await prepare_function(func)
     result = crud.create_function(db, func)
-    register_dynamic_route(app, result["route"], result["id"])
+    get_engine().schedule_prewarm(result)
     return result
 
 @app.get("/functions/")
-async def list_funcs(db: Session = Depends(get_db)):
-    return crud.get_functions(db)
+async def list_funcs(after: int = Query(None, ge=0), limit: int = Query(None, ge=1, le=1000),
+                     db: Session = Depends(get_db)):
+    # Summaries without code, a page at a time; the next page starts after the last id returned
+    return crud.get_functions(db, after, limit or config.FUNCTION_PAGE_SIZE)
 
 @app.get("/functions/{func_id}")
 async def read_func(func_id: int, db: Session = Depends(get_db)):
@@ -60,9 +249,39 @@ async def read_func(func_id: int, db: Session = Depends(get_db)):
 
 @app.put("/functions/{func_id}")
 async def update_func(func_id: int, func: dict, db: Session = Depends(get_db)):
+    existing = crud.get_function_by_id(db, func_id)
+    if not existing:
+        raise HTTPException(status_code=404, detail="Function not found")
+    if "dependencies" not in func:
+        func = dict(func, dependencies=existing["dependencies"])
+    func = await prepare_function(func)
     result = crud.update_function(db, func_id, func)
     if not result:
         raise HTTPException(status_code=404, detail="Function not found")
+    get_engine().schedule_prewarm(result)
+    return result
+
+@app.get("/functions/{func_id}/versions")
+async def list_versions(func_id: int, db: Session = Depends(get_db)):
+    versions = crud.get_function_versions(db, func_id)
+    if versions is None:
+        raise HTTPException(status_code=404, detail="Function not found")
+    return versions
+
+@app.get("/functions/{func_id}/versions/{version}")
+async def read_version(func_id: int, version: int, db: Session = Depends(get_db)):
+    func = crud.get_function_version(db, func_id, version)
+    if not func:
+        raise HTTPException(status_code=404, detail="Version not found")
+    return func
+
+@app.post("/functions/{func_id}/versions/{version}/activate")
+async def activate_version(func_id: int, version: int, db: Session = Depends(get_db)):
+    # Rolls back (or forward) without rebuilding anything
+    result = crud.activate_version(db, func_id, version)
+    if not result:
+        raise HTTPException(status_code=404, detail="Version not found")
+    get_engine().schedule_prewarm(result)
     return result
 
 @app.delete("/functions/{func_id}")
@@ -70,49 +289,158 @@ async def delete_func(func_id: int, db: Session = Depends(get_db)):
     result = crud.delete_function(db, func_id)
     if not result:
         raise HTTPException(status_code=404, detail="Function not found")
+    get_engine().prewarmer.forget(func_id)
     return result
 
+def pin_version(db, func_data, version, mode):
+    # ?version=N runs that stored version of the function without activating it
+    if version is None or version == func_data["version"]:
+        return func_data
+    if mode == "async":
+        raise HTTPException(status_code=400, detail="Asynchronous invocations always run the active version")
+    pinned = crud.get_function_version(db, func_data["id"], version)
+    if not pinned:
+        raise HTTPException(status_code=404, detail="Version not found")
+    return pinned
+
 @app.post("/execute/{func_id}")
-async def execute(func_id: int, payload: dict, db: Session = Depends(get_db)):
-    func = crud.get_function_by_id(db, func_id)
+async def execute(func_id: int, request: Request, mode: str = Query("sync", regex="^(sync|async|stream)$"),
+                  callback_url: str = Query(None), version: int = Query(None, ge=1), db: Session = Depends(get_db)):
+    with span("function_lookup"):
+        func = crud.get_function_by_id(db, func_id)
     if not func:
         raise HTTPException(status_code=404, detail="Function not found")
-    result, response_time, errors, resources = await execute_function(func, payload)
+    func = pin_version(db, func, version, mode)
+    body = await read_body(request)
+    payload = decode_payload(request, body)
+    if mode == "sync":
+        forwarded = await forward_function(func, request, body, payload)
+        if forwarded is not None:
+            return forwarded
+    if mode == "async":
+        return enqueue(db, func, payload, callback_url)
+    if mode == "stream":
+        return await stream_function(func, payload, request)
+    result, response_time, errors, resources = await run_function(func, payload)
     if errors:
         raise HTTPException(status_code=500, detail=errors)
     logger.info(f"Metrics for func_id {func_id}: response_time={response_time}, resources={resources}, errors={errors}")
     return {"result": result}
 
-@app.get("/metrics/")
-async def get_metrics(route: str = Query(None), db: Session = Depends(get_db)):
-    if route:
-        func = crud.get_function_by_route(db, route)
-        if not func:
-            raise HTTPException(status_code=404, detail="Function not found")
-        # Return a single metric as a list for consistency
-        metrics = [{
-            "route": route,
-            "function_id": func["id"],
-            "response_time": 0.1,  # Placeholder (replace with real data)
-            "cpu_usage": "0.1 cores",
-            "memory_usage": "128Mi",
-            "resources": {"cpu": "0.1 cores", "memory": "128Mi"},
-            "timestamp": int(time.time()),  # Unix timestamp
-            "errors": None  # Placeholder
-        }]
+@app.post("/execute/{func_id}/batch")
+async def execute_batch_route(func_id: int, request: Request, concurrency: int = Query(None, ge=1),
+                              db: Session = Depends(get_db)):
+    func = crud.get_function_by_id(db, func_id)
+    if not func:
+        raise HTTPException(status_code=404, detail="Function not found")
+    body_read = asyncio.Event()
+    if request.headers.get("content-type", "").startswith("application/x-ndjson"):
+        payloads = read_ndjson(request, body_read)
     else:
-        # Return metrics for all functions (placeholder)
-        funcs = crud.get_functions(db)
-        metrics = [
-            {
-                "route": func["route"],
-                "function_id": func["id"],
-                "response_time": 0.1,
-                "cpu_usage": "0.1 cores",
-                "memory_usage": "128Mi",
-                "resources": {"cpu": "0.1 cores", "memory": "128Mi"},
-                "timestamp": int(time.time()),
-                "errors": None
-            } for func in funcs
-        ]
-    return metrics
\ No newline at end of file
+        body_read.set()
+        payloads = await read_payload(request)
+        if not isinstance(payloads, list):
+            raise HTTPException(status_code=400, detail="Batch body must be a JSON array or NDJSON")
+        if len(payloads) > config.BATCH_MAX_ITEMS:
+            raise HTTPException(status_code=413, detail=f"Batch exceeds {config.BATCH_MAX_ITEMS} payloads")
+
+    # Results are streamed back as NDJSON in completion order, each tagged with its input index
+    async def results():
+        async for item in execute_batch(func, payloads, concurrency):
+            yield json.dumps(item) + "\n"
+
+    return BatchResponse(results(), body_read, media_type="application/x-ndjson")
+
+# Every function is served by this one route: the full path is looked up in the function
+# cache's route index (falling back to the indexed route column), so routing cost does not
+# grow with the number of deployed functions and updates or deletes take effect immediately.
+@app.post("/fn/{unique_id}/{suffix:path}")
+async def dispatch(unique_id: str, suffix: str, request: Request, mode: str = Query("sync", regex="^(sync|async|stream)$"),
+                   callback_url: str = Query(None), version: int = Query(None, ge=1), db: Session = Depends(get_db)):
+    route = f"/fn/{unique_id}/{suffix}"
+    with span("route_resolve"):
+        func_data = crud.get_function_by_route(db, route)
+    if not func_data:
+        raise HTTPException(status_code=404, detail="Function not found")
+    func_data = pin_version(db, func_data, version, mode)
+    body = await read_body(request)
+    payload = decode_payload(request, body)
+    if mode == "sync":
+        forwarded = await forward_function(func_data, request, body, payload)
+        if forwarded is not None:
+            return forwarded
+    if mode == "async":
+        return enqueue(db, func_data, payload, callback_url)
+    if mode == "stream":
+        return await stream_function(func_data, payload, request)
+    result, response_time, errors, resources = await run_function(func_data, payload)
+    if errors:
+        raise HTTPException(status_code=500, detail=errors)
+    # Log metrics
+    logger.info(f"Metrics for {route}: response_time={response_time}, resources={resources}, errors={errors}")
+    return {"result": result}
+
+@app.get("/jobs/{job_id}")
+async def read_job(job_id: str, db: Session = Depends(get_db)):
+    job = crud.get_job(db, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.get("/metrics/")
+async def get_metrics(route: str = Query(None), since: float = Query(None), window: float = Query(None),
+                      limit: int = Query(None, ge=1), db: Session = Depends(get_db)):
+    if route and not crud.get_function_by_route(db, route):
+        raise HTTPException(status_code=404, detail="Function not found")
+    # window is a number of seconds back from now; since is an absolute Unix timestamp;
+    # limit keeps only the newest records
+    if window is not None:
+        since = max(since or 0, time.time() - window)
+    return metrics.get_metrics(route, since=since, limit=limit)
+
+@app.get("/metrics/series")
+async def get_metrics_series(route: str = Query(None), since: float = Query(None), bucket: float = Query(None, gt=0),
+                             db: Session = Depends(get_db)):
+    # Time-bucketed aggregates for charts; poll with since=<cursor from the last response>
+    if route and not crud.get_function_by_route(db, route):
+        raise HTTPException(status_code=404, detail="Function not found")
+    return metrics.series(route, since=since, bucket=bucket)
+
+@app.get("/metrics/summary")
+async def get_metrics_summary(route: str = Query(None), window: float = Query(None)):
+    return metrics.summary(route, window=window)
+
+@app.get("/metrics/cache")
+async def get_cache_metrics():
+    return dict(function_cache.stats(), results=result_cache.stats())
+
+
+@app.get("/metrics/backends")
+async def get_backend_metrics():
+    # Latency per execution backend, e.g. to compare runc, runsc and local on live traffic
+    return get_engine().backend_stats()
+
+@app.get("/metrics/capacity")
+async def get_capacity_metrics():
+    engine = get_engine()
+    # The settings tell clients such as the benchmark whether a first call can still be cold
+    return dict(engine.admission.stats(), prewarm=engine.prewarmer.stats(),
+                prewarm_on_deploy=config.PREWARM_ON_DEPLOY, dispatch_enabled=config.DISPATCH_ENABLED)
+
+@app.get("/nodes/")
+async def get_nodes():
+    # Live API processes sharing this registry, with their admission capacity and warm containers
+    cluster = get_cluster()
+    return cluster.nodes() if cluster is not None else []
+
+@app.get("/traces/")
+async def get_traces(path: str = Query(None), limit: int = Query(100, ge=1, le=1000)):
+    # Most recent first; path filters on the request path, e.g. a function's route
+    return traces.recent(limit, path)
+
+@app.get("/traces/{request_id}")
+async def get_trace(request_id: str):
+    trace = traces.get(request_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail="Trace not found")
+    return trace
@@ -1,19 +1,321 @@
+import math
+import threading
 import time
-from collections import defaultdict
+from collections import OrderedDict, deque
+from . import config
+
+PHASES = ("queue_wait", "acquire", "exec", "release", "total")  # release happens after the response
+IO_KEYS = ("io_read_bytes", "io_write_bytes")
+
+
+class Histogram:
+    # Log-bucketed histogram: fixed memory and ~5% relative error on quantiles regardless of volume
+    MIN_VALUE = 1e-4
+    GROWTH = 1.1
+    BUCKETS = 200  # Covers 0.1 ms up to several hours
 
-class Metrics:
     def __init__(self):
-        self.data = defaultdict(list)
+        self.counts = {}  # bucket index -> count; sparse, so small histograms stay small
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        index = 0
+        if value > self.MIN_VALUE:
+            index = min(int(math.log(value / self.MIN_VALUE, self.GROWTH)), self.BUCKETS - 1)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, other):
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        if other.count:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+
+    def quantile(self, q):
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                estimate = self.MIN_VALUE * self.GROWTH ** (index + 0.5)
+                return min(max(estimate, self.min), self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            "mean": self.total / self.count if self.count else None,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "max": self.max
+        }
+
+
+class TimeBucket:
+    # Aggregates of one route's invocations over one interval of the time series
+    def __init__(self, start):
+        self.start = start
+        self.count = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.cache_hits = 0
+        self.response_time = Histogram()
+        self.phases = {}  # phase -> [sum, count]
+
+    def add(self, record):
+        self.count += 1
+        if record["errors"]:
+            self.errors += 1
+        if record["timeout"]:
+            self.timeouts += 1
+        if record["cached"]:
+            self.cache_hits += 1
+        self.response_time.add(record["response_time"])
+        for phase, value in record["phases"].items():
+            if value is not None:
+                self.add_phase(phase, value)
+
+    def add_phase(self, phase, value):
+        totals = self.phases.setdefault(phase, [0.0, 0])
+        totals[0] += value
+        totals[1] += 1
+
+    def merge(self, other):
+        self.count += other.count
+        self.errors += other.errors
+        self.timeouts += other.timeouts
+        self.cache_hits += other.cache_hits
+        self.response_time.merge(other.response_time)
+        for phase, (total, count) in other.phases.items():
+            totals = self.phases.setdefault(phase, [0.0, 0])
+            totals[0] += total
+            totals[1] += count
+
+    def to_dict(self, route):
+        return dict(
+            self.response_time.summary(),
+            route=route,
+            start=self.start,
+            count=self.count,
+            errors=self.errors,
+            timeouts=self.timeouts,
+            cache_hits=self.cache_hits,
+            phases={phase: total / count for phase, (total, count) in self.phases.items()}
+        )
+
+
+class RouteMetrics:
+    def __init__(self, buffer_size, bucket_seconds=None, retention=None):
+        self.recent = deque(maxlen=buffer_size)  # Ring buffer of the latest invocation records
+        self.bucket_seconds = config.METRICS_BUCKET_SECONDS if bucket_seconds is None else bucket_seconds
+        self.retention = config.METRICS_SERIES_RETENTION if retention is None else retention
+        self.series = OrderedDict()  # bucket start -> TimeBucket, oldest first
+        self.count = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.cache_hits = 0
+        self.histograms = {phase: Histogram() for phase in PHASES}
+        self.cpu_seconds = Histogram()
+        self.memory_peak_bytes = 0
+        self.io_bytes = dict.fromkeys(IO_KEYS, 0)
+
+    def add(self, record):
+        self.recent.append(record)
+        self.count += 1
+        if record["errors"]:
+            self.errors += 1
+        if record["timeout"]:
+            self.timeouts += 1
+        if record["cached"]:
+            self.cache_hits += 1
+        for phase in PHASES:
+            value = record["phases"].get(phase)
+            if value is not None:
+                self.histograms[phase].add(value)
+        start = record["timestamp"] - record["timestamp"] % self.bucket_seconds
+        bucket = self.series.get(start)
+        if bucket is None:
+            bucket = self.series[start] = TimeBucket(start)
+            while next(iter(self.series)) < start - self.retention:
+                self.series.popitem(last=False)
+        bucket.add(record)
 
-    def record(self, route: str, response_time: float, errors: str, resources: dict):
-        self.data[route].append({
+    def bucket_for(self, timestamp):
+        return self.series.get(timestamp - timestamp % self.bucket_seconds)
+
+    def add_resources(self, usage):
+        if usage.get("cpu_seconds") is not None:
+            self.cpu_seconds.add(usage["cpu_seconds"])
+        self.memory_peak_bytes = max(self.memory_peak_bytes, usage.get("memory_peak_bytes") or 0)
+        for key in IO_KEYS:
+            self.io_bytes[key] += usage.get(key) or 0
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "error_rate": self.errors / self.count if self.count else 0.0,
+            "timeouts": self.timeouts,
+            "cache_hits": self.cache_hits,
+            "phases": {phase: histogram.summary() for phase, histogram in self.histograms.items()},
+            "resources": {
+                "cpu_seconds": self.cpu_seconds.summary(),
+                "memory_peak_bytes": self.memory_peak_bytes or None,
+                **self.io_bytes
+            }
+        }
+
+
+def _quantile(values, q):
+    if not values:
+        return None
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+def summarise_records(records):
+    # Exact aggregates over a window of buffered records (at most METRICS_BUFFER_SIZE per route)
+    count = len(records)
+    phases = {}
+    for phase in PHASES:
+        values = sorted(r["phases"][phase] for r in records if r["phases"].get(phase) is not None)
+        phases[phase] = {
+            "mean": sum(values) / len(values) if values else None,
+            "p50": _quantile(values, 0.5),
+            "p95": _quantile(values, 0.95),
+            "p99": _quantile(values, 0.99),
+            "max": values[-1] if values else None
+        }
+    cpu = sorted(r["resources"]["cpu_seconds"] for r in records if r["resources"].get("cpu_seconds") is not None)
+    return {
+        "count": count,
+        "error_rate": sum(1 for r in records if r["errors"]) / count if count else 0.0,
+        "timeouts": sum(1 for r in records if r["timeout"]),
+        "cache_hits": sum(1 for r in records if r["cached"]),
+        "phases": phases,
+        "resources": {
+            "cpu_seconds": {
+                "mean": sum(cpu) / len(cpu) if cpu else None,
+                "p50": _quantile(cpu, 0.5),
+                "p95": _quantile(cpu, 0.95),
+                "p99": _quantile(cpu, 0.99),
+                "max": cpu[-1] if cpu else None
+            },
+            "memory_peak_bytes": max((r["resources"].get("memory_peak_bytes") or 0 for r in records), default=0) or None,
+            **{key: sum(r["resources"].get(key) or 0 for r in records) for key in IO_KEYS}
+        }
+    }
+
+
+class Metrics:
+    def __init__(self, buffer_size=None, bucket_seconds=None, retention=None):
+        self.buffer_size = config.METRICS_BUFFER_SIZE if buffer_size is None else buffer_size
+        self.bucket_seconds = config.METRICS_BUCKET_SECONDS if bucket_seconds is None else bucket_seconds
+        self.retention = config.METRICS_SERIES_RETENTION if retention is None else retention
+        self.data = {}
+        self.lock = threading.Lock()
+
+    def record(self, route: str, response_time: float, errors: str, resources: dict,
+               function_id=None, phases=None, exit_code=None, timeout=False, cached=False):
+        record = {
+            "route": route,
+            "function_id": function_id,
             "timestamp": time.time(),
             "response_time": response_time,
+            "phases": dict(phases or {}, total=response_time),
+            "exit_code": exit_code,
+            "timeout": timeout,
+            "cached": cached,
             "errors": errors,
             "resources": resources
-        })
+        }
+        with self.lock:
+            # Stamped under the lock so time buckets are created in order
+            record["timestamp"] = time.time()
+            if route not in self.data:
+                self.data[route] = RouteMetrics(self.buffer_size, self.bucket_seconds, self.retention)
+            self.data[route].add(record)
+        return record
+
+    def attach_resources(self, record, usage):
+        # Usage is sampled after the response has been sent, so it is added to the record later
+        with self.lock:
+            record["resources"].update(usage)
+            route_metrics = self.data.get(record["route"])
+            if route_metrics is not None:
+                route_metrics.add_resources(usage)
+
+    def attach_phase(self, record, phase, value):
+        # For phases that finish after the record was made, such as releasing the container
+        with self.lock:
+            record["phases"][phase] = value
+            route_metrics = self.data.get(record["route"])
+            if route_metrics is not None:
+                route_metrics.histograms[phase].add(value)
+                bucket = route_metrics.bucket_for(record["timestamp"])
+                if bucket is not None:
+                    bucket.add_phase(phase, value)
+
+    def get_metrics(self, route: str = None, since: float = None, limit: int = None):
+        with self.lock:
+            routes = [self.data[route]] if route in self.data else [] if route else list(self.data.values())
+            records = [dict(r, resources=dict(r["resources"]), phases=dict(r["phases"]))
+                       for route_metrics in routes for r in route_metrics.recent]
+        if since is not None:
+            records = [r for r in records if r["timestamp"] >= since]
+        records.sort(key=lambda r: r["timestamp"])
+        return records[-limit:] if limit else records
+
+    def series(self, route: str = None, since: float = None, bucket: float = None):
+        # Per-route aggregates in time buckets of `bucket` seconds (rounded up to a multiple of
+        # METRICS_BUCKET_SECONDS). Only buckets starting at or after the one containing `since`
+        # are returned, so polling with since=cursor costs the same however long history is.
+        # The last bucket may still be filling up: clients replace points from the cursor on.
+        width = self.bucket_seconds
+        if bucket:
+            width = max(1, math.ceil(bucket / self.bucket_seconds)) * self.bucket_seconds
+        start = time.time() - self.retention
+        if since is not None:
+            start = max(start, since - since % width)
+        points = []
+        with self.lock:
+            routes = {route: self.data[route]} if route in self.data else {} if route else dict(self.data)
+            for name, route_metrics in routes.items():
+                merged = {}
+                # Newest first, stopping at the cursor, so old buckets are never visited
+                for base in reversed(route_metrics.series.values()):
+                    if base.start < start:
+                        break
+                    key = base.start - base.start % width
+                    if key not in merged:
+                        merged[key] = TimeBucket(key)
+                    merged[key].merge(base)
+                points.extend(b.to_dict(name) for b in merged.values())
+        points.sort(key=lambda p: (p["start"], p["route"]))
+        return {
+            "bucket": width,
+            "points": points,
+            "cursor": points[-1]["start"] if points else (since - since % width if since is not None else None)
+        }
+
+    def summary(self, route: str = None, window: float = None):
+        with self.lock:
+            routes = {route: self.data[route]} if route in self.data else {} if route else dict(self.data)
+            if window is None:
+                return {name: route_metrics.summary() for name, route_metrics in routes.items()}
+            since = time.time() - window
+            windows = {name: [r for r in route_metrics.recent if r["timestamp"] >= since]
+                       for name, route_metrics in routes.items()}
+        return {name: summarise_records(records) for name, records in windows.items()}
+
 
-    def get_metrics(self, route: str = None):
-        if route:
-            return self.data.get(route, [])
-        return [entry for route_data in self.data.values() for entry in route_data]
\ No newline at end of file
+metrics = Metrics()
@@ -0,0 +1,50 @@
+import logging
+import time
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session
+from . import crud, models
+from .code_store import CodeStore
+
+logger = logging.getLogger(__name__)
+
+
+def migrate_legacy_code(bind):
+    # Databases from before the code store kept each function's code inline in functions.code.
+    # That code is moved into the store as version 1; the old column is left in place, unused.
+    if "code" not in {column["name"] for column in inspect(bind).get_columns("functions")}:
+        return 0
+    store = CodeStore()  # Not the shared one: its cache must not answer for another database
+    with Session(bind) as db:
+        rows = db.execute(text("SELECT id, code FROM functions WHERE code IS NOT NULL AND code_hash IS NULL")).all()
+        for func_id, code in rows:
+            db_func = db.get(models.Function, func_id)
+            db_func.code_hash = store.put(db, code)
+            db_func.version = 1
+            crud._add_version(db, db_func, 1)
+        db.commit()
+    if rows:
+        logger.info(f"Moved the code of {len(rows)} functions into the code store")
+    return len(rows)
+
+
+def upgrade(bind=None, attempts=5):
+    # Every uvicorn worker runs this on startup, so several may race on the same step. Each step
+    # checks what already exists first, so a step that fails because another worker got there
+    # first is simply retried. Running `python -m api.migrate` before starting workers avoids it.
+    bind = bind or models.engine
+    for attempt in range(attempts):
+        try:
+            models.create_schema(bind)
+            migrate_legacy_code(bind)
+            return
+        except DBAPIError as e:
+            if attempt == attempts - 1:
+                raise
+            logger.info(f"Schema upgrade collided with another process, retrying: {str(e)}")
+            time.sleep(0.1 * (attempt + 1))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    upgrade()
@@ -0,0 +1,142 @@
+import logging
+import math
+import threading
+import time
+from . import config
+from .worker import uses_worker
+
+logger = logging.getLogger(__name__)
+
+
+class FunctionDemand:
+    def __init__(self, func_data, key):
+        self.func_data = func_data
+        self.key = key
+        self.rate = 0.0  # EWMA of invocations per second
+        self.duration = 0.0  # EWMA of seconds a container is held per invocation
+        self.pending = 0  # Invocations since the last tick
+        self.last_seen = time.time()
+        self.target = 0
+
+
+class PrewarmScheduler:
+    # Keeps enough warm containers per function to absorb its recent invocation rate.
+    # By Little's law the expected number of busy containers is rate * duration; we keep that
+    # (times some headroom) warm, scale to zero once a function has been idle for a while,
+    # and warm new or updated functions before their first request arrives.
+    def __init__(self, engine, interval=None, alpha=None, headroom=None, max_warm=None, idle_after=None):
+        self.engine = engine
+        self.interval = config.PREWARM_INTERVAL if interval is None else interval
+        self.alpha = config.PREWARM_ALPHA if alpha is None else alpha
+        self.headroom = config.PREWARM_HEADROOM if headroom is None else headroom
+        self.max_warm = config.PREWARM_MAX_WARM if max_warm is None else max_warm
+        self.idle_after = config.PREWARM_IDLE_AFTER if idle_after is None else idle_after
+        self.demand = {}  # function id -> FunctionDemand
+        self.stale = []  # Pool keys of deleted functions, drained on the next tick
+        self.lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def observe(self, func_data, duration):
+        if func_data.get('pinned'):
+            # Calls pinned to an inactive version say nothing about the active one's demand
+            return
+        with self.lock:
+            demand = self._track(func_data)
+            demand.pending += 1
+            demand.last_seen = time.time()
+            demand.duration = duration if not demand.duration else (
+                self.alpha * duration + (1 - self.alpha) * demand.duration)
+
+    def prewarm(self, func_data, count=None):
+        count = config.PREWARM_ON_DEPLOY if count is None else count
+        with self.lock:
+            demand = self._track(func_data)
+            demand.last_seen = time.time()
+            demand.target = max(demand.target, count)
+        self._apply(demand)
+
+    def forget(self, func_id):
+        with self.lock:
+            demand = self.demand.pop(func_id, None)
+            if demand is not None:
+                self.stale.append(demand.key)
+
+    def tick(self):
+        now = time.time()
+        dormant = []
+        with self.lock:
+            for func_id, demand in list(self.demand.items()):
+                observed = demand.pending / self.interval
+                demand.pending = 0
+                demand.rate = self.alpha * observed + (1 - self.alpha) * demand.rate
+                if now - demand.last_seen > self.idle_after:
+                    dormant.append(self.demand.pop(func_id))
+                else:
+                    expected = demand.rate * demand.duration * self.headroom
+                    demand.target = min(self.max_warm, math.ceil(expected))
+            demands = list(self.demand.values())
+            stale, self.stale = self.stale, []
+        for key in stale + [demand.key for demand in dormant]:
+            if self.engine.pool.drain(key):
+                logger.info(f"Scaled idle containers for key={key} to zero")
+        for demand in demands:
+            self._apply(demand)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+
+        def run():
+            while not self._stop.wait(self.interval):
+                try:
+                    self.tick()
+                except Exception as e:
+                    logger.error(f"Pre-warm tick failed: {str(e)}")
+
+        self._thread = threading.Thread(target=run, name="prewarm-scheduler", daemon=True)
+        self._thread.start()
+
+    def shutdown(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def stats(self):
+        with self.lock:
+            return {
+                func_id: {"rate": demand.rate, "duration": demand.duration, "target": demand.target,
+                          "idle": self.engine.pool.idle_count(demand.key)}
+                for func_id, demand in self.demand.items()
+            }
+
+    def _track(self, func_data):
+        key = self.engine.pool_key(func_data)
+        demand = self.demand.get(func_data['id'])
+        if demand is None or demand.key != key:
+            if demand is not None:
+                # The function changed version or limits. Containers for the old key are no longer
+                # kept warm, but the idle TTL retires them, so a quick rollback still finds them.
+                self.engine.pool.configure(demand.key, min_idle=0)
+            demand = self.demand[func_data['id']] = FunctionDemand(func_data, key)
+        demand.func_data = func_data
+        return demand
+
+    def _apply(self, demand):
+        pool = self.engine.pool
+        if demand.target == 0:
+            # No expected demand: let the pool's idle TTL retire whatever is still warm
+            pool.configure(demand.key, min_idle=0)
+            return
+        func_data = demand.func_data
+        if uses_worker(func_data):
+            warmup = lambda entry: self.engine.load_worker(entry, func_data)  # noqa: E731
+        else:
+            warmup = lambda entry: self.engine.load_code(entry, func_data)  # noqa: E731
+        pool.configure(demand.key, min_idle=demand.target,
+                       max_idle=max(demand.target, pool.max_idle), warmup=warmup)
+        started = pool.prewarm(demand.key, demand.target)
+        if started:
+            logger.info(f"Pre-warmed {started} container(s) for function {demand.func_data['id']}")
@@ -0,0 +1,98 @@
+import os
+import queue
+import resource
+import shutil
+import signal
+import subprocess
+import tempfile
+import threading
+import time
+from .exec_stream import ExecTimeout, STDERR, STDOUT, Stream
+
+
+# A local subprocess with the same interface as ExecStream, for the local backend. The process
+# gets its own session (so the whole group can be killed), a private working directory that is
+# removed afterwards, a minimal environment and rlimits; this contains mistakes, not hostile code.
+class ProcessStream(Stream):
+    def __init__(self, cmd, environment=None, memory_mb=None, max_files=256):
+        def limit():
+            if memory_mb:
+                size = memory_mb * 1024 * 1024
+                resource.setrlimit(resource.RLIMIT_AS, (size, size))
+            resource.setrlimit(resource.RLIMIT_NOFILE, (max_files, max_files))
+            resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
+
+        self.workdir = tempfile.mkdtemp(prefix="fn-")
+        environment = dict(environment or {}, HOME=self.workdir)
+        try:
+            self.proc = subprocess.Popen(
+                cmd,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                cwd=self.workdir,
+                env=environment,
+                start_new_session=True,
+                preexec_fn=limit
+            )
+        except OSError:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+            raise
+        self._frames = queue.Queue()
+        self._open = 2
+        for pipe, stream in ((self.proc.stdout, STDOUT), (self.proc.stderr, STDERR)):
+            threading.Thread(target=self._pump, args=(pipe, stream), daemon=True).start()
+        self.closed = False
+
+    def send(self, data):
+        self.proc.stdin.write(data)
+        self.proc.stdin.flush()
+
+    def close_stdin(self):
+        self.proc.stdin.close()
+
+    def read_frame(self, deadline=None):
+        while self._open:
+            timeout = None
+            if deadline is not None:
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    raise ExecTimeout()
+            try:
+                stream, data = self._frames.get(timeout=timeout)
+            except queue.Empty:
+                raise ExecTimeout()
+            if stream is None:
+                self._open -= 1
+                continue
+            return stream, data
+        return None, b""
+
+    def exit_code(self):
+        code = self.proc.wait()
+        # Report signals the way Docker does
+        return 128 - code if code < 0 else code
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            os.killpg(self.proc.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+        self.proc.wait()
+        for pipe in (self.proc.stdin, self.proc.stdout, self.proc.stderr):
+            try:
+                pipe.close()
+            except OSError:
+                pass
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def _pump(self, pipe, stream):
+        try:
+            for chunk in iter(lambda: os.read(pipe.fileno(), 65536), b""):
+                self._frames.put((stream, chunk))
+        except (OSError, ValueError):
+            pass
+        self._frames.put((None, b""))
@@ -0,0 +1,137 @@
+import logging
+import os
+from docker.errors import APIError
+from . import config
+
+logger = logging.getLogger(__name__)
+
+# Where a container's cgroup lives under CGROUP_ROOT for the common cgroup drivers
+CGROUP_V2_DIRS = ("system.slice/docker-{id}.scope", "docker/{id}")
+CGROUP_V1_DIRS = ("{controller}/docker/{id}", "{controller}/system.slice/docker-{id}.scope")
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def _read_int(path):
+    value = _read(path)
+    return int(value) if value is not None and value.strip().isdigit() else None
+
+
+class ResourceSampler:
+    # Reads cumulative CPU, memory and I/O counters for a container. cgroup files are read
+    # directly when the API runs on the Docker host (microseconds); otherwise the one-shot
+    # stats API is used, which is slow and therefore only allowed off the request path.
+    def __init__(self, client, cgroup_root=None):
+        self.client = client
+        self.cgroup_root = config.CGROUP_ROOT if cgroup_root is None else cgroup_root
+        self.paths = {}  # container id -> ("v2", dir) or ("v1", None)
+
+    def sample(self, container, allow_api=True):
+        location = self._locate(container.id)
+        if location is not None:
+            version, path = location
+            return self._sample_v2(path) if version == "v2" else self._sample_v1(container.id)
+        if allow_api and config.RESOURCE_STATS_API_FALLBACK:
+            return self._sample_api(container)
+        return None
+
+    def forget(self, container_id):
+        self.paths.pop(container_id, None)
+
+    @staticmethod
+    def usage(before, after):
+        if after is None:
+            return {}
+        before = before or {}
+
+        def delta(key):
+            if after.get(key) is None:
+                return None
+            return max(after[key] - (before.get(key) or 0), 0)
+
+        cpu_ns = delta("cpu_ns")
+        return {
+            "cpu_seconds": cpu_ns / 1e9 if cpu_ns is not None else None,
+            # cgroups only track a peak per container, so for a reused container this is an upper bound
+            "memory_peak_bytes": after.get("memory_peak_bytes") or after.get("memory_bytes"),
+            "memory_bytes": after.get("memory_bytes"),
+            "io_read_bytes": delta("io_read_bytes"),
+            "io_write_bytes": delta("io_write_bytes")
+        }
+
+    def _locate(self, container_id):
+        if container_id in self.paths:
+            return self.paths[container_id]
+        location = None
+        for pattern in CGROUP_V2_DIRS:
+            path = os.path.join(self.cgroup_root, pattern.format(id=container_id))
+            if os.path.exists(os.path.join(path, "cpu.stat")):
+                location = ("v2", path)
+                break
+        else:
+            path = os.path.join(self.cgroup_root, CGROUP_V1_DIRS[0].format(controller="cpuacct", id=container_id))
+            if os.path.exists(os.path.join(path, "cpuacct.usage")):
+                location = ("v1", None)
+        if location is not None:
+            self.paths[container_id] = location
+        return location
+
+    def _sample_v2(self, path):
+        sample = {"cpu_ns": None, "io_read_bytes": 0, "io_write_bytes": 0}
+        for line in (_read(os.path.join(path, "cpu.stat")) or "").splitlines():
+            key, _, value = line.partition(" ")
+            if key == "usage_usec":
+                sample["cpu_ns"] = int(value) * 1000
+        sample["memory_bytes"] = _read_int(os.path.join(path, "memory.current"))
+        sample["memory_peak_bytes"] = _read_int(os.path.join(path, "memory.peak"))
+        for line in (_read(os.path.join(path, "io.stat")) or "").splitlines():
+            for field in line.split()[1:]:
+                key, _, value = field.partition("=")
+                if key == "rbytes":
+                    sample["io_read_bytes"] += int(value)
+                elif key == "wbytes":
+                    sample["io_write_bytes"] += int(value)
+        return sample
+
+    def _sample_v1(self, container_id):
+        def path(controller, name):
+            return os.path.join(self.cgroup_root, CGROUP_V1_DIRS[0].format(controller=controller, id=container_id), name)
+
+        sample = {
+            "cpu_ns": _read_int(path("cpuacct", "cpuacct.usage")),
+            "memory_bytes": _read_int(path("memory", "memory.usage_in_bytes")),
+            "memory_peak_bytes": _read_int(path("memory", "memory.max_usage_in_bytes")),
+            "io_read_bytes": 0,
+            "io_write_bytes": 0
+        }
+        for line in (_read(path("blkio", "blkio.throttle.io_service_bytes")) or "").splitlines():
+            parts = line.split()
+            if len(parts) == 3 and parts[1] in ("Read", "Write"):
+                sample["io_read_bytes" if parts[1] == "Read" else "io_write_bytes"] += int(parts[2])
+        return sample
+
+    def _sample_api(self, container):
+        try:
+            stats = container.stats(stream=False)
+        except APIError as e:
+            logger.warning(f"Failed to read stats for container {container.id}: {str(e)}")
+            return None
+        memory = stats.get("memory_stats") or {}
+        sample = {
+            "cpu_ns": ((stats.get("cpu_stats") or {}).get("cpu_usage") or {}).get("total_usage"),
+            "memory_bytes": memory.get("usage"),
+            "memory_peak_bytes": memory.get("max_usage"),
+            "io_read_bytes": 0,
+            "io_write_bytes": 0
+        }
+        for entry in (stats.get("blkio_stats") or {}).get("io_service_bytes_recursive") or []:
+            op = entry.get("op", "").lower()
+            if op in ("read", "write"):
+                sample[f"io_{op}_bytes"] += entry.get("value", 0)
+        return sample
@@ -0,0 +1,146 @@
+import contextvars
+import threading
+import time
+import uuid
+from collections import deque
+from . import config
+
+_current = contextvars.ContextVar("trace", default=None)
+
+
+class Trace:
+    def __init__(self, request_id, name):
+        self.request_id = request_id
+        self.name = name
+        self.start = time.time()
+        self.duration = None
+        self.status = None
+        self.spans = []  # {"name", "start" (seconds after the trace started), "duration"}
+
+    def add(self, name, start, duration):
+        # list.append is atomic, so spans can arrive from executor and reaper threads
+        self.spans.append({"name": name, "start": start - self.start, "duration": duration})
+
+    def finish(self):
+        self.duration = time.time() - self.start
+
+    def server_timing(self):
+        totals = {}
+        for span in list(self.spans):
+            totals[span["name"]] = totals.get(span["name"], 0.0) + span["duration"]
+        totals["total"] = time.time() - self.start
+        return ", ".join(f"{name};dur={duration * 1000:.2f}" for name, duration in totals.items())
+
+    def to_dict(self):
+        return {
+            "request_id": self.request_id,
+            "name": self.name,
+            "start": self.start,
+            "duration": self.duration,
+            "status": self.status,
+            "spans": sorted(list(self.spans), key=lambda span: span["start"])
+        }
+
+
+class _Span:
+    __slots__ = ("trace", "name", "start")
+
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        self.trace.add(self.name, self.start, time.time() - self.start)
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(name):
+    # Outside a traced request this is a context variable lookup and a shared no-op object
+    trace = _current.get()
+    return _NO_SPAN if trace is None else _Span(trace, name)
+
+
+def add_span(name, start, duration):
+    trace = _current.get()
+    if trace is not None:
+        trace.add(name, start, duration)
+
+
+class TraceBuffer:
+    def __init__(self, size=None):
+        self.traces = deque(maxlen=config.TRACE_BUFFER_SIZE if size is None else size)
+        self.lock = threading.Lock()
+
+    def add(self, trace):
+        with self.lock:
+            self.traces.append(trace)
+
+    def get(self, request_id):
+        with self.lock:
+            for trace in reversed(self.traces):
+                if trace.request_id == request_id:
+                    return trace.to_dict()
+        return None
+
+    def recent(self, limit=100, path=None):
+        with self.lock:
+            traces = list(self.traces)
+        if path:
+            traces = [trace for trace in traces if trace.name.split(" ", 1)[-1] == path]
+        return [trace.to_dict() for trace in reversed(traces[-limit:])]
+
+
+traces = TraceBuffer()
+
+
+class TracingMiddleware:
+    # Plain ASGI middleware, so streaming request and response bodies pass straight through.
+    # Every HTTP request gets a trace with a request id (taken from X-Request-ID when sent);
+    # its spans are summarised in a Server-Timing header and kept in the trace buffer, where
+    # spans that finish after the response (such as release) still arrive.
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        request_id = None
+        for name, value in scope.get("headers", []):
+            if name == b"x-request-id":
+                request_id = value.decode("latin-1")[:64]
+        trace = Trace(request_id or uuid.uuid4().hex[:16], f"{scope['method']} {scope['path']}")
+        token = _current.set(trace)
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                trace.status = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"x-request-id", trace.request_id.encode("latin-1")))
+                if config.TRACE_SERVER_TIMING:
+                    headers.append((b"server-timing", trace.server_timing().encode()))
+                message = dict(message, headers=headers)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            trace.finish()
+            _current.reset(token)
+            traces.add(trace)
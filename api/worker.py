@@ -0,0 +1,109 @@
+import base64
+import hashlib
+import json
+import logging
+import time
+from .exec_stream import ExecStream, STDOUT
+
+logger = logging.getLogger(__name__)
+
+MARKER = b"\x1e"
+LOAD_TIMEOUT = 30
+MAX_STDERR_BYTES = 64 * 1024
+
+WORKER_COMMANDS = {
+    "python": ["python", "-u", "/opt/worker/python_worker.py"],
+    "javascript": ["node", "/opt/worker/js_worker.js"],
+}
+
+# How a function's code is run: "script" reads its payload on stdin and prints its result for
+# every invocation; "handler" defines handler(event), loaded once into a persistent worker
+ENTRYPOINTS = ("script", "handler")
+
+
+class WorkerError(Exception):
+    pass
+
+
+def uses_worker(func_data):
+    return func_data.get('entrypoint') == "handler"
+
+
+def code_hash(code):
+    return hashlib.sha256(code.encode()).hexdigest()[:16]
+
+
+def version_hash(func_data):
+    # Functions read from the registry carry their code store hash, which saves rehashing the code
+    return func_data['code_hash'][:16] if func_data.get('code_hash') else code_hash(func_data['code'])
+
+
+class WorkerChannel:
+    def __init__(self, client, container, language, code, stream=None, load_timeout=LOAD_TIMEOUT):
+        # stream overrides the docker exec, e.g. with a local ProcessStream. Loading runs the
+        # code's module level, so callers bound it by the function's own timeout.
+        self.container = container
+        self.stream = stream or ExecStream(client, container, WORKER_COMMANDS[language])
+        self._stdout = bytearray()
+        self.stderr = bytearray()
+        self._next_id = 0
+        try:
+            self._send({"code": code})
+            ready = self._read_message(time.time() + load_timeout)
+        except Exception:
+            self.close()
+            raise
+        if not ready.get("ready"):
+            self.close()
+            raise WorkerError(ready.get("error", "Function failed to load"))
+        logger.info(f"Worker loaded in {f'container {container.id}' if container is not None else 'local process'}")
+
+    @property
+    def alive(self):
+        return not self.stream.closed
+
+    def call(self, payload, timeout, grace=0):
+        # The worker enforces timeout itself; grace is how much longer we wait before giving up on it
+        self._next_id += 1
+        request_id = self._next_id
+        deadline = time.time() + timeout + grace
+        try:
+            request = {"id": request_id, "timeout": timeout}
+            if isinstance(payload, bytes):
+                request["payload_b64"] = base64.b64encode(payload).decode()
+            else:
+                request["payload"] = payload
+            self._send(request)
+            while True:
+                message = self._read_message(deadline)
+                if message.get("id") == request_id:
+                    return message
+        except Exception:
+            # A timed out or broken worker is in an unknown state and must not be reused
+            self.close()
+            raise
+
+    def close(self):
+        self.stream.close()
+
+    def _send(self, message):
+        self.stream.send(json.dumps(message).encode() + b"\n")
+
+    def _read_message(self, deadline):
+        while True:
+            newline = self._stdout.find(b"\n")
+            if newline >= 0:
+                line = bytes(self._stdout[:newline])
+                del self._stdout[:newline + 1]
+                if line.startswith(MARKER):
+                    return json.loads(line[len(MARKER):])
+                continue
+            stream, data = self.stream.read_frame(deadline)
+            if stream is None:
+                self.close()
+                raise WorkerError(f"Worker exited: {self.stderr.decode(errors='replace')}")
+            if stream == STDOUT:
+                self._stdout.extend(data)
+            else:
+                self.stderr.extend(data)
+                del self.stderr[:-MAX_STDERR_BYTES]
@@ -0,0 +1,242 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+# Containers are created on demand so the first call to each function is a true cold start
+os.environ.setdefault("PREWARM_ON_DEPLOY", "0")
+
+import httpx  # noqa: E402
+
+HANDLER_CODE = {
+    "python": "def handler(event):\n    return len(event.get('data', ''))\n",
+    "javascript": "exports.handler = (event) => (event.data || '').length;\n",
+}
+SCRIPT_CODE = {
+    "python": "import sys, json\nprint(len(json.load(sys.stdin).get('data', '')))\n",
+    "javascript": "let s = '';\nprocess.stdin.on('data', c => s += c).on('end', () => console.log((JSON.parse(s).data || '').length));\n",
+}
+PHASES = ("queue_wait", "acquire", "exec", "release", "total")
+
+
+def percentiles(values):
+    values = sorted(v for v in values if v is not None)
+    if not values:
+        return None
+
+    def q(p):
+        return values[min(int(p * len(values)), len(values) - 1)]
+
+    return {"count": len(values), "mean": sum(values) / len(values), "p50": q(0.5), "p90": q(0.9),
+            "p95": q(0.95), "p99": q(0.99), "max": values[-1]}
+
+
+class Harness:
+    def __init__(self, client, flush=None):
+        self.client = client
+        self.flush = flush  # Waits for background releases when running in-process
+
+    async def deploy(self, name, language, kind, runtime):
+        code = HANDLER_CODE[language] if kind == "handler" else SCRIPT_CODE[language]
+        response = await self.client.post("/functions/", json={
+            "name": name, "language": language, "code": code, "timeout": 30, "runtime": runtime, "entrypoint": kind,
+            "route": name, "max_concurrency": 1000
+        })
+        response.raise_for_status()
+        return response.json()
+
+    async def invoke(self, func, payload):
+        start = time.perf_counter()
+        response = await self.client.post(f"/execute/{func['id']}", json=payload)
+        return time.perf_counter() - start, response.status_code == 200
+
+    async def scenario(self, runtime, language, kind, payload_size, concurrency, requests):
+        payload = {"data": "x" * payload_size}
+        tag = f"bench-{runtime}-{kind}-{payload_size}-{concurrency}-{int(time.time() * 1000)}"
+        funcs = [await self.deploy(f"{tag}-{i}", language, kind, runtime) for i in range(concurrency)]
+        try:
+            # Cold: the first call to each freshly deployed function, all at once
+            cold = await asyncio.gather(*(self.invoke(func, payload) for func in funcs))
+            await self._settle()
+
+            # Warm: keep `concurrency` calls in flight across the now-warm functions
+            since = time.time()
+            queue = asyncio.Queue()
+            for i in range(requests):
+                queue.put_nowait(funcs[i % len(funcs)])
+            warm = []
+
+            async def worker():
+                while not queue.empty():
+                    warm.append(await self.invoke(queue.get_nowait(), payload))
+
+            wall_start = time.perf_counter()
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+            wall = time.perf_counter() - wall_start
+            await self._settle()
+            phases = await self._phases(funcs, since)
+        finally:
+            for func in funcs:
+                await self.client.delete(f"/functions/{func['id']}")
+
+        return {
+            "runtime": runtime,
+            "language": language,
+            "kind": kind,
+            "payload_bytes": payload_size,
+            "concurrency": concurrency,
+            "requests": requests,
+            "cold": percentiles([t for t, ok in cold if ok]),
+            "warm": percentiles([t for t, ok in warm if ok]),
+            "errors": sum(1 for _, ok in cold + warm if not ok),
+            "requests_per_second": len(warm) / wall if wall else None,
+            "phases": phases
+        }
+
+    async def _settle(self):
+        if self.flush is not None:
+            await asyncio.get_running_loop().run_in_executor(None, self.flush)
+
+    async def _phases(self, funcs, since):
+        # Server-side breakdown from the metrics API; release is only known once recycling is done
+        records = []
+        for func in funcs:
+            response = await self.client.get("/metrics/", params={"route": func["route"], "since": since})
+            records.extend(response.json())
+        return {phase: percentiles([r["phases"].get(phase) for r in records]) for phase in PHASES}
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    return {"commit": commit or None, "python": platform.python_version(), "platform": platform.platform(),
+            "cpus": os.cpu_count(), "timestamp": time.time()}
+
+
+def compare(results, baseline):
+    # Prints how each scenario moved against a previous results file
+    def key(r):
+        return (r["runtime"], r["language"], r["kind"], r["payload_bytes"], r["concurrency"])
+
+    before = {key(r): r for r in baseline["scenarios"]}
+    for result in results["scenarios"]:
+        old = before.get(key(result))
+        if old is None:
+            continue
+        parts = []
+        for label, new_value, old_value in (
+            ("cold p50", (result["cold"] or {}).get("p50"), (old["cold"] or {}).get("p50")),
+            ("warm p50", (result["warm"] or {}).get("p50"), (old["warm"] or {}).get("p50")),
+            ("warm p99", (result["warm"] or {}).get("p99"), (old["warm"] or {}).get("p99")),
+            ("req/s", result["requests_per_second"], old["requests_per_second"]),
+        ):
+            if new_value and old_value:
+                parts.append(f"{label} {(new_value - old_value) / old_value * 100:+.1f}%")
+        print(f"{'/'.join(str(k) for k in key(result))}: {', '.join(parts)}")
+
+
+def report(result):
+    def ms(summary, q):
+        return f"{summary[q] * 1000:.1f}" if summary else "-"
+
+    phases = " ".join(f"{phase}={ms(result['phases'][phase], 'p50')}" for phase in PHASES)
+    print(f"{result['runtime']:>6} {result['kind']:>7} {result['payload_bytes']:>8}B c={result['concurrency']:<4} "
+          f"cold p50={ms(result['cold'], 'p50')}ms warm p50={ms(result['warm'], 'p50')}ms "
+          f"p99={ms(result['warm'], 'p99')}ms {result['requests_per_second'] or 0:.1f} req/s "
+          f"errors={result['errors']} | {phases}")
+
+
+def warn(message):
+    print(f"warning: {message}", file=sys.stderr)
+
+
+async def check_server(client):
+    # Cold starts are only cold if the server neither pre-warms on deploy nor forwards the first
+    # call to a peer that already has a warm container
+    capacity = (await client.get("/metrics/capacity")).json()
+    nodes = (await client.get("/nodes/")).json()
+    problems = []
+    if capacity.get("prewarm_on_deploy"):
+        problems.append("it pre-warms functions on deploy (PREWARM_ON_DEPLOY=0 turns that off)")
+    if capacity.get("dispatch_enabled") and len(nodes) > 1:
+        problems.append(f"it forwards calls to {len(nodes) - 1} peer node(s) (DISPATCH_ENABLED=0 turns that off)")
+    for problem in problems:
+        warn(f"cold latency will include warm containers: {problem}")
+    return problems
+
+
+def parse_list(value, cast=str):
+    return [cast(v) for v in value.split(",") if v]
+
+
+async def main(args):
+    flush = None
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=120)
+        await check_server(client)
+    else:
+        if "local" in parse_list(args.runtimes):
+            # Asking for the runtime on the command line is the opt-in for this process
+            os.environ.setdefault("LOCAL_BACKEND_ENABLED", "1")
+        from api import execution
+        from api.main import app
+        from api.migrate import upgrade
+        from api.models import engine
+
+        upgrade(engine)
+        docker_client = None
+        if args.docker == "fake":
+            # The same fake client as the test suite: Docker calls are answered in memory and
+            # execs run as local subprocesses, so this needs neither a daemon nor images
+            sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+            from tests.fakes import FakeDockerClient
+            docker_client = FakeDockerClient()
+        engine_ = execution.init_engine(client=docker_client)
+        flush = engine_.flush
+        client = httpx.AsyncClient(app=app, base_url="http://bench", timeout=120)
+
+    harness = Harness(client, flush)
+    results = {"environment": environment(), "settings": vars(args), "scenarios": []}
+    try:
+        for runtime in parse_list(args.runtimes):
+            for kind in parse_list(args.kinds):
+                for payload_size in parse_list(args.payload_sizes, int):
+                    for concurrency in parse_list(args.concurrency, int):
+                        result = await harness.scenario(runtime, args.language, kind, payload_size,
+                                                        concurrency, args.requests)
+                        results["scenarios"].append(result)
+                        report(result)
+    finally:
+        await client.aclose()
+        if not args.url:
+            execution.shutdown_engine()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cold start, warm start and throughput benchmarks")
+    parser.add_argument("--url", help="Benchmark a running API instead of the app in-process")
+    parser.add_argument("--docker", choices=("real", "fake"), default="real",
+                        help="In-process only: use the Docker daemon or the in-memory fake")
+    parser.add_argument("--runtimes", default="runc", help="Comma-separated, e.g. runc,runsc,local")
+    parser.add_argument("--kinds", default="handler,script", help="handler (persistent worker) and/or script")
+    parser.add_argument("--language", default="python", choices=("python", "javascript"))
+    parser.add_argument("--payload-sizes", default="16,65536", help="Comma-separated payload sizes in bytes")
+    parser.add_argument("--concurrency", default="1,8", help="Comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=200, help="Warm requests per scenario")
+    parser.add_argument("--output", help="Write results as JSON")
+    parser.add_argument("--compare", help="Baseline results JSON to compare against")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,83 @@
+// Long-lived function worker: loads the function code once, then serves invocations
+// framed as one JSON document per line on stdin. Replies are written to stdout prefixed
+// with a record separator so stray output can never be mistaken for one.
+const readline = require('readline');
+const util = require('util');
+
+const MARKER = '\x1e';
+const write = process.stdout.write.bind(process.stdout);
+
+class FunctionTimeout extends Error {}
+
+function reply(message) {
+  write(MARKER + JSON.stringify(message) + '\n');
+}
+
+// Anything the function prints outside a handler call goes to stderr
+process.stdout.write = process.stderr.write.bind(process.stderr);
+
+function load(code) {
+  const module = { exports: {} };
+  const factory = new Function('module', 'exports', 'require',
+    code + '\n;return typeof handler === "function" ? handler : module.exports.handler;');
+  const handler = factory(module, module.exports, require);
+  if (typeof handler !== 'function') {
+    throw new Error('function code must define a handler(event) function');
+  }
+  return handler;
+}
+
+async function invoke(handler, request) {
+  const captured = [];
+  const log = console.log;
+  console.log = (...args) => captured.push(util.format(...args) + '\n');
+  let timer = null;
+  const deadline = new Promise((resolve, reject) => {
+    if (request.timeout) {
+      timer = setTimeout(() => reject(new FunctionTimeout()), request.timeout * 1000);
+    }
+  });
+  try {
+    const payload = 'payload_b64' in request ? Buffer.from(request.payload_b64, 'base64') : request.payload;
+    const value = await Promise.race([handler(payload), deadline]);
+    const logs = captured.join('');
+    let result;
+    if (value === undefined || value === null) {
+      result = logs;
+    } else if (typeof value === 'string') {
+      result = value;
+    } else {
+      result = JSON.stringify(value);
+    }
+    reply({ id: request.id, ok: true, result, logs });
+  } catch (err) {
+    if (err instanceof FunctionTimeout) {
+      // The handler may still be running in the background, so this worker cannot be reused
+      reply({ id: request.id, ok: false, timeout: true, recoverable: false, error: 'Execution timed out', logs: captured.join('') });
+      process.exit(1);
+    }
+    reply({ id: request.id, ok: false, error: (err && err.stack) || String(err), logs: captured.join('') });
+  } finally {
+    clearTimeout(timer);
+    console.log = log;
+  }
+}
+
+const lines = readline.createInterface({ input: process.stdin });
+let handler = null;
+let queue = Promise.resolve();
+
+lines.on('line', (line) => {
+  const message = JSON.parse(line);
+  if (handler === null) {
+    try {
+      handler = load(message.code);
+      reply({ ready: true });
+    } catch (err) {
+      reply({ ready: false, error: (err && err.stack) || String(err) });
+      process.exit(1);
+    }
+    return;
+  }
+  queue = queue.then(() => invoke(handler, message));
+});
@@ -0,0 +1,80 @@
+# Long-lived function worker: loads the function code once, then serves invocations
+# framed as one JSON document per line on stdin. Replies are written to the original
+# stdout prefixed with a record separator so stray output can never be mistaken for one.
+import asyncio
+import base64
+import io
+import json
+import os
+import signal
+import sys
+import traceback
+from contextlib import redirect_stdout
+
+MARKER = "\x1e"
+
+
+class FunctionTimeout(BaseException):
+    # Not an Exception subclass, so a broad "except Exception" in user code cannot swallow it
+    pass
+
+
+def on_alarm(signum, frame):
+    raise FunctionTimeout()
+
+
+def payload(request):
+    if "payload_b64" in request:
+        return base64.b64decode(request["payload_b64"])
+    return request.get("payload")
+
+
+def main():
+    channel = os.fdopen(os.dup(1), "w", buffering=1)
+    # Anything the function writes to fd 1 outside a handler call lands on stderr
+    os.dup2(2, 1)
+
+    def reply(message):
+        channel.write(MARKER + json.dumps(message) + "\n")
+
+    load = json.loads(sys.stdin.readline())
+    namespace = {"__name__": "__function__"}
+    try:
+        exec(compile(load["code"], "<function>", "exec"), namespace)
+        handler = namespace["handler"]
+    except BaseException:
+        reply({"ready": False, "error": traceback.format_exc()})
+        return
+    reply({"ready": True})
+    signal.signal(signal.SIGALRM, on_alarm)
+
+    for line in sys.stdin:
+        request = json.loads(line)
+        captured = io.StringIO()
+        try:
+            with redirect_stdout(captured):
+                signal.setitimer(signal.ITIMER_REAL, request.get("timeout") or 0)
+                try:
+                    value = handler(payload(request))
+                    if asyncio.iscoroutine(value):
+                        # async def handlers run to completion on a fresh event loop per call
+                        value = asyncio.run(value)
+                finally:
+                    signal.setitimer(signal.ITIMER_REAL, 0)
+            if value is None:
+                result = captured.getvalue()
+            elif isinstance(value, str):
+                result = value
+            else:
+                result = json.dumps(value)
+            reply({"id": request["id"], "ok": True, "result": result, "logs": captured.getvalue()})
+        except FunctionTimeout:
+            # The handler was interrupted cleanly, so this worker can keep serving
+            reply({"id": request["id"], "ok": False, "timeout": True, "recoverable": True,
+                   "error": "Execution timed out", "logs": captured.getvalue()})
+        except BaseException:
+            reply({"id": request["id"], "ok": False, "error": traceback.format_exc(), "logs": captured.getvalue()})
+
+
+if __name__ == "__main__":
+    main()
@@ -3,8 +3,8 @@ import requests
 import plotly.express as px
 import pandas as pd
 import json
-from datetime import datetime
 import time
+from urllib.parse import urlencode
 
 API_URL = "http://localhost:8000"
 
@@ -41,6 +41,8 @@ def main():
             with col1:
                 name = st.text_input("Function Name", placeholder="e.g., my_function")
                 language = st.selectbox("Language", ["python", "javascript"])
+                entrypoint = st.selectbox("Entrypoint", ["script", "handler"],
+                                          help="script: payload on stdin, result printed. handler: handler(event) served by a persistent worker")
             with col2:
                 timeout = st.number_input("Timeout (seconds)", min_value=1, value=30)
                 runtime = st.selectbox("Runtime", ["runc", "runsc"])
@@ -50,26 +52,46 @@ def main():
                 - `runsc`: gVisor sandboxed runtime (more secure, slightly slower)
                 """)
                 route_suffix = st.text_input("Route Suffix (optional)", placeholder="echo", help="Will be /fn/{unique_id}/{suffix}, leave blank for 'default'")
+            col5, col6, col7 = st.columns(3)
+            memory_mb = col5.number_input("Memory (MiB)", min_value=64, value=1024, step=64)
+            cpus = col6.number_input("CPUs", min_value=0.1, value=2.0, step=0.1)
+            max_concurrency = col7.number_input("Max Concurrency", min_value=1, value=10)
+            cacheable = st.checkbox("Cacheable", help="Deterministic function: identical payloads may be answered from the result cache")
             code = st.text_area("Code", height=200, placeholder="Enter your code here")
+            dependencies = st.text_area("Dependencies (optional)", height=80, placeholder="requirements.txt lines, or package.json for JavaScript",
+                                        help="Installed once into a prebuilt image when the function is deployed")
             submit = st.form_submit_button("Deploy")
             if submit:
                 if not name or not code:
                     st.error("Function Name and Code are required!")
                 else:
-                    func = {"name": name, "language": language, "code": code, "timeout": timeout, "runtime": runtime}
+                    func = {"name": name, "language": language, "code": code, "timeout": timeout, "runtime": runtime, "entrypoint": entrypoint,
+                            "memory_mb": memory_mb, "cpus": cpus, "max_concurrency": max_concurrency, "cacheable": cacheable}
                     if route_suffix:
                         func["route"] = route_suffix
+                    if dependencies.strip():
+                        func["dependencies"] = dependencies
                     result = api_call("POST", "/functions/", func)
                     if result:
                         st.success(f"Function {result['id']} deployed successfully! Route: {result['route']}")
 
     elif page == "Manage Functions":
         st.header("Manage Functions")
-        funcs = api_call("GET", "/functions/")
+        # Listings come a page at a time; each page starts after the last id of the previous one
+        if "page_starts" not in st.session_state:
+            st.session_state.page_starts = [0]
+        funcs = api_call("GET", f"/functions/?after={st.session_state.page_starts[-1]}&limit=100")
         if funcs:
             df = pd.DataFrame(funcs)
-            display_columns = ["id", "name", "language", "code", "timeout", "route"]
+            display_columns = ["id", "name", "language", "runtime", "timeout", "route"]
             st.dataframe(df[display_columns], use_container_width=True)
+            col_prev, col_next = st.columns(2)
+            if col_prev.button("Previous Page", disabled=len(st.session_state.page_starts) == 1):
+                st.session_state.page_starts.pop()
+                st.rerun()
+            if col_next.button("Next Page", disabled=len(funcs) < 100):
+                st.session_state.page_starts.append(funcs[-1]["id"])
+                st.rerun()
 
             if "selected_func_id" not in st.session_state:
                 st.session_state.selected_func_id = None
@@ -86,6 +108,7 @@ def main():
                         with col1:
                             name = st.text_input("Function Name", value=func["name"])
                             language = st.selectbox("Language", ["python", "javascript"], index=["python", "javascript"].index(func["language"]))
+                            entrypoint = st.selectbox("Entrypoint", ["script", "handler"], index=["script", "handler"].index(func.get("entrypoint") or "script"))
                         with col2:
                             timeout = st.number_input("Timeout (seconds)", min_value=1, value=func["timeout"])
                             route_suffix = st.text_input("Route Suffix", value=func["route"].split("/")[-1])
@@ -100,6 +123,7 @@ def main():
                                 "id": st.session_state.selected_func_id,
                                 "name": name,
                                 "language": language,
+                                "entrypoint": entrypoint,
                                 "code": code,
                                 "timeout": timeout,
                                 "route": route_suffix
@@ -118,6 +142,22 @@ def main():
                                 st.session_state.selected_func_id = None
                                 time.sleep(1)
                                 st.rerun()
+
+                    st.subheader("Version History")
+                    versions = api_call("GET", f"/functions/{st.session_state.selected_func_id}/versions")
+                    if versions:
+                        versions_df = pd.DataFrame(versions)
+                        versions_df["created_at"] = pd.to_datetime(versions_df["created_at"], unit="s")
+                        versions_df["active"] = versions_df["version"] == func["version"]
+                        st.dataframe(versions_df[["version", "active", "code_hash", "created_at"]], use_container_width=True)
+                        col5, col6 = st.columns(2)
+                        target = col5.selectbox("Version", [v["version"] for v in versions if v["version"] != func["version"]])
+                        if target and col6.button("Roll Back to Version"):
+                            result = api_call("POST", f"/functions/{st.session_state.selected_func_id}/versions/{target}/activate")
+                            if result:
+                                st.success(f"Function {st.session_state.selected_func_id} is now at version {target}")
+                                time.sleep(1)
+                                st.rerun()
                 else:
                     st.warning(f"Function {st.session_state.selected_func_id} not found.")
         else:
@@ -154,37 +194,69 @@ def main():
     elif page == "Metrics Dashboard":
         st.header("Metrics Dashboard")
         route_filter = st.text_input("Filter by Route (optional, leave blank for all)", placeholder="/fn/abc12345/echo")
-        metrics = api_call("GET", "/metrics/" if not route_filter else f"/metrics/?route={route_filter}")
-        if metrics:
-            # Handle single dict or list of dicts
-            if isinstance(metrics, dict):
-                metrics = [metrics]  # Wrap single dict in list
-            df = pd.DataFrame(metrics)
-            if not df.empty:
-                # Ensure required columns exist
-                if "timestamp" not in df.columns:
-                    df["timestamp"] = pd.to_datetime(datetime.now())
-                else:
-                    df["timestamp"] = pd.to_datetime(df["timestamp"], unit="s")
-                if "errors" not in df.columns:
-                    df["errors"] = None
-                if "route" not in df.columns:
-                    df["route"] = route_filter or "unknown"
-                if "resources" in df.columns:
-                    # Flatten resources dict if needed
-                    df["cpu_usage"] = df["resources"].apply(lambda x: x.get("cpu", "N/A") if isinstance(x, dict) else "N/A")
-                    df["memory_usage"] = df["resources"].apply(lambda x: x.get("memory", "N/A") if isinstance(x, dict) else "N/A")
-                st.write("Metrics Data:", df[["route", "timestamp", "response_time", "cpu_usage", "memory_usage", "errors"]])
-                fig = px.line(df, x="timestamp", y="response_time", color="route", 
-                              title="Response Time Over Time", labels={"response_time": "Response Time (s)"})
+        col_bucket, col_refresh = st.columns([3, 1])
+        bucket = col_bucket.selectbox("Resolution", [10, 60, 300], format_func=lambda seconds: f"{seconds} s buckets")
+        col_refresh.button("Refresh")
+        route_params = {"route": route_filter} if route_filter else {}
+
+        # Chart points are kept between reruns and only buckets from the last cursor on are
+        # fetched, so a refresh costs the same however much history there is
+        if st.session_state.get("series_key") != (route_filter, bucket):
+            st.session_state.series_key = (route_filter, bucket)
+            st.session_state.series_points = pd.DataFrame()
+            st.session_state.series_cursor = None
+        cursor = st.session_state.series_cursor
+        params = dict(route_params, bucket=bucket, **({"since": cursor} if cursor is not None else {}))
+        series = api_call("GET", f"/metrics/series?{urlencode(params)}")
+        if series:
+            points = st.session_state.series_points
+            if cursor is not None and not points.empty:
+                # The bucket at the cursor may have been partial; the server sends it again
+                points = points[points["start"] < cursor]
+            if series["points"]:
+                points = pd.concat([points, pd.DataFrame(series["points"])], ignore_index=True)
+            # The server keeps an hour of buckets by default; keep the chart to the same span
+            st.session_state.series_points = points[points["start"] >= time.time() - 3600] if not points.empty else points
+            st.session_state.series_cursor = series["cursor"]
+
+        points = st.session_state.series_points
+        if not points.empty:
+            points = points.assign(time=pd.to_datetime(points["start"], unit="s"))
+            fig = px.line(points, x="time", y="mean", color="route",
+                          title="Response Time Over Time", labels={"mean": "Mean Response Time (s)", "time": "Time"})
+            st.plotly_chart(fig, use_container_width=True)
+            fig = px.bar(points, x="time", y="count", color="route",
+                         title="Invocations per Bucket", labels={"count": "Invocations", "time": "Time"})
+            st.plotly_chart(fig, use_container_width=True)
+
+            st.subheader("Statistics")
+            summary = api_call("GET", f"/metrics/summary?{urlencode(route_params)}") or {}
+            count = sum(s["count"] for s in summary.values())
+            total_time = sum((s["phases"]["total"]["mean"] or 0) * s["count"] for s in summary.values())
+            errors = sum(s["error_rate"] * s["count"] for s in summary.values())
+            col1, col2, col3 = st.columns(3)
+            col1.metric("Average Response Time", f"{total_time / count:.2f} s" if count else "N/A")
+            col2.metric("Execution Count", count)
+            col3.metric("Error Rate", f"{errors / count * 100:.1f}%" if count else "N/A")
+
+            recent = api_call("GET", f"/metrics/?{urlencode(dict(route_params, limit=50))}")
+            if recent:
+                df = pd.DataFrame(recent)
+                df["timestamp"] = pd.to_datetime(df["timestamp"], unit="s")
+                # Usage is sampled after each invocation: CPU seconds consumed and peak memory
+                df["cpu_usage"] = df["resources"].apply(lambda x: f"{x['cpu_seconds']:.3f} s" if isinstance(x, dict) and x.get("cpu_seconds") is not None else "N/A")
+                df["memory_usage"] = df["resources"].apply(lambda x: f"{x['memory_peak_bytes'] / 2**20:.1f} MiB" if isinstance(x, dict) and x.get("memory_peak_bytes") else "N/A")
+                st.write("Recent Invocations:", df[["route", "timestamp", "response_time", "cpu_usage", "memory_usage", "errors"]])
+
+            # Where the time goes: mean span durations from recent request traces
+            traces = api_call("GET", "/traces/?limit=200" if not route_filter else f"/traces/?limit=200&path={route_filter}")
+            spans = [span for trace in traces or [] for span in trace["spans"]]
+            if spans:
+                spans_df = pd.DataFrame(spans)
+                breakdown = spans_df.groupby("name", sort=False)["duration"].mean().mul(1000).reset_index()
+                fig = px.bar(breakdown, x="duration", y="name", orientation="h", title="Phase Breakdown (recent requests)",
+                             labels={"duration": "Mean Duration (ms)", "name": "Phase"})
                 st.plotly_chart(fig, use_container_width=True)
-                st.subheader("Statistics")
-                col1, col2, col3 = st.columns(3)
-                col1.metric("Average Response Time", f"{df['response_time'].mean():.2f} s" if 'response_time' in df else "N/A")
-                col2.metric("Execution Count", len(df))
-                col3.metric("Error Rate", f"{(df['errors'].notnull().sum() / len(df) * 100):.1f}%")
-            else:
-                st.info("No metrics available for this filter.")
         else:
             st.info("No metrics available.")
 
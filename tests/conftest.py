@@ -0,0 +1,15 @@
+import pytest
+
+from api import execution
+from api.models import Base, engine
+from tests.fakes import FakeDockerClient
+
+Base.metadata.create_all(bind=engine)
+
+
+@pytest.fixture(autouse=True)
+def fake_engine():
+    # API tests run against an engine backed by the fake Docker client, never a real daemon
+    execution.init_engine(client=FakeDockerClient())
+    yield
+    execution.shutdown_engine()
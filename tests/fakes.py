@@ -0,0 +1,176 @@
+import itertools
+import os
+import socket
+import struct
+import io
+import subprocess
+import tarfile
+import tempfile
+import threading
+from types import SimpleNamespace
+
+from docker.errors import ImageNotFound
+
+WORKER_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "containers", "worker")
+# Files copied into fake containers land here, shared by all of them
+ROOT_DIR = tempfile.mkdtemp(prefix="fake-containers-")
+
+
+class FakeContainer:
+    _ids = itertools.count(1)
+
+    def __init__(self, image, **kwargs):
+        self.id = f"fake{next(self._ids)}"
+        self.image = image
+        self.kwargs = kwargs
+        self.status = "created"
+        self.removed = False
+        self.execs = []
+
+    def start(self):
+        self.status = "running"
+
+    def reload(self):
+        pass
+
+    def exec_run(self, cmd, **kwargs):
+        self.execs.append(cmd)
+        if cmd[-1] == "echo $$":
+            return SimpleNamespace(exit_code=0, output=b"7\n")
+        return SimpleNamespace(exit_code=0, output=b"")
+
+    def put_archive(self, path, data):
+        self.archives = getattr(self, "archives", 0) + 1
+        target = os.path.join(ROOT_DIR, path.lstrip("/"))
+        os.makedirs(target, exist_ok=True)
+        with tarfile.open(fileobj=io.BytesIO(data)) as tar:
+            for member in tar.getmembers():
+                if member.isfile() and not os.path.exists(os.path.join(target, member.name)):
+                    tar.extract(member, target)
+        return True
+
+    def stats(self, stream=True):
+        self.cpu_ns = getattr(self, "cpu_ns", 0) + 5000000
+        return {
+            "cpu_stats": {"cpu_usage": {"total_usage": self.cpu_ns}},
+            "memory_stats": {"usage": 1 << 20, "max_usage": 4 << 20},
+            "blkio_stats": {"io_service_bytes_recursive": [{"op": "Read", "value": 0}, {"op": "Write", "value": 0}]}
+        }
+
+    def remove(self, force=False):
+        self.removed = True
+        self.status = "removed"
+
+
+class FakeContainers:
+    def __init__(self):
+        self.created = []
+
+    def create(self, image, **kwargs):
+        container = FakeContainer(image, **kwargs)
+        self.created.append(container)
+        return container
+
+
+class FakeImages:
+    def __init__(self):
+        self.tags = set()
+        self.builds = []
+
+    def get(self, tag):
+        if tag not in self.tags:
+            raise ImageNotFound(tag)
+        return SimpleNamespace(tags=[tag])
+
+    def build(self, fileobj=None, tag=None, **kwargs):
+        with tarfile.open(fileobj=fileobj) as tar:
+            files = {member.name: tar.extractfile(member).read().decode() for member in tar.getmembers()}
+        self.builds.append((tag, files))
+        self.tags.add(tag)
+        return SimpleNamespace(tags=[tag]), []
+
+
+class FakeExecAPI:
+    # Runs exec commands as local subprocesses and speaks Docker's multiplexed attach protocol
+    def __init__(self):
+        self.execs = {}
+        self._ids = itertools.count(1)
+
+    def exec_create(self, container, cmd, **kwargs):
+        exec_id = f"exec{next(self._ids)}"
+        cmd = [c.replace("/opt/worker", WORKER_DIR).replace("/opt/code", os.path.join(ROOT_DIR, "opt", "code"))
+               for c in cmd]
+        self.execs[exec_id] = {"cmd": cmd, "env": kwargs.get("environment"), "process": None}
+        return {"Id": exec_id}
+
+    def exec_start(self, exec_id, socket=False):
+        ours, theirs = _socketpair()
+        spec = self.execs[exec_id]
+        env = dict(os.environ, **(spec["env"] or {}))
+        process = subprocess.Popen(spec["cmd"], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE, env=env)
+        spec["process"] = process
+        lock = threading.Lock()
+
+        def pump_stdin():
+            while True:
+                try:
+                    data = ours.recv(65536)
+                except OSError:
+                    data = b""
+                if not data:
+                    break
+                try:
+                    process.stdin.write(data)
+                    process.stdin.flush()
+                except OSError:
+                    break
+            try:
+                process.stdin.close()
+            except OSError:
+                pass
+
+        def pump_output(pipe, stream):
+            for chunk in iter(lambda: pipe.read1(65536), b""):
+                with lock:
+                    try:
+                        ours.sendall(struct.pack(">BxxxL", stream, len(chunk)) + chunk)
+                    except OSError:
+                        return
+
+        readers = [threading.Thread(target=pump_output, args=(process.stdout, 1), daemon=True),
+                   threading.Thread(target=pump_output, args=(process.stderr, 2), daemon=True)]
+
+        def finish():
+            for reader in readers:
+                reader.join()
+            process.wait()
+            ours.close()
+
+        threading.Thread(target=pump_stdin, daemon=True).start()
+        for reader in readers:
+            reader.start()
+        threading.Thread(target=finish, daemon=True).start()
+        return theirs
+
+    def exec_inspect(self, exec_id):
+        code = self.execs[exec_id]["process"].poll()
+        # Docker reports death by signal N as exit status 128 + N
+        if code is not None and code < 0:
+            code = 128 - code
+        return {"ExitCode": code, "Running": code is None}
+
+
+def _socketpair():
+    return socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+
+
+class FakeDockerClient:
+    def __init__(self):
+        self.containers = FakeContainers()
+        self.images = FakeImages()
+        self.api = FakeExecAPI()
+        self.closed = False
+
+    def close(self):
+        self.closed = True
@@ -0,0 +1,54 @@
+import asyncio
+
+import pytest
+
+from api.admission import AdmissionController, AdmissionRejected
+
+SMALL = {"id": 1, "memory_mb": 256, "cpus": 0.5, "max_concurrency": 10}
+
+
+def test_requests_wait_for_capacity_and_are_admitted_on_release():
+    async def scenario():
+        controller = AdmissionController(memory_mb=512, cpus=4, max_wait=5)
+        first = await controller.admit(SMALL)
+        await controller.admit(SMALL)
+        waiting = asyncio.ensure_future(controller.admit(SMALL))
+        await asyncio.sleep(0.01)
+        assert not waiting.done() and controller.stats()["waiting"] == 1
+        controller.release(first)
+        await asyncio.wait_for(waiting, 1)
+        assert controller.stats()["memory_mb"]["used"] == 512
+
+    asyncio.run(scenario())
+
+
+def test_overflow_and_long_waits_are_rejected():
+    async def scenario():
+        controller = AdmissionController(memory_mb=256, cpus=4, max_queue=1, max_wait=0.05)
+        await controller.admit(SMALL)
+        waiting = asyncio.ensure_future(controller.admit(SMALL))
+        await asyncio.sleep(0.01)
+        with pytest.raises(AdmissionRejected):
+            await controller.admit(SMALL)
+        with pytest.raises(AdmissionRejected):
+            await waiting
+        with pytest.raises(AdmissionRejected):
+            await controller.admit(dict(SMALL, memory_mb=1024))
+        assert controller.stats()["rejected"] == 3
+
+    asyncio.run(scenario())
+
+
+def test_per_function_concurrency_limit_does_not_block_other_functions():
+    async def scenario():
+        controller = AdmissionController(memory_mb=4096, cpus=16, max_wait=5)
+        limited = dict(SMALL, id=7, max_concurrency=1)
+        ticket = await controller.admit(limited)
+        blocked = asyncio.ensure_future(controller.admit(limited))
+        await asyncio.sleep(0.01)
+        await asyncio.wait_for(controller.admit(dict(SMALL, id=8)), 1)
+        assert not blocked.done()
+        controller.release(ticket)
+        await asyncio.wait_for(blocked, 1)
+
+    asyncio.run(scenario())
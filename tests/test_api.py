@@ -1,10 +1,214 @@
+import asyncio
+import json
 import pytest
 from fastapi.testclient import TestClient
 from api.main import app
+from sqlalchemy import create_engine, inspect, text
+from api.models import create_schema, engine
 
 client = TestClient(app)
 
 def test_create_function():
     response = client.post("/functions/", json={"name": "test", "language": "python", "code": "print('hello')", "timeout": 30})
     assert response.status_code == 200
-    assert response.json()["name"] == "test"
\ No newline at end of file
+    assert response.json()["name"] == "test"
+
+def test_unknown_languages_are_rejected():
+    func = {"name": "ruby", "language": "ruby", "code": "puts 1", "timeout": 30}
+    assert client.post("/functions/", json=func).status_code == 400
+    created = client.post("/functions/", json=dict(func, language="python", code="print(1)")).json()
+    assert client.put(f"/functions/{created['id']}", json=func).status_code == 400
+    client.delete(f"/functions/{created['id']}")
+
+def test_invalid_resource_limits_are_rejected():
+    func = {"name": "limits", "language": "python", "code": "print(1)", "timeout": 30}
+    for limits in ({"memory_mb": -100000}, {"memory_mb": "abc"}, {"memory_mb": 1.5}, {"cpus": 0},
+                   {"cpus": "nan"}, {"max_concurrency": 0}, {"max_concurrency": True}):
+        assert client.post("/functions/", json=dict(func, **limits)).status_code == 400, limits
+    created = client.post("/functions/", json=dict(func, memory_mb="256", cpus=0.5)).json()
+    assert (created["memory_mb"], created["cpus"]) == (256, 0.5)
+    assert client.put(f"/functions/{created['id']}", json=dict(func, max_concurrency=-1)).status_code == 400
+    client.delete(f"/functions/{created['id']}")
+
+def test_listing_is_paginated_and_leaves_out_code():
+    created = [client.post("/functions/", json={"name": f"page{i}", "language": "python", "code": "print(1)",
+                                                "timeout": 5}).json() for i in range(3)]
+    page = client.get("/functions/", params={"after": created[0]["id"] - 1, "limit": 2}).json()
+    assert [f["id"] for f in page] == [created[0]["id"], created[1]["id"]]
+    assert "code" not in page[0] and page[0]["route"] == created[0]["route"]
+    rest = client.get("/functions/", params={"after": page[-1]["id"], "limit": 2}).json()
+    assert rest[0]["id"] == created[2]["id"]
+    for func in created:
+        client.delete(f"/functions/{func['id']}")
+
+def test_sqlite_runs_in_wal_mode():
+    with engine.connect() as connection:
+        assert connection.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+
+def test_columns_added_since_a_database_was_created_are_migrated(tmp_path):
+    old = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with old.begin() as connection:
+        connection.execute(text("CREATE TABLE functions (id INTEGER PRIMARY KEY, name VARCHAR, language VARCHAR, "
+                                "code VARCHAR, timeout INTEGER, route VARCHAR UNIQUE, runtime VARCHAR)"))
+    create_schema(old)
+    columns = {column["name"] for column in inspect(old).get_columns("functions")}
+    assert {"memory_mb", "cpus", "max_concurrency", "cacheable", "unique_id"} <= columns
+    assert "ix_functions_unique_id" in {index["name"] for index in inspect(old).get_indexes("functions")}
+    old.dispose()
+
+def test_execute_unknown_function_returns_404():
+    response = client.post("/execute/999999", json={})
+    assert response.status_code == 404
+
+
+def test_dispatch_follows_route_updates_and_deletes(monkeypatch):
+    async def fake_execute(func_data, payload):
+        return f"ran {func_data['id']} with {payload}", 0.01, None, {}
+
+    monkeypatch.setattr("api.main.execute_function", fake_execute)
+    func = {"name": "routed", "language": "python", "code": "print(1)", "timeout": 5, "route": "before"}
+    created = client.post("/functions/", json=func).json()
+    response = client.post(created["route"], json={"x": 1})
+    assert response.json() == {"result": f"ran {created['id']} with {{'x': 1}}"}
+
+    updated = client.put(f"/functions/{created['id']}", json=dict(func, route="after")).json()
+    assert client.post(created["route"], json={}).status_code == 404
+    assert client.post(updated["route"], json={}).status_code == 200
+
+    client.delete(f"/functions/{created['id']}")
+    assert client.post(updated["route"], json={}).status_code == 404
+
+
+def test_oversized_payloads_are_refused_without_buffering_them(monkeypatch):
+    ran = []
+
+    async def fake_execute(func_data, payload):
+        ran.append(payload)
+        return "ok", 0.01, None, {}
+
+    monkeypatch.setattr("api.main.execute_function", fake_execute)
+    monkeypatch.setattr("api.main.config.MAX_PAYLOAD_BYTES", 64)
+    created = client.post("/functions/", json={"name": "capped", "language": "python", "code": "print(1)",
+                                               "timeout": 5, "route": "capped"}).json()
+    assert client.post(created["route"], content=b"x" * 65, headers={"content-type": "text/plain"}).status_code == 413
+
+    def chunks():
+        # Chunked, so there is no Content-Length to check up front
+        for _ in range(10):
+            yield b"x" * 16
+
+    assert client.post(created["route"], content=chunks(), headers={"content-type": "text/plain"}).status_code == 413
+    assert client.post(created["route"], content=b"x" * 64, headers={"content-type": "text/plain"}).status_code == 200
+    assert ran == [b"x" * 64]
+    client.delete(f"/functions/{created['id']}")
+
+
+def test_batch_streams_ndjson_results(monkeypatch):
+    async def fake_batch(func_data, payloads, concurrency=None):
+        index = 0
+        async for payload in payloads:
+            error = str(payload) if isinstance(payload, Exception) else None
+            yield {"index": index, "result": None if error else payload, "error": error, "response_time": 0.0}
+            index += 1
+
+    async def fake_list_batch(func_data, payloads, concurrency=None):
+        for index, payload in enumerate(payloads):
+            yield {"index": index, "result": payload, "error": None, "response_time": 0.0}
+
+    created = client.post("/functions/", json={"name": "batch", "language": "python", "code": "print(1)", "timeout": 5}).json()
+    monkeypatch.setattr("api.main.execute_batch", fake_list_batch)
+    response = client.post(f"/execute/{created['id']}/batch", json=[{"a": 1}, 2])
+    assert [json.loads(line)["result"] for line in response.text.splitlines()] == [{"a": 1}, 2]
+    assert client.post(f"/execute/{created['id']}/batch", json={"a": 1}).status_code == 400
+
+    monkeypatch.setattr("api.main.execute_batch", fake_batch)
+    response = client.post(f"/execute/{created['id']}/batch", content=b'{"a": 1}\nnot json\n3',
+                           headers={"content-type": "application/x-ndjson"})
+    results = [json.loads(line) for line in response.text.splitlines()]
+    assert [item["result"] for item in results] == [{"a": 1}, None, 3]
+    assert results[1]["error"] == "Invalid JSON payload"
+
+
+def test_oversized_batch_line_fails_only_its_own_item(monkeypatch):
+    monkeypatch.setattr("api.main.config.MAX_PAYLOAD_BYTES", 64)
+    created = client.post("/functions/", json={"name": "echo", "language": "python", "entrypoint": "handler",
+                                               "code": "def handler(event):\n    return event\n", "timeout": 5}).json()
+    scope = {"type": "http", "method": "POST", "path": f"/execute/{created['id']}/batch", "raw_path": b"",
+             "query_string": b"concurrency=1", "root_path": "", "scheme": "http", "server": ("testserver", 80),
+             "client": ("testclient", 50000), "http_version": "1.1",
+             "headers": [(b"content-type", b"application/x-ndjson")]}
+    # The oversized line arrives split across chunks, so it is cut off before its newline is seen
+    chunks = [b'1\n', b'"' + b'x' * 100, b'x' * 100 + b'"\n', b'2\n3\n']
+    messages = [{"type": "http.request", "body": chunk, "more_body": True} for chunk in chunks]
+    messages.append({"type": "http.request", "body": b"", "more_body": False})
+    sent = []
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        await asyncio.Event().wait()
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(asyncio.wait_for(app(scope, receive, send), 5))
+    body = b"".join(message.get("body", b"") for message in sent[1:])
+    results = sorted((json.loads(line) for line in body.splitlines()), key=lambda item: item["index"])
+    assert [item["result"] for item in results] == ["1", None, "2", "3"]
+    assert "byte limit" in results[1]["error"]
+    client.delete(f"/functions/{created['id']}")
+
+
+def test_batch_is_cancelled_when_the_client_disconnects(monkeypatch):
+    closed = []
+
+    async def endless_batch(func_data, payloads, concurrency=None):
+        try:
+            async for payload in payloads:
+                yield {"index": 0, "result": payload, "error": None, "response_time": 0.0}
+            await asyncio.Event().wait()
+        finally:
+            closed.append(True)
+
+    monkeypatch.setattr("api.main.execute_batch", endless_batch)
+    created = client.post("/functions/", json={"name": "abandoned", "language": "python", "code": "print(1)", "timeout": 5}).json()
+    scope = {"type": "http", "method": "POST", "path": f"/execute/{created['id']}/batch", "raw_path": b"",
+             "query_string": b"", "root_path": "", "scheme": "http", "server": ("testserver", 80),
+             "client": ("testclient", 50000), "http_version": "1.1",
+             "headers": [(b"content-type", b"application/x-ndjson")]}
+    messages = [{"type": "http.request", "body": b"1\n", "more_body": False}]
+    sent = []
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        # The client goes away once it has its first result
+        while not any(m.get("body") for m in sent):
+            await asyncio.sleep(0.01)
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(asyncio.wait_for(app(scope, receive, send), 5))
+    assert closed == [True] and sent[1]["body"].startswith(b'{"index": 0, "result": 1')
+    client.delete(f"/functions/{created['id']}")
+
+
+def test_stream_mode_emits_sse_with_trailers(monkeypatch):
+    async def fake_stream(func_data, payload):
+        yield "stdout", "café".encode()[:4]
+        yield "stdout", "café\nok".encode()[4:]
+        yield "stderr", b"warn"
+        yield "exit", {"exit_code": 0, "error": None, "response_time": 0.01}
+
+    monkeypatch.setattr("api.main.execute_stream", fake_stream)
+    created = client.post("/functions/", json={"name": "stream", "language": "python", "code": "print(1)", "timeout": 5}).json()
+    response = client.post(f"/execute/{created['id']}?mode=stream", json={}, headers={"accept": "text/event-stream"})
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert "event: stdout\ndata: é\ndata: ok\n\n" in response.text
+    assert response.text.endswith('event: exit\ndata: {"exit_code": 0, "error": null, "response_time": 0.01}\n\n')
+
+    response = client.post(f"{created['route']}?mode=stream", json={})
+    events = [json.loads(line) for line in response.text.splitlines()]
+    assert [e["event"] for e in events] == ["stdout", "stdout", "stderr", "exit"]
@@ -0,0 +1,101 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+from api import config, execution
+from api.backends import DockerBackend, ExecutionBackend, LocalBackend
+from api.main import app
+from tests.fakes import FakeDockerClient
+
+client = TestClient(app)
+
+
+@pytest.fixture(autouse=True)
+def local_backend(monkeypatch):
+    monkeypatch.setattr(config, "LOCAL_BACKEND_ENABLED", 1)
+
+
+def make_engine():
+    return execution.ExecutionEngine(client=FakeDockerClient())
+
+
+def test_runtime_selects_the_backend():
+    engine = make_engine()
+    try:
+        assert isinstance(engine.backend_for({"runtime": "local"}), LocalBackend)
+        runsc = engine.backend_for({"runtime": "runsc"})
+        assert isinstance(runsc, DockerBackend) and runsc.name == "docker-runsc"
+        assert engine.backend_for({}).name == "docker-runc"
+    finally:
+        engine.shutdown()
+
+
+def test_backends_must_implement_invoke():
+    class Incomplete(ExecutionBackend):
+        name = "incomplete"
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_local_runtime_is_refused_unless_enabled(monkeypatch):
+    monkeypatch.setattr(config, "LOCAL_BACKEND_ENABLED", 0)
+    func = {"name": "host", "language": "python", "code": "print(1)", "timeout": 5, "runtime": "local"}
+    assert client.post("/functions/", json=func).status_code == 400
+    created = client.post("/functions/", json=dict(func, runtime="runc")).json()
+    assert client.put(f"/functions/{created['id']}", json=func).status_code == 400
+    client.delete(f"/functions/{created['id']}")
+    engine = make_engine()
+    try:
+        assert isinstance(engine.backend_for({"runtime": "local"}), DockerBackend)
+    finally:
+        engine.shutdown()
+
+
+def test_local_scripts_run_without_containers():
+    engine = make_engine()
+    code = "import sys, json\nprint(json.load(sys.stdin)['n'] * 2)\n"
+    func = {"id": 1, "language": "python", "code": code, "timeout": 5, "runtime": "local"}
+    try:
+        result, _, errors, _ = asyncio.run(engine.execute(func, {"n": 21}))
+        assert (result, errors) == ("42\n", None)
+        slow = dict(func, code="import time\ntime.sleep(10)\n", timeout=1)
+        _, response_time, errors, _ = asyncio.run(engine.execute(slow, {}))
+        assert errors == execution.TIMEOUT_ERROR and response_time < 3
+        assert not engine.client.containers.created
+        assert engine.backend_stats()["local"]["count"] == 2
+    finally:
+        engine.shutdown()
+
+
+def test_local_handlers_reuse_a_warm_worker_process():
+    engine = make_engine()
+    code = "import os\nPID = os.getpid()\ndef handler(event):\n    return PID\n"
+    func = {"id": 2, "language": "python", "code": code, "timeout": 5, "runtime": "local", "entrypoint": "handler"}
+    try:
+        first = asyncio.run(engine.execute(func, {}))[0]
+        second = asyncio.run(engine.execute(func, {}))[0]
+        assert first == second
+        backend = engine.backends["local"]
+        assert sum(len(idle) for idle in backend.idle.values()) == 1
+    finally:
+        engine.shutdown()
+    assert not backend.idle
+
+
+def test_local_worker_eviction_skips_keys_emptied_by_takes():
+    class Worker:
+        alive = True
+        closed = False
+
+        def close(self):
+            self.closed = True
+
+    backend = LocalBackend(None, max_workers=1)
+    b, c, d = Worker(), Worker(), Worker()
+    backend._put("b", b)
+    assert backend._take("b") is b and "b" not in backend.idle
+    backend._put("c", c)
+    backend._put("d", d)
+    assert c.closed and list(backend.idle) == ["d"]
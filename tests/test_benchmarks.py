@@ -0,0 +1,38 @@
+import asyncio
+
+import httpx
+
+from api import config, execution
+from api.main import app
+from benchmarks.run import Harness, check_server, percentiles
+
+
+def test_percentiles():
+    summary = percentiles([0.3, 0.1, 0.2, None])
+    assert (summary["count"], summary["p50"], summary["max"]) == (3, 0.2, 0.3)
+    assert percentiles([]) is None
+
+
+def test_servers_that_would_hide_cold_starts_are_detected(monkeypatch):
+    async def check():
+        async with httpx.AsyncClient(app=app, base_url="http://bench") as client:
+            return await check_server(client)
+
+    monkeypatch.setattr(config, "PREWARM_ON_DEPLOY", 1)
+    assert len(asyncio.run(check())) == 1
+    monkeypatch.setattr(config, "PREWARM_ON_DEPLOY", 0)
+    assert asyncio.run(check()) == []
+
+
+def test_scenario_reports_cold_warm_and_phase_breakdown(monkeypatch):
+    monkeypatch.setattr(config, "PREWARM_ON_DEPLOY", 0)
+    async def run():
+        async with httpx.AsyncClient(app=app, base_url="http://bench") as client:
+            harness = Harness(client, execution.get_engine().flush)
+            return await harness.scenario("runc", "python", "handler", 16, 2, 6)
+
+    result = asyncio.run(run())
+    assert result["errors"] == 0
+    assert result["cold"]["count"] == 2 and result["warm"]["count"] == 6
+    assert result["requests_per_second"] > 0
+    assert result["phases"]["release"]["count"] == 6
@@ -0,0 +1,93 @@
+from fastapi.testclient import TestClient
+
+from api.cache import FunctionCache, ResultCache, function_cache
+from api.main import app
+
+client = TestClient(app)
+
+
+def make_func(func_id, route=None):
+    return {"id": func_id, "name": f"f{func_id}", "route": route or f"/fn/x/{func_id}", "code": ""}
+
+
+def test_lookup_by_id_and_route_with_lru_eviction():
+    cache = FunctionCache(max_size=2)
+    for func_id in (1, 2):
+        cache.put(make_func(func_id), cache.version)
+    assert cache.get_by_id(1)["name"] == "f1"
+    cache.put(make_func(3), cache.version)
+    assert cache.get_by_id(2) is None
+    assert cache.get_by_route("/fn/x/1")["id"] == 1
+    assert cache.get_by_route("/fn/x/2") is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["size"]) == (2, 2, 2)
+
+
+def test_reads_racing_an_invalidation_are_not_cached():
+    cache = FunctionCache()
+    version = cache.version
+    cache.invalidate(1)
+    cache.put(make_func(1), version)
+    assert cache.get_by_id(1) is None
+
+
+def test_update_and_delete_invalidate_cached_definitions():
+    created = client.post("/functions/", json={"name": "cached", "language": "python", "code": "print(1)", "timeout": 5}).json()
+    assert client.get(f"/functions/{created['id']}").json()["code"] == "print(1)"
+    assert function_cache.get_by_id(created["id"]) is not None
+    update = {"name": "cached", "language": "python", "code": "print(2)", "timeout": 5, "route": "renamed"}
+    client.put(f"/functions/{created['id']}", json=update)
+    assert client.get(f"/functions/{created['id']}").json()["code"] == "print(2)"
+    client.delete(f"/functions/{created['id']}")
+    assert client.get(f"/functions/{created['id']}").status_code == 404
+
+
+def test_result_cache_is_bounded_expires_and_persists(tmp_path):
+    func = {"id": 1, "code": "def handler(event): return event"}
+    cache = ResultCache(max_size=2, max_bytes=100, ttl=60, directory=str(tmp_path))
+    key = ResultCache.key(func, {"a": 1, "b": 2})
+    assert ResultCache.key(func, {"b": 2, "a": 1}) == key
+    assert ResultCache.key(dict(func, code="changed"), {"a": 1, "b": 2}) != key
+    cache.put(key, "first")
+    cache.put(ResultCache.key(func, 2), "second")
+    cache.put(ResultCache.key(func, 3), "x" * 90)
+    assert cache.stats()["evictions"] == 1 and cache.stats()["bytes"] == 96
+
+    # Evicted entries are deleted on disk too; the rest survive a restart
+    assert cache.get(key) is None and len(list(tmp_path.iterdir())) == 2
+    assert ResultCache(directory=str(tmp_path)).get(ResultCache.key(func, 2)) == "second"
+    cache.invalidate(1)
+    assert cache.get(ResultCache.key(func, 2)) is None and not list(tmp_path.iterdir())
+
+    # Expired files are deleted when read, and at startup
+    expired = ResultCache(ttl=0, directory=str(tmp_path))
+    expired.put(key, "stale")
+    expired.put(ResultCache.key(func, 2), "stale")
+    assert expired.get(key) is None and len(list(tmp_path.iterdir())) == 1
+    ResultCache(directory=str(tmp_path))
+    assert not list(tmp_path.iterdir())
+
+    expiring = ResultCache(ttl=0, directory="")
+    expiring.put(key, "stale")
+    assert expiring.get(key) is None
+
+
+def test_cacheable_functions_skip_execution_until_updated(monkeypatch):
+    from api import execution
+
+    calls = []
+
+    async def fake_execute(self, func_data, payload, run):
+        calls.append(payload)
+        return f"v{len(calls)}", 0.01, None, {}
+
+    monkeypatch.setattr(execution.ExecutionEngine, "_execute", fake_execute)
+    func = {"name": "pure", "language": "python", "code": "print(1)", "timeout": 5, "cacheable": True}
+    created = client.post("/functions/", json=func).json()
+    assert created["cacheable"] is True
+    for _ in range(2):
+        assert client.post(f"/execute/{created['id']}", json={"x": 1}).json() == {"result": "v1"}
+    assert len(calls) == 1
+    client.put(f"/functions/{created['id']}", json=dict(func, code="print(2)"))
+    assert client.post(f"/execute/{created['id']}", json={"x": 1}).json() == {"result": "v2"}
+    assert client.get("/metrics/cache").json()["results"]["hits"] >= 1
@@ -0,0 +1,135 @@
+import time
+
+from sqlalchemy import create_engine, text
+from fastapi.testclient import TestClient
+
+from api import config, crud, execution
+from api.cache import function_cache, result_cache
+from api.cluster import Cluster
+from api.main import app
+from api.models import FunctionChange, SessionLocal, create_schema
+from tests.fakes import FakeDockerClient
+
+client = TestClient(app)
+
+SCRIPT = {"name": "clustered", "language": "python", "code": "print(1)", "timeout": 5}
+
+
+def make_node(node_id, url=""):
+    engine = execution.ExecutionEngine(client=FakeDockerClient())
+    cluster = Cluster(engine, node_id=node_id, url=url, interval=3600)
+    cluster.start()
+    return engine, cluster
+
+
+def stop(engine, cluster):
+    cluster.shutdown()
+    engine.shutdown()
+
+
+def test_changes_from_other_nodes_invalidate_cached_functions():
+    engine, cluster = make_node(config.NODE_ID)
+    try:
+        with SessionLocal() as db:
+            func = crud.create_function(db, SCRIPT)
+            cluster.apply_changes()
+            # This process wrote the change itself, so its cached copy stays
+            assert function_cache.get_by_id(func["id"]) is not None
+            db.add(FunctionChange(function_id=func["id"], kind="updated", node="node-b", at=time.time()))
+            db.commit()
+        assert cluster.apply_changes() == 1
+        assert function_cache.get_by_id(func["id"]) is None
+    finally:
+        stop(engine, cluster)
+
+
+def test_changes_committed_out_of_id_order_are_still_applied():
+    engine, cluster = make_node(config.NODE_ID)
+    try:
+        with SessionLocal() as db:
+            func = crud.create_function(db, SCRIPT)
+            cluster.apply_changes()
+            late = cluster.cursor + 1
+            # The later id commits first; the earlier one lands after the cursor has passed it
+            db.add(FunctionChange(id=late + 1, function_id=0, kind="updated", node="node-b", at=time.time()))
+            db.commit()
+            assert cluster.apply_changes() == 1 and cluster.gaps.keys() == {late}
+            assert function_cache.get_by_id(func["id"]) is not None
+            db.add(FunctionChange(id=late, function_id=func["id"], kind="updated", node="node-b", at=time.time()))
+            db.commit()
+        assert cluster.apply_changes() == 1 and not cluster.gaps
+        assert function_cache.get_by_id(func["id"]) is None
+    finally:
+        stop(engine, cluster)
+
+
+def test_invocations_are_dispatched_to_a_peer_with_a_warm_container():
+    warm_engine, warm = make_node("warm", url="http://warm:8000")
+    cold_engine, cold = make_node("cold")
+    func = dict(SCRIPT, id=1, memory_mb=256)
+    try:
+        warm_engine.pool.prewarm(warm_engine.pool_key(func), 1)
+        warm.sync()
+        cold.sync()
+        assert {n["id"] for n in cold.nodes()} >= {"warm", "cold"}
+        assert cold.pick_node(func)["id"] == "warm"
+        # Nodes with a warm container of their own, or peers without one, keep the call
+        assert warm.pick_node(func) is None
+        assert cold.pick_node(dict(func, code="print(2)", memory_mb=512)) is None
+    finally:
+        stop(cold_engine, cold)
+        stop(warm_engine, warm)
+    assert not [n for n in Cluster(None).nodes() if n["id"] in ("warm", "cold")]
+
+
+def test_forwarded_requests_are_proxied_and_never_forwarded_twice(monkeypatch):
+    class Peer:
+        def pick_node(self, func_data):
+            return {"id": "peer", "url": "http://peer:8000"}
+
+        def forward(self, node, path, query, body, headers):
+            assert path.startswith("/fn/") and body == b'{"x": 1}'
+            return 200, b'{"result": "remote"}', "application/json"
+
+    async def fake_execute(func_data, payload):
+        return "local", 0.01, None, {}
+
+    monkeypatch.setattr("api.main.get_cluster", lambda: Peer())
+    monkeypatch.setattr("api.main.execute_function", fake_execute)
+    created = client.post("/functions/", json=dict(SCRIPT, route="forwarded")).json()
+    assert client.post(created["route"], json={"x": 1}).json() == {"result": "remote"}
+    forwarded = client.post(created["route"], json={"x": 1}, headers={"X-Forwarded-Node": "peer"})
+    assert forwarded.json() == {"result": "local"}
+    client.delete(f"/functions/{created['id']}")
+
+
+def test_cached_results_are_served_locally_instead_of_forwarded(monkeypatch):
+    class Peer:
+        def pick_node(self, func_data):
+            return {"id": "peer", "url": "http://peer:8000"}
+
+        def forward(self, node, path, query, body, headers):
+            return 200, b'{"result": "remote"}', "application/json"
+
+    monkeypatch.setattr("api.main.get_cluster", lambda: Peer())
+    created = client.post("/functions/", json=dict(SCRIPT, route="cached", cacheable=True)).json()
+    result_cache.put(result_cache.key(created, {"x": 1}), "cached")
+    assert client.post(created["route"], json={"x": 1}).json() == {"result": "cached"}
+    assert client.post(created["route"], json={"x": 2}).json() == {"result": "remote"}
+    client.delete(f"/functions/{created['id']}")
+
+
+def test_change_ids_are_not_reused_after_a_prune(tmp_path):
+    old = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with old.begin() as connection:
+        connection.execute(text("CREATE TABLE function_changes (id INTEGER PRIMARY KEY, function_id INTEGER, "
+                                "kind VARCHAR, node VARCHAR, at FLOAT)"))
+        connection.execute(text("INSERT INTO function_changes (function_id, kind, at) VALUES (1, 'created', 0), "
+                                "(1, 'updated', 0), (1, 'deleted', 0)"))
+    create_schema(old)
+    with old.begin() as connection:
+        assert connection.execute(text("SELECT count(*) FROM function_changes")).scalar() == 3
+        connection.execute(text("DELETE FROM function_changes"))
+        connection.execute(text("INSERT INTO function_changes (function_id, kind, at) VALUES (2, 'created', 0)"))
+        assert connection.execute(text("SELECT id FROM function_changes")).scalar() == 4
+    old.dispose()
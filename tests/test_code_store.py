@@ -0,0 +1,149 @@
+import asyncio
+import threading
+import time
+
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+
+from api import execution
+from api.code_store import CodeStore, blob_hash
+from api.main import app
+from api.migrate import upgrade
+from api.models import CodeBlob, Function, FunctionVersion, SessionLocal
+from tests.fakes import FakeDockerClient
+
+client = TestClient(app)
+
+
+def test_blobs_are_deduplicated_and_large_code_is_compressed():
+    store = CodeStore(compress_min=1024)
+    big = "print('x')\n" * 500
+    with SessionLocal() as db:
+        assert store.put(db, big) == blob_hash(big)
+        db.commit()
+        assert store.put(db, big) == blob_hash(big)
+        db.commit()
+        blob = db.get(CodeBlob, blob_hash(big))
+        assert blob.compressed and len(blob.data) < blob.size == len(big)
+        assert db.query(CodeBlob).filter(CodeBlob.hash == blob_hash(big)).count() == 1
+        assert CodeStore().get(db, blob_hash(big)) == big
+
+
+def test_concurrent_puts_of_the_same_code_do_not_conflict():
+    code = f"print({time.time()!r})"
+    first, second = SessionLocal(), SessionLocal()
+    errors = []
+
+    def racing_put():
+        # Misses the first session's uncommitted blob, then waits on its write lock
+        try:
+            CodeStore().put(second, code)
+            second.commit()
+        except Exception as e:
+            errors.append(e)
+
+    try:
+        CodeStore().put(first, code)
+        racer = threading.Thread(target=racing_put)
+        racer.start()
+        time.sleep(0.2)
+        first.commit()
+        racer.join(10)
+        assert not errors
+        assert first.query(CodeBlob).filter(CodeBlob.hash == blob_hash(code)).count() == 1
+    finally:
+        first.close()
+        second.close()
+
+
+def test_updates_create_versions_that_can_be_pinned_and_rolled_back(monkeypatch):
+    ran = []
+
+    async def fake_execute(func_data, payload):
+        ran.append(func_data["code"])
+        return "ok", 0.01, None, {}
+
+    monkeypatch.setattr("api.main.execute_function", fake_execute)
+    func = {"name": "versioned", "language": "python", "code": "print(1)", "timeout": 5, "route": "v"}
+    created = client.post("/functions/", json=func).json()
+    assert created["version"] == 1
+    assert client.put(f"/functions/{created['id']}", json=dict(func, code="print(2)")).json()["version"] == 2
+    # Saving unchanged code and dependencies does not make a new version
+    assert client.put(f"/functions/{created['id']}", json=dict(func, code="print(2)", timeout=9)).json()["version"] == 2
+    versions = client.get(f"/functions/{created['id']}/versions").json()
+    assert [v["version"] for v in versions] == [2, 1] and "code" not in versions[0]
+    assert client.get(f"/functions/{created['id']}/versions/1").json()["code"] == "print(1)"
+
+    client.post(f"/execute/{created['id']}", json={}, params={"version": 1})
+    client.post(created["route"], json={})
+    assert ran == ["print(1)", "print(2)"]
+    assert client.post(f"/execute/{created['id']}", json={}, params={"version": 7}).status_code == 404
+
+    rolled_back = client.post(f"/functions/{created['id']}/versions/1/activate").json()
+    assert (rolled_back["version"], rolled_back["code"]) == (1, "print(1)")
+    assert client.get(f"/functions/{created['id']}").json()["code"] == "print(1)"
+    assert client.put(f"/functions/{created['id']}", json=dict(func, code="print(3)")).json()["version"] == 3
+    client.delete(f"/functions/{created['id']}")
+    assert client.get(f"/functions/{created['id']}/versions").status_code == 404
+
+
+def test_scripts_are_copied_into_their_container_once():
+    engine = execution.ExecutionEngine(client=FakeDockerClient())
+    func = {"id": 1, "language": "python", "code": "print('copied')", "timeout": 5}
+    try:
+        for _ in range(2):
+            assert asyncio.run(engine.execute(func, {}))[0] == "copied\n"
+            engine.flush()
+        [container] = engine.client.containers.created
+        assert container.archives == 1
+        commands = [spec["cmd"] for spec in engine.client.api.execs.values()]
+        assert all("-c" not in cmd and cmd[-1].endswith(".py") for cmd in commands)
+    finally:
+        engine.shutdown()
+
+
+def test_databases_with_inline_code_are_upgraded(tmp_path):
+    legacy = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    with legacy.begin() as connection:
+        # The functions table as it was before versions and the code store
+        connection.execute(text("CREATE TABLE functions (id INTEGER PRIMARY KEY, name VARCHAR, language VARCHAR, "
+                                "code VARCHAR, timeout INTEGER, route VARCHAR UNIQUE, runtime VARCHAR)"))
+        connection.execute(text("INSERT INTO functions VALUES (1, 'old', 'python', 'print(1)', 5, '/old', 'runc')"))
+    upgrade(legacy)
+    upgrade(legacy)
+    with Session(legacy) as db:
+        func = db.get(Function, 1)
+        assert (func.version, func.code_hash) == (1, blob_hash("print(1)"))
+        assert CodeStore().get(db, func.code_hash) == "print(1)"
+        assert db.query(FunctionVersion).filter(FunctionVersion.function_id == 1).count() == 1
+    legacy.dispose()
+
+
+def test_workers_upgrading_at_once_do_not_fail(tmp_path):
+    url = f"sqlite:///{tmp_path / 'legacy.db'}"
+    legacy = create_engine(url)
+    with legacy.begin() as connection:
+        connection.execute(text("CREATE TABLE functions (id INTEGER PRIMARY KEY, name VARCHAR, language VARCHAR, "
+                                "code VARCHAR, timeout INTEGER, route VARCHAR UNIQUE, runtime VARCHAR)"))
+        connection.execute(text("INSERT INTO functions VALUES (1, 'old', 'python', 'print(1)', 5, '/old', 'runc')"))
+    # Each worker has its own engine, as separate processes would
+    engines = [create_engine(url, connect_args={"timeout": 5}) for _ in range(4)]
+    errors = []
+
+    def run(bind):
+        try:
+            upgrade(bind)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=(bind,)) for bind in engines]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    with Session(legacy) as db:
+        assert db.query(FunctionVersion).filter(FunctionVersion.function_id == 1).count() == 1
+    for bind in engines + [legacy]:
+        bind.dispose()
@@ -0,0 +1,61 @@
+from api.container_pool import ContainerPool
+from tests.fakes import FakeDockerClient
+
+
+def make_pool(**kwargs):
+    return ContainerPool(FakeDockerClient(), **kwargs)
+
+
+def test_release_returns_container_to_pool_for_reuse():
+    pool = make_pool()
+    first = pool.acquire("func-python:latest", 30)
+    pool.release(first)
+    second = pool.acquire("func-python:latest", 30)
+    assert second is first
+    assert len(pool.client.containers.created) == 1
+
+
+def test_pool_is_keyed_by_image_runtime_and_limits():
+    pool = make_pool()
+    entry = pool.acquire("func-python:latest", 30)
+    pool.release(entry)
+    other = pool.acquire("func-python:latest", 30, runtime="runsc")
+    assert other is not entry
+    assert pool.idle_count(entry.key) == 1
+
+
+def test_unhealthy_and_non_reusable_containers_are_removed():
+    pool = make_pool()
+    entry = pool.acquire("func-js:latest", 30)
+    pool.release(entry)
+    entry.container.status = "exited"
+    fresh = pool.acquire("func-js:latest", 30)
+    assert fresh is not entry and entry.container.removed
+    pool.release(fresh, reusable=False)
+    assert fresh.container.removed
+    assert pool.idle_count(fresh.key) == 0
+
+
+def test_max_idle_and_max_uses_bound_the_pool():
+    pool = make_pool(max_idle=1, max_uses=2)
+    a = pool.acquire("func-python:latest", 30)
+    b = pool.acquire("func-python:latest", 30)
+    pool.release(a)
+    pool.release(b)
+    assert pool.idle_count(a.key) == 1 and b.container.removed
+    again = pool.acquire("func-python:latest", 30)
+    pool.release(again)
+    assert again.container.removed
+
+
+def test_evict_idle_respects_ttl_and_min_idle():
+    pool = make_pool(idle_ttl=10)
+    key = ContainerPool.make_key("func-python:latest")
+    pool.configure(key, min_idle=1)
+    assert pool.prewarm(key, 3) == 3
+    for entry in pool.idle[key]:
+        entry.last_used -= 60
+    assert pool.evict_idle() == 2
+    assert pool.idle_count(key) == 1
+    pool.shutdown()
+    assert pool.idle_count(key) == 0
@@ -0,0 +1,186 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from api import execution
+from tests.fakes import FakeDockerClient
+
+
+def test_engine_is_shared_and_torn_down_cleanly():
+    execution.shutdown_engine()
+    client = FakeDockerClient()
+    engine = execution.init_engine(client=client)
+    try:
+        assert execution.get_engine() is engine
+        func = {"id": 1, "language": "python", "code": "print(1)", "timeout": 5, "runtime": "runc"}
+        asyncio.run(execution.execute_function(func, {}))
+        engine.flush()
+        asyncio.run(execution.execute_function(func, {}))
+        assert len(client.containers.created) == 1
+    finally:
+        execution.shutdown_engine()
+    assert client.closed
+    assert client.containers.created[0].removed
+    assert execution._engine is None
+
+
+def test_release_happens_in_the_background():
+    client = FakeDockerClient()
+    engine = execution.ExecutionEngine(client=client)
+    release = engine.pool.release
+    started = threading.Event()
+    unblock = threading.Event()
+
+    def slow_release(entry, reusable=True):
+        started.set()
+        unblock.wait(5)
+        release(entry, reusable)
+
+    engine.pool.release = slow_release
+    func = {"id": 1, "language": "python", "code": "print(1)", "timeout": 5, "runtime": "runc"}
+    try:
+        result, _, errors, _ = asyncio.run(engine.execute(func, {}))
+        assert errors is None
+        assert started.wait(5) and not unblock.is_set()
+        unblock.set()
+        engine.flush()
+        assert sum(len(q) for q in engine.pool.idle.values()) == 1
+    finally:
+        unblock.set()
+        engine.shutdown()
+
+
+def test_capacity_is_not_held_while_docker_stats_are_sampled():
+    client = FakeDockerClient()
+    engine = execution.ExecutionEngine(client=client)
+    sample = engine.sampler.sample
+    used = []
+
+    def slow_sample(container, allow_api=True):
+        if allow_api:
+            used.append(engine.admission.stats()["memory_mb"]["used"])
+        return sample(container, allow_api)
+
+    engine.sampler.sample = slow_sample
+    func = {"id": 1, "language": "python", "code": "print(1)", "timeout": 5, "runtime": "runc", "memory_mb": 256}
+    try:
+        assert asyncio.run(engine.execute(func, {}))[2] is None
+        engine.flush()
+        assert used and not any(used)
+    finally:
+        engine.shutdown()
+
+
+def test_payload_is_streamed_to_stdin_with_stdout_and_stderr_demuxed():
+    engine = execution.ExecutionEngine(client=FakeDockerClient())
+    code = ("import sys\ndata = sys.stdin.buffer.read()\nsys.stderr.write('noise')\n"
+            "print(len(data), data[:2].hex())\n")
+    func = {"id": 1, "language": "python", "code": code, "timeout": 5, "runtime": "runc"}
+    try:
+        payload = bytes([0, 255]) + b"x" * (3 * 1024 * 1024)
+        result, _, errors, _ = asyncio.run(engine.execute(func, payload))
+        assert errors is None
+        assert result == f"{len(payload)} 00ff\n"
+        with pytest.raises(execution.PayloadTooLarge):
+            asyncio.run(engine.execute(func, b"x" * (execution.config.MAX_PAYLOAD_BYTES + 1)))
+    finally:
+        engine.shutdown()
+
+
+def test_oneshot_function_is_killed_at_its_deadline():
+    engine = execution.ExecutionEngine(client=FakeDockerClient())
+    func = {"id": 1, "language": "python", "code": "import time\ntime.sleep(10)", "timeout": 1, "runtime": "runc"}
+    try:
+        _, elapsed, errors, _ = asyncio.run(engine.execute(func, {}))
+        assert errors == execution.TIMEOUT_ERROR and elapsed < 3
+    finally:
+        engine.shutdown()
+
+
+def test_sigkill_before_the_deadline_is_not_reported_as_a_timeout():
+    engine = execution.ExecutionEngine(client=FakeDockerClient())
+    func = {"id": 1, "language": "python", "code": "import os, signal\nos.kill(os.getpid(), signal.SIGKILL)",
+            "timeout": 5, "runtime": "runc"}
+    try:
+        _, _, errors, _ = asyncio.run(engine.execute(func, {}))
+        assert errors == execution.KILLED_ERROR
+    finally:
+        engine.shutdown()
+
+
+def test_every_execution_is_recorded_with_phase_timings():
+    engine = execution.ExecutionEngine(client=FakeDockerClient())
+    route = "/fn/metrics/recorded"
+    func = {"id": 42, "route": route, "language": "python", "code": "print(1)", "timeout": 5, "runtime": "runc"}
+    try:
+        asyncio.run(engine.execute(func, {}))
+        record = execution.metrics.get_metrics(route)[-1]
+        assert record["function_id"] == 42 and record["exit_code"] == 0 and not record["timeout"]
+        assert {"queue_wait", "acquire", "exec", "total"} <= set(record["phases"])
+    finally:
+        engine.shutdown()
+
+
+def test_resource_usage_is_attached_to_the_metrics_record_after_release():
+    engine = execution.ExecutionEngine(client=FakeDockerClient())
+    route = "/fn/metrics/resources"
+    func = {"id": 43, "route": route, "language": "python", "code": "print(1)", "timeout": 5, "runtime": "runc"}
+    try:
+        asyncio.run(engine.execute(func, {}))
+        engine.flush()
+        record = execution.metrics.get_metrics(route)[-1]
+        assert record["resources"]["cpu_seconds"] > 0
+        assert record["resources"]["memory_peak_bytes"] == 4 << 20
+        summary = execution.metrics.summary(route)[route]["resources"]
+        assert summary["cpu_seconds"]["max"] == record["resources"]["cpu_seconds"]
+    finally:
+        engine.shutdown()
+
+
+def test_batch_runs_payloads_across_a_bounded_set_of_containers():
+    client = FakeDockerClient()
+    engine = execution.ExecutionEngine(client=client)
+    code = "def handler(event):\n    if event == 3:\n        raise ValueError('bad item')\n    return event * 2\n"
+    func = {"id": 7, "language": "python", "code": code, "timeout": 5, "runtime": "runc", "route": "/fn/batch/x",
+            "entrypoint": "handler"}
+
+    async def collect():
+        return [item async for item in engine.execute_batch(func, list(range(10)), concurrency=2)]
+
+    try:
+        results = sorted(asyncio.run(collect()), key=lambda item: item["index"])
+        engine.flush()
+        assert [item["index"] for item in results] == list(range(10))
+        assert results[2]["result"] == "4" and results[2]["error"] is None
+        assert "bad item" in results[3]["error"] and results[3]["result"] is None
+        assert len(client.containers.created) <= 2
+        assert engine.admission.stats()["running"] == 0
+    finally:
+        engine.shutdown()
+
+
+def test_stream_forwards_stdout_before_the_function_exits():
+    engine = execution.ExecutionEngine(client=FakeDockerClient())
+    code = ("import sys, time\nprint('first', flush=True)\ntime.sleep(0.5)\n"
+            "sys.stderr.write('warn')\nprint('second')\nsys.exit(3)\n")
+    func = {"id": 1, "language": "python", "code": code, "timeout": 5, "runtime": "runc"}
+
+    async def collect():
+        events = []
+        start = time.time()
+        async for kind, value in engine.execute_stream(func, {}):
+            events.append((kind, value, time.time() - start))
+        return events
+
+    try:
+        events = asyncio.run(collect())
+        engine.flush()
+        assert events[0][0] == "stdout" and events[0][1].startswith(b"first") and events[0][2] < 0.4
+        assert b"".join(v for k, v, _ in events if k == "stdout") == b"first\nsecond\n"
+        assert events[-2][:2] == ("stderr", b"warn")
+        assert events[-1][1]["exit_code"] == 3 and events[-1][1]["error"] == "warn"
+        assert engine.admission.stats()["running"] == 0
+    finally:
+        engine.shutdown()
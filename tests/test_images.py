@@ -0,0 +1,55 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+from api import execution
+from api.images import ImageBuilder, image_tag, normalise_dependencies
+from api.main import app
+from tests.fakes import FakeDockerClient
+
+client = TestClient(app)
+
+
+def test_equivalent_dependency_sets_share_one_image():
+    a = normalise_dependencies("python", ["requests==2.31.0", "numpy", "# comment", ""])
+    b = normalise_dependencies("python", "numpy\nrequests==2.31.0\n")
+    assert a == b == "numpy\nrequests==2.31.0\n"
+    assert normalise_dependencies("javascript", {"lodash": "^4"}) == normalise_dependencies(
+        "javascript", '{"name": "x", "dependencies": {"lodash": "^4"}}')
+    assert normalise_dependencies("python", []) is None
+    with pytest.raises(ValueError):
+        normalise_dependencies("javascript", ["lodash"])
+
+    docker_client = FakeDockerClient()
+    builder = ImageBuilder(docker_client)
+    tag = builder.ensure("python", a)
+    assert builder.ensure("python", b) == tag == image_tag("python", a)
+    [(built, files)] = docker_client.images.builds
+    assert built == tag and files["requirements.txt"] == a
+    assert files["Dockerfile"].startswith("FROM func-python:latest")
+
+
+def test_pool_launches_the_dependency_image():
+    engine = execution.ExecutionEngine(client=FakeDockerClient())
+    try:
+        func = asyncio.run(engine.prepare({"id": 1, "language": "python", "code": "print(1)", "timeout": 5,
+                                           "dependencies": ["six"]}))
+        assert func["image"].startswith("func-deps:python-")
+        asyncio.run(engine.execute(func, {}))
+        engine.flush()
+        assert engine.client.containers.created[0].image == func["image"]
+    finally:
+        engine.shutdown()
+
+
+def test_dependencies_are_built_on_deploy_and_kept_on_update():
+    func = {"name": "deps", "language": "javascript", "code": "console.log(1)", "timeout": 5,
+            "dependencies": {"dependencies": {"lodash": "^4.17.21"}}}
+    created = client.post("/functions/", json=func).json()
+    assert created["image"].startswith("func-deps:javascript-")
+    func.pop("dependencies")
+    updated = client.put(f"/functions/{created['id']}", json=func).json()
+    assert updated["image"] == created["image"]
+    bad = client.post("/functions/", json=dict(func, dependencies=["lodash"]))
+    assert bad.status_code == 400
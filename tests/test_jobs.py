@@ -0,0 +1,101 @@
+import asyncio
+import time
+
+from fastapi.testclient import TestClient
+
+from api import crud, execution
+from api.jobs import JobQueue
+from api.main import app
+from api.models import Job, Node, SessionLocal
+
+client = TestClient(app)
+
+
+def deploy(code, entrypoint="script"):
+    return client.post("/functions/", json={"name": "job", "language": "python", "code": code, "timeout": 5,
+                                            "entrypoint": entrypoint}).json()
+
+
+def drain(queue):
+    async def run():
+        while await queue.process_next():
+            pass
+
+    asyncio.run(run())
+
+
+def test_async_invocation_is_queued_and_polled_until_done():
+    func = deploy("def handler(event):\n    return event['n'] + 1\n", "handler")
+    response = client.post(f"/execute/{func['id']}?mode=async", json={"n": 41})
+    assert response.status_code == 202
+    job_id = response.json()["job_id"]
+    assert client.get(f"/jobs/{job_id}").json()["status"] == "queued"
+
+    drain(JobQueue())
+    execution.get_engine().flush()
+    job = client.get(f"/jobs/{job_id}").json()
+    assert job["status"] == "succeeded" and job["result"] == "42" and job["attempts"] == 1
+    assert client.get("/jobs/missing").status_code == 404
+
+
+def test_failing_jobs_are_retried_then_marked_failed_and_expire():
+    func = deploy("def handler(event):\n    raise RuntimeError('boom')\n", "handler")
+    with SessionLocal() as db:
+        job_id = crud.create_job(db, func["id"], {}, 2)["id"]
+    queue = JobQueue(retry_backoff=0, result_ttl=0)
+    drain(queue)
+    with SessionLocal() as db:
+        job = crud.get_job(db, job_id)
+    assert job["status"] == "failed" and job["attempts"] == 2 and "boom" in job["error"]
+    queue.expire()
+    with SessionLocal() as db:
+        assert crud.get_job(db, job_id) is None
+
+
+def test_unexpected_errors_fail_the_attempt_instead_of_leaving_the_job_running(monkeypatch):
+    async def broken_execute(func_data, payload):
+        raise RuntimeError("engine exploded")
+
+    func = deploy("print(1)")
+    monkeypatch.setattr(execution.get_engine(), "execute", broken_execute)
+    with SessionLocal() as db:
+        job_id = crud.create_job(db, func["id"], {}, 2)["id"]
+    drain(JobQueue(retry_backoff=0))
+    with SessionLocal() as db:
+        job = crud.get_job(db, job_id)
+    assert job["status"] == "failed" and job["attempts"] == 2 and job["error"] == "engine exploded"
+
+
+def test_interrupted_jobs_are_requeued_on_start():
+    func = deploy("print(1)")
+    with SessionLocal() as db:
+        job_id = crud.create_job(db, func["id"], {}, 3)["id"]
+        db.query(Job).filter(Job.id == job_id).update({"status": "running"})
+        db.commit()
+    JobQueue().recover()
+    with SessionLocal() as db:
+        assert crud.get_job(db, job_id)["status"] == "queued"
+
+
+def test_only_jobs_of_stopped_nodes_are_recovered():
+    func = deploy("print(1)")
+    with SessionLocal() as db:
+        jobs = {node: crud.create_job(db, func["id"], {}, 3)["id"] for node in ("me", "alive", "gone")}
+        for node, job_id in jobs.items():
+            db.query(Job).filter(Job.id == job_id).update({"status": "running", "node": node})
+        db.merge(Node(id="me", heartbeat_at=time.time()))
+        db.merge(Node(id="alive", heartbeat_at=time.time()))
+        db.merge(Node(id="gone", heartbeat_at=time.time() - 60))
+        db.commit()
+    queue = JobQueue(node_id="me", node_ttl=10)
+    queue.recover(own=False)
+    with SessionLocal() as db:
+        assert [crud.get_job(db, jobs[node])["status"] for node in ("me", "alive", "gone")] == \
+            ["running", "running", "queued"]
+    queue.recover()
+    with SessionLocal() as db:
+        assert [crud.get_job(db, jobs[node])["status"] for node in ("me", "alive", "gone")] == \
+            ["queued", "running", "queued"]
+        db.query(Job).filter(Job.id == jobs["alive"]).delete()
+        db.query(Node).filter(Node.id.in_(tuple(jobs))).delete()
+        db.commit()
@@ -0,0 +1,68 @@
+import time
+
+from api.metrics import Histogram, Metrics
+
+
+def test_histogram_quantiles_are_within_bucket_error():
+    histogram = Histogram()
+    for i in range(1, 1001):
+        histogram.add(i / 1000)
+    assert abs(histogram.quantile(0.5) - 0.5) / 0.5 < 0.1
+    assert abs(histogram.quantile(0.99) - 0.99) / 0.99 < 0.1
+    assert histogram.count == 1000 and histogram.max == 1.0
+
+
+def test_records_are_bounded_per_route_but_aggregates_see_everything():
+    metrics = Metrics(buffer_size=10)
+    for i in range(100):
+        metrics.record("/fn/a/x", 0.01 * (i + 1), "boom" if i % 4 == 0 else None, {},
+                       function_id=1, phases={"acquire": 0.001, "exec": 0.01}, timeout=i == 0)
+    assert len(metrics.get_metrics("/fn/a/x")) == 10
+    summary = metrics.summary("/fn/a/x")["/fn/a/x"]
+    assert summary["count"] == 100
+    assert summary["error_rate"] == 0.25 and summary["timeouts"] == 1
+    assert summary["phases"]["total"]["p99"] > summary["phases"]["total"]["p50"]
+    assert metrics.get_metrics("/fn/missing/x") == []
+
+
+def test_time_window_filtering():
+    metrics = Metrics()
+    old = metrics.record("/fn/a/x", 1.0, None, {})
+    old["timestamp"] -= 120
+    metrics.record("/fn/a/x", 2.0, None, {})
+    assert [r["response_time"] for r in metrics.get_metrics(since=time.time() - 60)] == [2.0]
+    windowed = metrics.summary(window=60)["/fn/a/x"]
+    assert windowed["count"] == 1 and windowed["phases"]["total"]["p50"] == 2.0
+
+
+def test_series_buckets_and_cursor_only_return_new_points():
+    metrics = Metrics(bucket_seconds=10)
+    for route, response_time in (("/fn/a/x", 1.0), ("/fn/a/x", 3.0), ("/fn/b/y", 2.0)):
+        metrics.record(route, response_time, "boom" if response_time == 3.0 else None, {}, phases={"exec": 0.5})
+    series = metrics.series()
+    assert series["bucket"] == 10 and len(series["points"]) == 2
+    point = next(p for p in series["points"] if p["route"] == "/fn/a/x")
+    assert point["count"] == 2 and point["errors"] == 1 and point["mean"] == 2.0 and point["phases"]["exec"] == 0.5
+
+    # Polling from the cursor returns the (possibly still filling) last bucket and nothing older
+    record = metrics.record("/fn/a/x", 5.0, None, {})
+    later = metrics.series(route="/fn/a/x", since=series["cursor"])
+    assert [p["start"] for p in later["points"]] == [record["timestamp"] - record["timestamp"] % 10]
+    assert later["points"][0]["count"] in (1, 3)
+    assert metrics.series(route="/fn/a/x", since=time.time() + 60)["points"] == []
+
+    coarse = metrics.series(route="/fn/a/x", bucket=25)
+    assert coarse["bucket"] == 30 and sum(p["count"] for p in coarse["points"]) == 3
+
+
+def test_series_drops_buckets_past_retention():
+    metrics = Metrics(bucket_seconds=1, retention=5)
+    old = metrics.record("/fn/a/x", 1.0, None, {})
+    route_metrics = metrics.data["/fn/a/x"]
+    bucket = route_metrics.series.pop(old["timestamp"] - old["timestamp"] % 1)
+    bucket.start -= 60
+    route_metrics.series[bucket.start] = bucket
+    route_metrics.series.move_to_end(bucket.start, last=False)
+    metrics.record("/fn/a/x", 2.0, None, {})
+    assert [b.count for b in route_metrics.series.values()] == [1]
+    assert [p["mean"] for p in metrics.series()["points"]] == [2.0]
@@ -0,0 +1,67 @@
+from api.execution import ExecutionEngine
+from api.prewarm import PrewarmScheduler
+from tests.fakes import FakeDockerClient
+
+SCRIPT = {"id": 1, "language": "python", "code": "print(1)", "timeout": 5}
+HANDLER = {"id": 2, "language": "python", "code": "def handler(event):\n    return event\n", "timeout": 5,
+           "entrypoint": "handler"}
+
+
+def make_scheduler(**kwargs):
+    engine = ExecutionEngine(client=FakeDockerClient())
+    return engine, PrewarmScheduler(engine, interval=1, alpha=1.0, headroom=1.0, max_warm=4, **kwargs)
+
+
+def test_target_follows_invocation_rate():
+    engine, scheduler = make_scheduler()
+    try:
+        for _ in range(6):
+            scheduler.observe(SCRIPT, 0.5)
+        scheduler.tick()
+        key = engine.pool_key(SCRIPT)
+        assert scheduler.demand[1].target == 3
+        assert engine.pool.idle_count(key) == 3
+        scheduler.tick()
+        assert scheduler.demand[1].target == 0
+    finally:
+        engine.shutdown()
+
+
+def test_deploy_prewarms_loaded_workers_and_updates_release_old_versions():
+    engine, scheduler = make_scheduler()
+    try:
+        scheduler.prewarm(HANDLER)
+        old_key = engine.pool_key(HANDLER)
+        [entry] = engine.pool.idle[old_key]
+        assert entry.worker is not None and entry.worker.alive
+        updated = dict(HANDLER, code=HANDLER["code"] + "\n# v2\n")
+        scheduler.prewarm(updated)
+        scheduler.tick()
+        assert engine.pool.idle_count(engine.pool_key(updated)) == 1
+        # The old version is no longer kept warm but stays until its idle TTL, for rollbacks
+        assert engine.pool._limits(old_key)[0] == 0
+        assert engine.pool.idle_count(old_key) == 1 and not entry.container.removed
+    finally:
+        engine.shutdown()
+
+
+def test_scripts_are_prewarmed_with_their_code_copied_in():
+    engine, scheduler = make_scheduler()
+    try:
+        scheduler.prewarm(SCRIPT)
+        [entry] = engine.pool.idle[engine.pool_key(SCRIPT)]
+        assert entry.code_path.startswith("/opt/code/") and entry.container.archives == 1
+    finally:
+        engine.shutdown()
+
+
+def test_dormant_functions_scale_to_zero():
+    engine, scheduler = make_scheduler(idle_after=0)
+    try:
+        scheduler.prewarm(SCRIPT)
+        assert engine.pool.idle_count(engine.pool_key(SCRIPT)) == 1
+        scheduler.tick()
+        assert engine.pool.idle_count(engine.pool_key(SCRIPT)) == 0
+        assert 1 not in scheduler.demand
+    finally:
+        engine.shutdown()
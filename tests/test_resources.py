@@ -0,0 +1,42 @@
+import os
+
+from api.resources import ResourceSampler
+from tests.fakes import FakeContainer
+
+
+def write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(content)
+
+
+def test_cgroup_v2_counters_are_read_directly(tmp_path):
+    container = FakeContainer("func-python:latest")
+    scope = tmp_path / f"system.slice/docker-{container.id}.scope"
+    write(scope / "cpu.stat", "usage_usec 1500000\nuser_usec 1000000\n")
+    write(scope / "memory.current", "1048576\n")
+    write(scope / "memory.peak", "4194304\n")
+    write(scope / "io.stat", "8:0 rbytes=100 wbytes=50 rios=1 wios=1\n8:16 rbytes=10 wbytes=5\n")
+    sampler = ResourceSampler(client=None, cgroup_root=str(tmp_path))
+    before = sampler.sample(container, allow_api=False)
+    assert before == {"cpu_ns": 1500000000, "memory_bytes": 1048576, "memory_peak_bytes": 4194304,
+                      "io_read_bytes": 110, "io_write_bytes": 55}
+    write(scope / "cpu.stat", "usage_usec 2000000\n")
+    write(scope / "io.stat", "8:0 rbytes=300 wbytes=55\n")
+    usage = ResourceSampler.usage(before, sampler.sample(container))
+    assert usage["cpu_seconds"] == 0.5
+    assert (usage["io_read_bytes"], usage["io_write_bytes"]) == (190, 0)
+    assert usage["memory_peak_bytes"] == 4194304
+
+
+def test_cgroup_v1_counters_and_missing_cgroups(tmp_path):
+    container = FakeContainer("func-js:latest")
+    write(tmp_path / f"cpuacct/docker/{container.id}/cpuacct.usage", "250000000\n")
+    write(tmp_path / f"memory/docker/{container.id}/memory.usage_in_bytes", "2048\n")
+    write(tmp_path / f"memory/docker/{container.id}/memory.max_usage_in_bytes", "8192\n")
+    write(tmp_path / f"blkio/docker/{container.id}/blkio.throttle.io_service_bytes", "8:0 Read 7\n8:0 Write 3\nTotal 10\n")
+    sampler = ResourceSampler(client=None, cgroup_root=str(tmp_path))
+    usage = ResourceSampler.usage(None, sampler.sample(container))
+    assert usage == {"cpu_seconds": 0.25, "memory_peak_bytes": 8192, "memory_bytes": 2048,
+                     "io_read_bytes": 7, "io_write_bytes": 3}
+    assert sampler.sample(FakeContainer("func-js:latest"), allow_api=False) is None
@@ -0,0 +1,51 @@
+import asyncio
+
+from fastapi.testclient import TestClient
+
+from api import execution, tracing
+from api.main import app
+
+client = TestClient(app)
+
+
+def test_spans_are_noops_outside_a_trace():
+    with tracing.span("exec") as s:
+        pass
+    assert s is tracing._NO_SPAN
+    tracing.add_span("release", 0.0, 1.0)
+
+
+def test_spans_follow_the_trace_across_docker_threads():
+    engine = execution.get_engine()
+    trace = tracing.Trace("abc", "POST /test")
+    func = {"id": None, "language": "python", "code": "print(1)", "timeout": 5}
+
+    async def run():
+        token = tracing._current.set(trace)
+        try:
+            return await engine.execute(func, {})
+        finally:
+            tracing._current.reset(token)
+
+    asyncio.run(run())
+    engine.flush()
+    names = [span["name"] for span in trace.to_dict()["spans"]]
+    for name in ("admission", "queue_wait", "acquire", "container_create", "container_start", "exec", "decode", "release"):
+        assert name in names
+    assert names.index("queue_wait") < names.index("exec") < names.index("release")
+
+
+def test_requests_get_server_timing_and_a_queryable_trace():
+    created = client.post("/functions/", json={"name": "traced", "language": "python", "code": "print(1)",
+                                               "timeout": 5, "route": "traced"}).json()
+    response = client.post(created["route"], json={}, headers={"X-Request-ID": "req-1"})
+    assert response.status_code == 200
+    assert response.headers["x-request-id"] == "req-1"
+    timing = response.headers["server-timing"]
+    assert "route_resolve;dur=" in timing and "exec;dur=" in timing and "total;dur=" in timing
+
+    trace = client.get("/traces/req-1").json()
+    assert trace["name"] == f"POST {created['route']}" and trace["status"] == 200
+    assert [t["request_id"] for t in client.get("/traces/", params={"path": created["route"]}).json()] == ["req-1"]
+    assert client.get("/traces/missing").status_code == 404
+    client.delete(f"/functions/{created['id']}")
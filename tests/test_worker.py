@@ -0,0 +1,107 @@
+import asyncio
+
+import pytest
+
+from api import config
+from api.execution import TIMEOUT_ERROR, ExecutionEngine
+from api.worker import WorkerChannel, WorkerError
+from tests.fakes import FakeContainer, FakeDockerClient
+
+HANDLER = "def handler(event):\n    print('log line')\n    return {'doubled': event['n'] * 2}\n"
+
+
+def test_scripts_defining_a_handler_still_run_as_scripts():
+    # Only functions deployed with entrypoint "handler" get a worker, whatever the code looks like
+    engine = ExecutionEngine(client=FakeDockerClient())
+    code = "import json, sys\ndef handler(event):\n    return event['n'] * 2\nprint(handler(json.load(sys.stdin)))\n"
+    func = {"id": 1, "language": "python", "code": code, "timeout": 5, "runtime": "runc"}
+    try:
+        result, elapsed, errors, _ = asyncio.run(engine.execute(func, {"n": 4}))
+        assert (result, errors) == ("8\n", None) and elapsed < 5
+    finally:
+        engine.shutdown()
+
+
+def test_worker_load_is_bounded_by_the_function_timeout():
+    engine = ExecutionEngine(client=FakeDockerClient())
+    code = "import time\ntime.sleep(10)\ndef handler(event):\n    return event\n"
+    func = {"id": 1, "language": "python", "code": code, "timeout": 1, "runtime": "runc", "entrypoint": "handler"}
+    try:
+        _, elapsed, errors, _ = asyncio.run(engine.execute(func, {}))
+        assert errors == TIMEOUT_ERROR and elapsed < 3
+    finally:
+        engine.shutdown()
+
+
+def test_worker_loads_once_and_serves_many_calls():
+    worker = WorkerChannel(FakeDockerClient(), FakeContainer("func-python:latest"), "python", HANDLER)
+    try:
+        for n in range(3):
+            reply = worker.call({"n": n}, timeout=5)
+            assert reply["ok"] and reply["result"] == f'{{"doubled": {n * 2}}}'
+            assert reply["logs"] == "log line\n"
+        failed = worker.call({}, timeout=5)
+        assert not failed["ok"] and "KeyError" in failed["error"]
+    finally:
+        worker.close()
+
+
+def test_worker_awaits_async_handlers():
+    code = "import asyncio\nasync def handler(event):\n    await asyncio.sleep(0)\n    return event['n'] + 1\n"
+    worker = WorkerChannel(FakeDockerClient(), FakeContainer("func-python:latest"), "python", code)
+    try:
+        reply = worker.call({"n": 1}, timeout=5)
+        assert reply["ok"] and reply["result"] == "2"
+    finally:
+        worker.close()
+
+
+def test_worker_reports_load_failures():
+    with pytest.raises(WorkerError):
+        WorkerChannel(FakeDockerClient(), FakeContainer("func-python:latest"), "python", "def handler(:")
+
+
+def test_engine_pins_warm_worker_to_code_version():
+    engine = ExecutionEngine(client=FakeDockerClient())
+    func = {"id": 1, "language": "python", "code": HANDLER, "timeout": 5, "runtime": "runc", "entrypoint": "handler"}
+    try:
+        first = asyncio.run(engine.execute(func, {"n": 1}))
+        engine.flush()
+        second = asyncio.run(engine.execute(func, {"n": 2}))
+        assert first[0] == '{"doubled": 2}' and second[0] == '{"doubled": 4}'
+        assert len(engine.client.containers.created) == 1
+        engine.flush()
+        changed = dict(func, code=HANDLER.replace("* 2", "* 3"))
+        assert asyncio.run(engine.execute(changed, {"n": 2}))[0] == '{"doubled": 6}'
+        assert len(engine.client.containers.created) == 2
+    finally:
+        engine.shutdown()
+
+
+def test_handler_timeout_is_enforced_in_the_worker_and_keeps_it_warm():
+    engine = ExecutionEngine(client=FakeDockerClient())
+    code = "import time\ndef handler(event):\n    time.sleep(event['sleep'])\n    return 'done'\n"
+    func = {"id": 1, "language": "python", "code": code, "timeout": 1, "runtime": "runc", "entrypoint": "handler"}
+    try:
+        _, elapsed, errors, _ = asyncio.run(engine.execute(func, {"sleep": 10}))
+        assert errors == TIMEOUT_ERROR and elapsed < 3
+        engine.flush()
+        assert asyncio.run(engine.execute(func, {"sleep": 0}))[0] == "done"
+        assert len(engine.client.containers.created) == 1
+    finally:
+        engine.shutdown()
+
+
+def test_runaway_worker_is_abandoned_at_the_deadline_and_reaped(monkeypatch):
+    monkeypatch.setattr(config, "TIMEOUT_GRACE", 0.2)
+    engine = ExecutionEngine(client=FakeDockerClient())
+    code = ("import signal, time\ndef handler(event):\n"
+            "    signal.signal(signal.SIGALRM, signal.SIG_IGN)\n    time.sleep(10)\n")
+    func = {"id": 1, "language": "python", "code": code, "timeout": 1, "runtime": "runc", "entrypoint": "handler"}
+    try:
+        _, elapsed, errors, _ = asyncio.run(engine.execute(func, {}))
+        assert errors == TIMEOUT_ERROR and elapsed < 3
+        engine.flush()
+        assert engine.client.containers.created[0].removed
+    finally:
+        engine.shutdown()